@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from shop import images
+        from . import signals  # noqa: F401
+        from .models import CustomUser
+        images.register(CustomUser, 'profile_picture', widths=(128, 256))
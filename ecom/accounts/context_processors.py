@@ -0,0 +1,11 @@
+from django.utils.functional import SimpleLazyObject
+
+from .principal import get_principal
+
+
+def principal(request):
+    """
+    Expose ``principal``, the cached snapshot of the logged-in user, for the
+    navbar; unlike ``user`` it doesn't load the user row.
+    """
+    return {'principal': SimpleLazyObject(lambda: get_principal(request))}
@@ -1,19 +1,50 @@
-from django.http import HttpResponseForbidden
-from django.shortcuts import redirect
+from django.contrib.auth.views import redirect_to_login
+from django.http import HttpResponseForbidden, JsonResponse
+from django.views.decorators.csrf import csrf_exempt
 from functools import wraps
 
+from .models import ApiToken
+from .principal import get_principal
+
 def seller_required(view_func):
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
-        if not request.user.is_authenticated:
-            return redirect('login')
+        # The cached snapshot, so the check doesn't load the user row
+        principal = get_principal(request)
+        if not principal.is_authenticated:
+            return redirect_to_login(request.get_full_path())
         
-        # Check user_type directly from CustomUser model
-        if not hasattr(request.user, 'user_type') or request.user.user_type != 'seller':
+        if not getattr(principal, 'is_seller', False):
             return HttpResponseForbidden(
                 "You must be a registered seller to access this page. "
                 "Please contact support if you need seller privileges."
             )
         
         return view_func(request, *args, **kwargs)
-    return _wrapped_view
\ No newline at end of file
+    return _wrapped_view
+
+
+def api_token_required(view_func):
+    """
+    For endpoints called by sellers' systems rather than browsers: the
+    seller is whoever holds the ``ApiToken`` key sent as ``Authorization:
+    Bearer <key>``, and is set as ``request.api_user``. No cookies are
+    involved, so there is no CSRF check, and failures are JSON 401s and
+    403s a client can act on instead of a redirect to the login page.
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        scheme, _, key = request.headers.get('Authorization', '').partition(' ')
+        token = None
+        if scheme.lower() == 'bearer' and key:
+            token = ApiToken.objects.select_related('user').filter(digest=ApiToken.digest_of(key)).first()
+        if token is None:
+            response = JsonResponse({'errors': ['Send a valid API key as "Authorization: Bearer <key>".']}, status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        if not token.user.is_active or token.user.user_type != 'seller':
+            return JsonResponse({'errors': ['This API key does not belong to a seller.']}, status=403)
+
+        request.api_user = token.user
+        return view_func(request, *args, **kwargs)
+    return csrf_exempt(_wrapped_view)
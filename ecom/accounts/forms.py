@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.forms import UserCreationForm
 from .models import CustomUser
 from django.contrib.auth.forms import PasswordResetForm, SetPasswordForm
+from shop.images import DerivativesFormMixin
 
 class UserRegistrationForm(UserCreationForm):
     USER_TYPE_CHOICES = [
@@ -25,7 +26,7 @@ class LoginForm(forms.Form):
     username = forms.CharField(label="Username or Email")
     password = forms.CharField(widget=forms.PasswordInput)
     
-class ProfileUpdateForm(forms.ModelForm):
+class ProfileUpdateForm(DerivativesFormMixin, forms.ModelForm):
     class Meta:
         model = CustomUser
         fields = ['username', 'email', 'phone_number', 'address', 'profile_picture']
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import ApiToken, CustomUser
+
+
+class Command(BaseCommand):
+    help = "Give a seller a new API key for the inventory sync, revoking the old one"
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+
+    def handle(self, *args, **options):
+        user = CustomUser.objects.filter(username=options['username'], user_type='seller').first()
+        if user is None:
+            raise CommandError(f"No seller named {options['username']!r}")
+        self.stdout.write(ApiToken.issue(user))
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_customuser_address'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_picture_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+    ]
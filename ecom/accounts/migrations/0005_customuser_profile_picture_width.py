@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_apitoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='customuser',
+            name='profile_picture_width',
+            field=models.PositiveIntegerField(editable=False, null=True),
+        ),
+    ]
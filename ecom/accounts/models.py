@@ -1,3 +1,6 @@
+import hashlib
+import secrets
+
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 
@@ -13,6 +16,33 @@ class CustomUser(AbstractUser):
     )
     phone_number = models.CharField(max_length=20, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True)
+    profile_picture_hash = models.CharField(max_length=64, blank=True, editable=False)
+    profile_picture_width = models.PositiveIntegerField(null=True, editable=False)
     address = models.TextField(blank=True)
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
+
+
+class ApiToken(models.Model):
+    """
+    A seller's key for the endpoints their own systems call, such as the
+    inventory sync. Only a digest of the key is stored; ``issue`` returns
+    the key itself once.
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, related_name='api_token')
+    digest = models.CharField(max_length=64, unique=True, editable=False)
+    issued = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'API key of {self.user}'
+
+    @staticmethod
+    def digest_of(key):
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    @classmethod
+    def issue(cls, user):
+        """Give ``user`` a new key, replacing the old one; return the key."""
+        key = secrets.token_urlsafe(32)
+        cls.objects.update_or_create(user=user, defaults={'digest': cls.digest_of(key)})
+        return key
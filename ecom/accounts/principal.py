@@ -0,0 +1,103 @@
+"""
+A small cached snapshot of the logged-in user.
+
+``AuthenticationMiddleware`` loads the whole ``CustomUser`` row (address,
+profile picture and all) the first time ``request.user`` is touched, and
+the navbar, the cart badge and ``seller_required`` touched it on every
+page. They only need to know who is logged in and whether they sell, so
+they read ``get_principal(request)`` instead: a ``Principal`` with the id,
+username, type and flags, kept in the cache under the user's id. A warm
+request costs one cache lookup and no SQL; ``request.user`` is still there,
+and still lazy, for views that need the model.
+
+The snapshot keeps the session auth hash of the user it was taken from.
+When the session's hash doesn't match (the password changed) or there is
+no snapshot, Django's own ``get_user`` decides, so stale sessions are
+flushed exactly as before, and the snapshot is taken again from the user
+it loads. ``accounts.signals`` drops the entry whenever a user is saved
+(``ProfileUpdateForm``, password changes, logins) or deleted.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.middleware import get_user
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+
+KEY = 'accounts:principal:{id}'
+CACHE_TIMEOUT = 60 * 60
+
+
+class Principal:
+    """What pages need to know about the logged-in user."""
+
+    __slots__ = ('id', 'username', 'user_type', 'is_active', 'is_staff', 'is_superuser', 'session_hash')
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, username, user_type, is_active, is_staff, is_superuser, session_hash):
+        self.id = id
+        self.username = username
+        self.user_type = user_type
+        self.is_active = is_active
+        self.is_staff = is_staff
+        self.is_superuser = is_superuser
+        self.session_hash = session_hash
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            user.id, user.username, user.user_type, user.is_active,
+            user.is_staff, user.is_superuser, user.get_session_auth_hash(),
+        )
+
+    @property
+    def pk(self):
+        return self.id
+
+    @property
+    def is_seller(self):
+        return self.user_type == 'seller'
+
+    def get_username(self):
+        return self.username
+
+    def __str__(self):
+        return self.username
+
+
+def invalidate_principal(user_id):
+    cache.delete(KEY.format(id=user_id))
+
+
+def _load(request):
+    if SESSION_KEY not in request.session:
+        return AnonymousUser()
+    key = KEY.format(id=request.session[SESSION_KEY])
+    principal = cache.get(key)
+    if principal is not None and constant_time_compare(
+        request.session.get(HASH_SESSION_KEY, ''), principal.session_hash
+    ):
+        return principal
+
+    # Also what request.user will return, so this is its one query
+    user = get_user(request)
+    if not user.is_authenticated:
+        return user
+    principal = Principal.from_user(user)
+    cache.set(key, principal, CACHE_TIMEOUT)
+    return principal
+
+
+def get_principal(request):
+    """The ``Principal`` of the logged-in user, or an ``AnonymousUser``."""
+    if not hasattr(request, '_principal'):
+        request._principal = _load(request)
+    return request._principal
+
+
+async def aget_principal(request):
+    """``get_principal`` for async views."""
+    if not hasattr(request, '_principal'):
+        request._principal = await sync_to_async(_load)(request)
+    return request._principal
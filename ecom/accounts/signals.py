@@ -0,0 +1,14 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CustomUser
+from .principal import invalidate_principal
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def user_changed(sender, instance, **kwargs):
+    user_id = instance.id
+    # After the commit, so a concurrent request can't cache the old row again
+    transaction.on_commit(lambda: invalidate_principal(user_id))
@@ -1,3 +1,59 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 
-# Create your tests here.
+from .models import CustomUser
+from .principal import KEY
+
+
+class PrincipalTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller', address='1 Long Road',
+        )
+        self.client.force_login(self.seller)
+
+    def user_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in queries if '"accounts_customuser"' in q['sql']]
+
+    def test_warm_pages_do_not_load_the_user(self):
+        # The first page takes the snapshot
+        self.assertEqual(len(self.user_queries(reverse('shop:product_list'))[1]), 1)
+        for url in (reverse('shop:product_list'), reverse('shop:seller_dashboard')):
+            response, queries = self.user_queries(url)
+            self.assertEqual(queries, [])
+        self.assertContains(response, reverse('shop:seller_dashboard'))
+
+    def test_profile_update_drops_the_snapshot(self):
+        self.client.get(reverse('shop:product_list'))
+        self.assertIsNotNone(cache.get(KEY.format(id=self.seller.id)))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {
+                'username': 'renamed', 'email': 'seller@example.com', 'address': '',
+            })
+        self.assertIsNone(cache.get(KEY.format(id=self.seller.id)))
+
+    def test_password_change_still_ends_other_sessions(self):
+        self.client.get(reverse('shop:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.seller.set_password('new')
+            self.seller.save()
+        # A session started since has cached the new snapshot
+        other = Client()
+        other.force_login(self.seller)
+        other.get(reverse('shop:product_list'))
+        response = self.client.get(reverse('shop:seller_dashboard'))
+        self.assertRedirects(
+            response, f"{reverse('login')}?next={reverse('shop:seller_dashboard')}",
+            fetch_redirect_response=False,
+        )
+
+    def test_seller_required_turns_buyers_away(self):
+        buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.client.force_login(buyer)
+        self.assertEqual(self.client.get(reverse('shop:seller_dashboard')).status_code, 403)
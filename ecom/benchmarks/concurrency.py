@@ -0,0 +1,203 @@
+"""
+Sync WSGI against async ASGI when an upstream is slow.
+
+``run_wsgi`` and ``run_asgi`` feed the same kind of traffic to Django's own
+``WSGIHandler`` and ``ASGIHandler`` inside this process, as one server
+worker would. The WSGI worker has a fixed number of threads, like a
+gunicorn ``gthread`` worker, and a request holds one until it has
+answered. The ASGI worker is a single event loop that takes every request
+as it arrives, like uvicorn, and serves the async views of
+``ecom.urls_async``.
+
+``clients`` visitors send requests back to back. Most ask for product
+pages; the rest submit the payment form of a pending order and wait on
+``FakeStripe`` and its latency. Under WSGI the product pages queue behind
+the payments that hold the threads; under ASGI they don't.
+"""
+import asyncio
+import io
+import random
+import sys
+import threading
+from dataclasses import dataclass
+from time import perf_counter
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from shop.models import Product
+from .runner import OperationResult
+from .scenario import ORDER_FORM, visitor_address
+from .seed import PREFIX, zipf_weights
+
+CATALOG = 'catalog'
+CHECKOUT = 'checkout'
+EXPECTED = {CATALOG: {200}, CHECKOUT: {302, 303}}
+
+
+@dataclass
+class Job:
+    kind: str
+    method: str
+    path: str
+    headers: tuple = ()
+
+
+def build_jobs(count, checkout_share, seed=0):
+    """``count`` requests in random order, ``checkout_share`` of them payments."""
+    rng = random.Random(seed)
+    products = list(
+        Product.objects.filter(slug__startswith=f'{PREFIX}-', available=True)
+        .order_by('id').values_list('id', 'slug')
+    )
+    if not products:
+        raise ValueError('No benchmark products; run seed_benchmark_data first.')
+    popularity = zipf_weights(len(products))
+
+    checkouts = round(count * checkout_share)
+    jobs = [
+        _checkout_job(rng.choices(products, popularity)[0][0], visitor_address(number))
+        for number in range(1, checkouts + 1)
+    ]
+    for _ in range(count - checkouts):
+        product_id, slug = rng.choices(products, popularity)[0]
+        jobs.append(Job(CATALOG, 'GET', reverse('shop:product_detail', args=[product_id, slug])))
+    rng.shuffle(jobs)
+    return jobs
+
+
+def _checkout_job(product_id, address):
+    """The payment submission of a new visitor with a pending order for ``product_id``."""
+    client = Client(REMOTE_ADDR=address)
+    client.post(reverse('cart:cart_add', args=[product_id]), {'quantity': 1})
+    client.post(reverse('orders:order_create'), ORDER_FORM)
+    # Sets the CSRF cookie the payment form is checked against
+    client.get(reverse('orders:payment_process'))
+    cookies = {name: morsel.value for name, morsel in client.cookies.items()}
+    return Job(CHECKOUT, 'POST', reverse('orders:payment_process'), (
+        ('Cookie', '; '.join(f'{name}={value}' for name, value in cookies.items())),
+        ('X-CSRFToken', cookies[settings.CSRF_COOKIE_NAME]),
+    ))
+
+
+def _record(results, job, status, seconds):
+    if status in EXPECTED[job.kind]:
+        results[job.kind].latencies.append(seconds)
+    else:
+        results[job.kind].errors[f'HTTP {status}'] += 1
+
+
+# ----- WSGI -----
+def _call_wsgi(handler, job):
+    environ = {
+        'REQUEST_METHOD': job.method, 'PATH_INFO': job.path, 'QUERY_STRING': '',
+        'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1', 'REMOTE_ADDR': '127.0.0.1', 'CONTENT_LENGTH': '0',
+        'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http', 'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in job.headers:
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    status = []
+    body = handler(environ, lambda line, headers, exc_info=None: status.append(int(line.split()[0])))
+    try:
+        for chunk in body:
+            pass
+    finally:
+        # Fires request_finished, like a server does
+        body.close()
+    return status[0]
+
+
+def run_wsgi(jobs, clients, threads):
+    """Serve ``jobs`` with a ``threads``-thread WSGI worker; return ``({kind: OperationResult}, seconds)``."""
+    handler = WSGIHandler()
+    slots = threading.Semaphore(threads)
+    results = {kind: OperationResult() for kind in EXPECTED}
+    pending = iter(jobs)
+    lock = threading.Lock()
+
+    def visitor():
+        try:
+            while True:
+                with lock:
+                    job = next(pending, None)
+                if job is None:
+                    return
+                start = perf_counter()
+                # Waiting for a free thread counts, as in a server's accept queue
+                with slots:
+                    status = _call_wsgi(handler, job)
+                _record(results, job, status, perf_counter() - start)
+        finally:
+            connections.close_all()
+
+    started = perf_counter()
+    visitors = [threading.Thread(target=visitor) for _ in range(clients)]
+    for thread in visitors:
+        thread.start()
+    for thread in visitors:
+        thread.join()
+    return results, perf_counter() - started
+
+
+# ----- ASGI -----
+async def _call_asgi(handler, job):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+        'method': job.method, 'scheme': 'http', 'path': job.path,
+        'raw_path': job.path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver')] + [
+            (name.lower().encode(), value.encode()) for name, value in job.headers
+        ],
+        'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            # The visitor never hangs up; the handler cancels this wait
+            await asyncio.get_running_loop().create_future()
+        received = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    status = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+
+    await handler(scope, receive, send)
+    return status[0]
+
+
+def run_asgi(jobs, clients):
+    """Serve ``jobs`` with one ASGI event loop; return ``({kind: OperationResult}, seconds)``."""
+    handler = ASGIHandler()
+    results = {kind: OperationResult() for kind in EXPECTED}
+
+    async def main():
+        pending = iter(jobs)
+
+        async def visitor():
+            for job in pending:
+                start = perf_counter()
+                status = await _call_asgi(handler, job)
+                _record(results, job, status, perf_counter() - start)
+
+        await asyncio.gather(*(visitor() for _ in range(clients)))
+
+    started = perf_counter()
+    with override_settings(ROOT_URLCONF='ecom.urls_async'):
+        # A thread of its own, as under a server: the requests must not pick
+        # up this thread's database connections
+        loop = threading.Thread(target=asyncio.run, args=(main(),))
+        loop.start()
+        loop.join()
+    return results, perf_counter() - started
@@ -0,0 +1,74 @@
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from benchmarks.concurrency import build_jobs, run_asgi, run_wsgi
+from benchmarks.runner import report
+from benchmarks.seed import seed
+from orders.fake_stripe import FakeStripe
+
+
+class Command(BaseCommand):
+    help = ('Serve the same mix of product pages and payments, which wait on a slow '
+            'fake Stripe, through a threaded WSGI worker and an ASGI event loop')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=300,
+                            help='Requests per server')
+        parser.add_argument('--clients', type=int, default=50,
+                            help='Visitors sending requests at the same time')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads of the WSGI worker')
+        parser.add_argument('--checkout-share', type=float, default=0.2,
+                            help='Fraction of the requests that are payments')
+        parser.add_argument('--stripe-latency', type=float, default=1.0,
+                            help='Seconds the fake Stripe API takes to answer')
+        parser.add_argument('--stripe-pool', type=int, default=None,
+                            help='Stripe connections (and async threads) per worker; '
+                                 'defaults to STRIPE_HTTP_POOL_SIZE')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--products', type=int, default=500,
+                            help='Catalog size of the scratch database')
+        parser.add_argument('--use-existing', action='store_true',
+                            help='Run against the configured database, seeded with '
+                                 'seed_benchmark_data, instead of a scratch one')
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = None
+        try:
+            if not options['use_existing']:
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                seed(products=options['products'], orders=0, seed=options['seed'])
+            with FakeStripe(latency=options['stripe_latency']) as fake:
+                stripe = {'STRIPE_API_BASE': fake.url, 'STRIPE_SECRET_KEY': 'sk_test_bench'}
+                if options['stripe_pool']:
+                    stripe['STRIPE_HTTP_POOL_SIZE'] = options['stripe_pool']
+                with override_settings(**stripe):
+                    self.compare(options)
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def compare(self, options):
+        servers = [
+            (f"WSGI, {options['threads']} threads",
+             lambda jobs: run_wsgi(jobs, options['clients'], options['threads'])),
+            ('ASGI, one event loop', lambda jobs: run_asgi(jobs, options['clients'])),
+        ]
+        for name, serve in servers:
+            try:
+                # Every payment needs a fresh pending order
+                jobs = build_jobs(options['requests'], options['checkout_share'], options['seed'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            # Both start with a cold page cache
+            cache.clear()
+            results, elapsed = serve(jobs)
+            self.stdout.write(f"{name}: {options['clients']} clients, "
+                              f"{options['stripe_latency'] * 1000:g} ms Stripe latency")
+            for line in report(results, elapsed):
+                self.stdout.write(line)
+            self.stdout.write('')
@@ -0,0 +1,70 @@
+import json
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from benchmarks.scenario import Scenario, compare, report
+from benchmarks.seed import seed
+
+
+class Command(BaseCommand):
+    help = ('Time the browse -> cart -> checkout journey step by step and optionally '
+            'compare it with a baseline; exits with an error on a regression')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Journeys to time')
+        parser.add_argument('--warmup', type=int, default=20,
+                            help='Journeys to run first without timing them')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--products', type=int, default=2000,
+                            help='Catalog size of the scratch database')
+        parser.add_argument('--orders', type=int, default=1000,
+                            help='Order history of the scratch database')
+        parser.add_argument('--stripe-latency', type=float, default=0.0,
+                            help='Seconds the fake Stripe API takes to answer')
+        parser.add_argument('--use-existing', action='store_true',
+                            help='Run against the configured database, seeded with '
+                                 'seed_benchmark_data, instead of a scratch one')
+        parser.add_argument('--json', metavar='PATH',
+                            help='Write the results to PATH')
+        parser.add_argument('--baseline', metavar='PATH',
+                            help='Fail if the results regress against this earlier --json output')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='Allowed p95 growth over the baseline, as a fraction')
+
+    def handle(self, *args, **options):
+        setup_test_environment(debug=False)
+        old_name = None
+        try:
+            if not options['use_existing']:
+                # A throwaway database, like the test runner's
+                old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+                seed(products=options['products'], orders=options['orders'], seed=options['seed'])
+            cache.clear()
+            try:
+                scenario = Scenario(seed=options['seed'], stripe_latency=options['stripe_latency'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            summary = scenario.run(options['iterations'], warmup=options['warmup'])
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for line in report(summary):
+            self.stdout.write(line)
+        if options['json']:
+            with open(options['json'], 'w') as f:
+                json.dump({'steps': summary}, f, indent=2)
+                f.write('\n')
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['steps']
+            regressions = compare(summary, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against the baseline:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No regressions against the baseline'))
@@ -0,0 +1,87 @@
+from django.conf import settings
+from django.contrib.sessions.backends.cached_db import SessionStore
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.models import CustomUser
+from benchmarks.runner import Operation, report, run
+from cart.storage import DatabaseCart, SessionCart
+from orders.checkout import place_order
+from orders.models import Order
+from shop.models import Category, Product
+
+PREFIX = 'dbbench'
+
+
+class Command(BaseCommand):
+    help = ('Measure database throughput under concurrent load: catalog reads, '
+            'cart writes and checkouts against the configured database. '
+            'Run it once per DB_PROFILE to compare them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8,
+                            help='Concurrent worker processes, each with its own connection')
+        parser.add_argument('--duration', type=float, default=10.0,
+                            help='Seconds to run for')
+        parser.add_argument('--products', type=int, default=200,
+                            help='Size of the throwaway catalog')
+        parser.add_argument('--keep', action='store_true',
+                            help='Leave the benchmark rows in the database')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        self.setup(options['products'], workers)
+        try:
+            self.stdout.write(
+                f"Profile {settings.DB_PROFILE} ({connection.vendor}), "
+                f"{workers} workers for {options['duration']:g}s"
+            )
+            results, elapsed = run(self.operations(), workers, options['duration'])
+            for line in report(results, elapsed):
+                self.stdout.write(line)
+        finally:
+            if not options['keep']:
+                self.teardown()
+
+    def setup(self, products, workers):
+        self.teardown()
+        seller = CustomUser.objects.create_user(username=f'{PREFIX}-seller', user_type='seller')
+        self.category = Category.objects.create(name=PREFIX, slug=PREFIX)
+        self.product_ids = [p.id for p in Product.objects.bulk_create([
+            Product(
+                seller=seller, category=self.category, name=f'Bench product {i}',
+                slug=f'{PREFIX}-{i}', price='9.99', stock=1_000_000,
+            )
+            for i in range(products)
+        ])]
+        self.buyers = CustomUser.objects.bulk_create([
+            CustomUser(username=f'{PREFIX}-buyer-{n}') for n in range(workers)
+        ])
+
+    def teardown(self):
+        # Order lines protect their products, so the orders go first
+        Order.objects.filter(full_name=PREFIX).delete()
+        CustomUser.objects.filter(username__startswith=f'{PREFIX}-').delete()
+        Category.objects.filter(slug=PREFIX).delete()
+
+    def operations(self):
+        def browse(worker, rng):
+            list(Product.objects.filter(category=self.category, available=True)
+                 .order_by('-created', '-id')[:settings.PRODUCTS_PER_PAGE])
+            Product.objects.get(id=rng.choice(self.product_ids))
+
+        def cart_add(worker, rng):
+            DatabaseCart(self.buyers[worker]).add(rng.choice(self.product_ids))
+
+        def checkout(worker, rng):
+            cart = SessionCart(SessionStore())
+            cart.add(rng.choice(self.product_ids), 1)
+            place_order(Order(
+                full_name=PREFIX, email='bench@example.com', address='-', city='-', phone='-',
+            ), cart)
+
+        return [
+            Operation('browse', 7, browse),
+            Operation('cart_add', 2, cart_add),
+            Operation('checkout', 1, checkout),
+        ]
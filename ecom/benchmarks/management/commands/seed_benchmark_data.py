@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from benchmarks.seed import flush, seed
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with realistic users, categories, products and orders for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--categories', type=int, default=12)
+        parser.add_argument('--products', type=int, default=2000)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Random seed; the same seed gives the same data')
+        parser.add_argument('--flush', action='store_true',
+                            help='Delete earlier benchmark data first')
+
+    def handle(self, *args, **options):
+        if options['flush']:
+            flush()
+        counts = seed(
+            users=options['users'], categories=options['categories'],
+            products=options['products'], orders=options['orders'], seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded ' + ', '.join(f'{count} {name}' for name, count in counts.items())
+        ))
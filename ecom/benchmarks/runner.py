@@ -0,0 +1,129 @@
+"""
+A small closed-loop load generator.
+
+``run`` forks ``workers`` processes that pick operations at random by
+weight and run them back to back for ``duration`` seconds, each with its
+own database connection, the way gunicorn workers would (threads would
+mostly measure the GIL). It returns the latency of every call and the
+errors raised, per operation, which ``report`` turns into throughput and
+percentiles. Needs a platform that can ``fork``.
+"""
+import multiprocessing
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Callable
+
+from django.db import connections
+
+
+@dataclass
+class Operation:
+    name: str
+    weight: int
+    # func(worker number, random.Random)
+    func: Callable
+
+
+@dataclass
+class OperationResult:
+    latencies: list = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)
+
+    @property
+    def calls(self):
+        return len(self.latencies) + sum(self.errors.values())
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def _work(operations, number, seed, start_at, deadline, queue):
+    rng = random.Random(seed + number)
+    weights = [op.weight for op in operations]
+    local = {op.name: OperationResult() for op in operations}
+    try:
+        time.sleep(max(0.0, start_at - time.time()))
+        while time.time() < deadline:
+            op = rng.choices(operations, weights)[0]
+            started = time.perf_counter()
+            try:
+                op.func(number, rng)
+            except Exception as e:
+                local[op.name].errors[_describe(e)] += 1
+            else:
+                local[op.name].latencies.append(time.perf_counter() - started)
+    finally:
+        connections.close_all()
+        queue.put(local)
+
+
+def run(operations, workers, duration, seed=0):
+    """Run ``operations`` from ``workers`` processes; return ``({name: OperationResult}, duration)``."""
+    # Children must open their own connections, not share the parent's
+    connections.close_all()
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    start_at = time.time() + 0.5
+    deadline = start_at + duration
+    processes = [
+        context.Process(target=_work, args=(operations, n, seed, start_at, deadline, queue))
+        for n in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    results = {op.name: OperationResult() for op in operations}
+    for _ in processes:
+        for name, result in queue.get().items():
+            results[name].latencies.extend(result.latencies)
+            results[name].errors.update(result.errors)
+    for process in processes:
+        process.join()
+    return results, duration
+
+
+def _describe(error):
+    message = str(error).splitlines()
+    return f"{type(error).__name__}: {message[0] if message else ''}"
+
+
+def summarize(results, elapsed):
+    """``{name: {calls, ok, errors, per_second, p50_ms, p95_ms, p99_ms}}``, plus ``total``."""
+    summary = {}
+    for name, result in list(results.items()) + [('total', _merged(results))]:
+        ordered = sorted(result.latencies)
+        summary[name] = {
+            'calls': result.calls,
+            'ok': len(ordered),
+            'errors': sum(result.errors.values()),
+            'per_second': round(len(ordered) / elapsed, 1),
+            'p50_ms': round(percentile(ordered, 0.50) * 1000, 2),
+            'p95_ms': round(percentile(ordered, 0.95) * 1000, 2),
+            'p99_ms': round(percentile(ordered, 0.99) * 1000, 2),
+        }
+    return summary
+
+
+def _merged(results):
+    merged = OperationResult()
+    for result in results.values():
+        merged.latencies.extend(result.latencies)
+        merged.errors.update(result.errors)
+    return merged
+
+
+def report(results, elapsed):
+    """Lines of a plain-text table of ``summarize``."""
+    summary = summarize(results, elapsed)
+    yield f"{'operation':<12} {'ok/s':>9} {'calls':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    for name, row in summary.items():
+        yield (f"{name:<12} {row['per_second']:>9} {row['calls']:>8} {row['errors']:>7} "
+               f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8}")
+    errors = _merged(results).errors
+    for message, count in errors.most_common(5):
+        yield f"  {count}x {message}"
@@ -0,0 +1,149 @@
+"""
+Scripted browse -> cart -> checkout journeys through the test client.
+
+Each journey is a new anonymous visitor who opens a category page and a
+product (picked by popularity, like the seeded orders), adds it to the
+cart, looks at the cart, fills in the order form and starts paying
+against ``orders.fake_stripe.FakeStripe``, so the real Stripe client runs
+over a local socket with a configurable latency. Every step records its
+latency, its SQL statement count and whether it answered with the status
+it should.
+
+``compare`` checks a run against a stored baseline: a step regresses when
+its p95 grows by more than the tolerance, or when it runs more queries
+than it used to (the journeys are deterministic, so query counts are
+exact).
+"""
+import itertools
+import random
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from orders.fake_stripe import FakeStripe
+from shop.models import Category, Product
+from .runner import percentile
+from .seed import PREFIX, zipf_weights
+
+STEPS = (
+    'product_list', 'product_detail', 'add_cart', 'cart_detail',
+    'order_create', 'order_submit', 'payment_process',
+)
+# p95s this close to the baseline are noise, whatever the tolerance
+MIN_LATENCY_DELTA_MS = 1.0
+ORDER_FORM = {
+    'full_name': f'{PREFIX} visitor', 'email': 'visitor@example.com',
+    'email_confirmation': 'visitor@example.com', 'address': '1 Bench Street',
+    'city': 'Benchville', 'phone': '+1 234 567 890',
+}
+
+
+def visitor_address(number):
+    """A client address per simulated visitor, so per-IP rate limits see many visitors."""
+    return f'10.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}'
+
+
+class Scenario:
+    def __init__(self, seed=0, stripe_latency=0.0):
+        self.rng = random.Random(seed)
+        self.stripe_latency = stripe_latency
+        self.categories = list(
+            Category.objects.filter(slug__startswith=f'{PREFIX}-').values_list('slug', flat=True)
+        )
+        self.products = list(
+            Product.objects.filter(slug__startswith=f'{PREFIX}-', available=True)
+            .order_by('id').values_list('id', 'slug')
+        )
+        if not self.products:
+            raise ValueError('No benchmark products; run seed_benchmark_data first.')
+        self.popularity = zipf_weights(len(self.products))
+        self.visitors = itertools.count(1)
+        # step -> [(seconds, queries, expected status?)]
+        self.samples = defaultdict(list)
+
+    def step(self, name, request, expected):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = request()
+            elapsed = time.perf_counter() - start
+        self.samples[name].append((elapsed, len(queries), response.status_code in expected))
+        return response
+
+    def journey(self):
+        client = Client(REMOTE_ADDR=visitor_address(next(self.visitors)))
+        product_id, slug = self.rng.choices(self.products, self.popularity)[0]
+        category = self.rng.choice(self.categories)
+
+        self.step('product_list', lambda: client.get(
+            reverse('shop:product_list_by_category', args=[category])), {200})
+        self.step('product_detail', lambda: client.get(
+            reverse('shop:product_detail', args=[product_id, slug])), {200})
+        self.step('add_cart', lambda: client.post(
+            reverse('cart:cart_add', args=[product_id]), {'quantity': self.rng.randint(1, 3)}), {302})
+        self.step('cart_detail', lambda: client.get(reverse('cart:cart_detail')), {200})
+        self.step('order_create', lambda: client.get(reverse('orders:order_create')), {200})
+        self.step('order_submit', lambda: client.post(reverse('orders:order_create'), ORDER_FORM), {302})
+        self.step('payment_process', lambda: client.post(reverse('orders:payment_process')), {302, 303})
+
+    def run(self, iterations, warmup=0):
+        with FakeStripe(latency=self.stripe_latency) as fake:
+            with override_settings(STRIPE_API_BASE=fake.url, STRIPE_SECRET_KEY='sk_test_bench'):
+                for _ in range(warmup):
+                    self.journey()
+                self.samples.clear()
+                for _ in range(iterations):
+                    self.journey()
+        return self.summary()
+
+    def summary(self):
+        """``{step: {count, failed, per_second, p50_ms, p95_ms, p99_ms, queries_mean, queries_max}}``."""
+        summary = {}
+        for name in STEPS:
+            samples = self.samples[name]
+            latencies = sorted(seconds for seconds, queries, ok in samples)
+            queries = [queries for seconds, queries, ok in samples]
+            summary[name] = {
+                'count': len(samples),
+                'failed': sum(1 for seconds, queries, ok in samples if not ok),
+                'per_second': round(len(samples) / sum(latencies), 1) if latencies else 0.0,
+                'p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+                'queries_mean': round(sum(queries) / len(queries), 2) if queries else 0.0,
+                'queries_max': max(queries, default=0),
+            }
+        return summary
+
+
+def report(summary):
+    yield (f"{'step':<16} {'req/s':>8} {'count':>6} {'failed':>6} {'p50 ms':>8} {'p95 ms':>8} "
+           f"{'p99 ms':>8} {'queries':>8} {'max q':>6}")
+    for name, row in summary.items():
+        yield (f"{name:<16} {row['per_second']:>8} {row['count']:>6} {row['failed']:>6} "
+               f"{row['p50_ms']:>8} {row['p95_ms']:>8} {row['p99_ms']:>8} "
+               f"{row['queries_mean']:>8} {row['queries_max']:>6}")
+
+
+def compare(summary, baseline, tolerance):
+    """Return the regressions of ``summary`` against ``baseline`` as messages."""
+    regressions = []
+    for name, base in baseline.items():
+        row = summary.get(name)
+        if row is None:
+            continue
+        if row['failed']:
+            regressions.append(f"{name}: {row['failed']} requests got an unexpected status")
+        limit = base['p95_ms'] * (1 + tolerance)
+        if row['p95_ms'] > limit and row['p95_ms'] - base['p95_ms'] > MIN_LATENCY_DELTA_MS:
+            regressions.append(
+                f"{name}: p95 {row['p95_ms']} ms, baseline {base['p95_ms']} ms (limit {limit:.2f})"
+            )
+        if row['queries_mean'] > base['queries_mean']:
+            regressions.append(
+                f"{name}: {row['queries_mean']} queries per request, baseline {base['queries_mean']}"
+            )
+    return regressions
@@ -0,0 +1,129 @@
+"""
+Realistic benchmark data.
+
+``seed`` fills the database with users, categories, products and orders
+whose shapes look like a real shop's rather than uniform noise: category
+sizes and product popularity follow a Zipf curve (a few best sellers
+take most orders), prices are log-normal, orders have mostly one or two
+lines and are spread over the last year. Everything is written with
+``bulk_create`` and derived from ``seed``, so the same arguments produce
+the same rows, and the sales rollups are rebuilt from the orders.
+Benchmark rows are named ``bench-...`` and ``flush`` removes them.
+"""
+import random
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from orders import rollups
+from orders.models import Order, OrderItem
+from shop.models import Category, Product
+from shop.signals import products_changed
+
+PREFIX = 'bench'
+PASSWORD = 'bench-password'
+BATCH_SIZE = 1000
+
+
+def zipf_weights(count, exponent=1.1):
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def flush():
+    """Delete the rows made by ``seed``."""
+    with transaction.atomic():
+        # Order lines protect their products, so the orders go first
+        Order.objects.filter(full_name__startswith=f'{PREFIX} ').delete()
+        CustomUser.objects.filter(username__startswith=f'{PREFIX}-').delete()
+        Category.objects.filter(slug__startswith=f'{PREFIX}-').delete()
+    products_changed.send(sender=Product)
+
+
+def seed(users=200, categories=12, products=2000, orders=1000, seed=0):
+    """Write the benchmark rows; return ``{model name: rows written}``."""
+    rng = random.Random(seed)
+    now = timezone.now()
+    # Hashing is slow on purpose; every benchmark user shares one hash
+    password = make_password(PASSWORD)
+
+    with transaction.atomic():
+        sellers = max(1, users // 10)
+        people = CustomUser.objects.bulk_create([
+            CustomUser(
+                username=f'{PREFIX}-{"seller" if i < sellers else "user"}-{i}',
+                email=f'{PREFIX}-{i}@example.com',
+                password=password,
+                user_type='seller' if i < sellers else 'buyer',
+            )
+            for i in range(users)
+        ], batch_size=BATCH_SIZE)
+        seller_list, buyers = people[:sellers], people[sellers:] or people
+
+        category_list = Category.objects.bulk_create([
+            Category(name=f'Bench category {i}', slug=f'{PREFIX}-category-{i}')
+            for i in range(categories)
+        ])
+        category_weights = zipf_weights(categories, exponent=0.8)
+
+        catalog = []
+        for i in range(products):
+            price = min(max(rng.lognormvariate(3, 0.8), 1), 2000)
+            catalog.append(Product(
+                seller=rng.choice(seller_list),
+                category=rng.choices(category_list, category_weights)[0],
+                name=f'Bench product {i}',
+                slug=f'{PREFIX}-product-{i}',
+                description=f'Benchmark product number {i}.',
+                price=Decimal(f'{price:.2f}'),
+                # Checkouts in the scenario should never run out
+                stock=rng.randint(10_000, 20_000),
+                available=rng.random() > 0.05,
+            ))
+        catalog = Product.objects.bulk_create(catalog, batch_size=BATCH_SIZE)
+        popularity = zipf_weights(len(catalog))
+
+        order_list, lines = [], []
+        for i in range(orders):
+            buyer = rng.choice(buyers)
+            order = Order(
+                user=buyer, full_name=f'{PREFIX} {buyer.username}', email=buyer.email,
+                address='1 Bench Street', city='Benchville', phone='+1 234 567 890',
+                status=rng.choices(['paid', 'shipped', 'canceled'], [70, 20, 10])[0],
+            )
+            order_list.append(order)
+            # Mostly one or two lines, now and then a big basket
+            count = min(1 + int(rng.expovariate(1.2)), 10)
+            for product in dict.fromkeys(rng.choices(catalog, popularity, k=count)):
+                lines.append((order, OrderItem(
+                    product=product, seller_id=product.seller_id, price=product.price,
+                    quantity=rng.choices([1, 2, 3], [80, 15, 5])[0],
+                )))
+        order_list = Order.objects.bulk_create(order_list, batch_size=BATCH_SIZE)
+        for order in order_list:
+            order.created = now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            if order.status in ('paid', 'shipped'):
+                order.paid_at = order.created
+        Order.objects.bulk_update(order_list, ['created', 'paid_at'], batch_size=BATCH_SIZE)
+
+        items = []
+        for order, item in lines:
+            item.order = order
+            item.paid = order.status in ('paid', 'shipped')
+            items.append(item)
+        OrderItem.objects.bulk_create(items, batch_size=BATCH_SIZE)
+        # bulk_create skips the webhook that keeps the rollups
+        rollups.rebuild()
+
+        transaction.on_commit(lambda: products_changed.send(sender=Product))
+
+    return {
+        'users': len(people),
+        'categories': len(category_list),
+        'products': len(catalog),
+        'orders': len(order_list),
+        'order lines': len(items),
+    }
@@ -0,0 +1,118 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+
+from accounts.models import CustomUser
+from orders.fake_stripe import FakeStripe
+from orders.models import Order, OrderItem
+from shop.models import Product
+from .concurrency import CATALOG, CHECKOUT, build_jobs, run_asgi, run_wsgi
+from .runner import Operation, percentile, run, summarize
+from .scenario import STEPS, Scenario, compare
+from .seed import flush, seed
+
+
+class RunnerTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('worker processes need a test database they can share')
+
+    def test_results_are_collected_from_every_worker(self):
+        def ok(worker, rng):
+            pass
+
+        def fail(worker, rng):
+            raise ValueError('nope')
+
+        results, elapsed = run([Operation('ok', 1, ok), Operation('fail', 1, fail)], 2, 0.2)
+        self.assertGreater(len(results['ok'].latencies), 0)
+        self.assertEqual(results['fail'].latencies, [])
+        self.assertEqual(list(results['fail'].errors), ['ValueError: nope'])
+        summary = summarize(results, elapsed)
+        self.assertEqual(summary['total']['calls'], results['ok'].calls + results['fail'].calls)
+
+    def test_percentile(self):
+        self.assertEqual(percentile([], 0.5), 0.0)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 3)
+        self.assertEqual(percentile([1, 2, 3, 4], 0.99), 4)
+
+    def test_dbbench_cleans_up_after_itself(self):
+        out = StringIO()
+        call_command('dbbench', workers=2, duration=0.5, products=5, stdout=out)
+        self.assertIn('checkout', out.getvalue())
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(CustomUser.objects.exists())
+
+
+class SeedTests(TestCase):
+    def test_seed_is_reproducible_and_flushable(self):
+        counts = seed(users=20, categories=3, products=50, orders=30, seed=7)
+        self.assertEqual(counts['products'], 50)
+        first = list(OrderItem.objects.order_by('id').values_list('product__slug', 'quantity'))
+        self.assertEqual(len(first), counts['order lines'])
+
+        flush()
+        self.assertFalse(Product.objects.exists())
+        self.assertFalse(Order.objects.exists())
+        seed(users=20, categories=3, products=50, orders=30, seed=7)
+        self.assertEqual(
+            list(OrderItem.objects.order_by('id').values_list('product__slug', 'quantity')), first
+        )
+
+    def test_popular_products_sell_most(self):
+        seed(users=20, categories=3, products=100, orders=300)
+        top = OrderItem.objects.filter(product__slug='bench-product-0').count()
+        tail = OrderItem.objects.filter(product__slug='bench-product-99').count()
+        self.assertGreater(top, tail)
+
+
+class ScenarioTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seed(users=10, categories=3, products=20, orders=10)
+
+    def test_every_step_succeeds(self):
+        summary = Scenario().run(iterations=3)
+        self.assertEqual(list(summary), list(STEPS))
+        for name, row in summary.items():
+            self.assertEqual((row['count'], row['failed']), (3, 0), name)
+        self.assertEqual(compare(summary, summary, tolerance=0), [])
+
+
+class CompareTests(SimpleTestCase):
+    base = {'step': {'failed': 0, 'p95_ms': 10.0, 'queries_mean': 2.0}}
+
+    def check(self, **row):
+        return compare({'step': {**self.base['step'], **row}}, self.base, tolerance=0.25)
+
+    def test_regressions(self):
+        self.assertEqual(self.check(p95_ms=12.4), [])
+        self.assertEqual(len(self.check(p95_ms=13.0)), 1)
+        self.assertEqual(len(self.check(queries_mean=3.0)), 1)
+        self.assertEqual(len(self.check(failed=1)), 1)
+
+    def test_small_absolute_changes_are_noise(self):
+        base = {'step': {'failed': 0, 'p95_ms': 1.0, 'queries_mean': 0.0}}
+        self.assertEqual(compare({'step': {**base['step'], 'p95_ms': 1.9}}, base, tolerance=0.25), [])
+
+
+class ConcurrencyTests(TransactionTestCase):
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('the servers run requests in threads with their own connections')
+        cache.clear()
+        seed(users=10, categories=3, products=20, orders=0)
+
+    def test_both_servers_answer_every_request(self):
+        with FakeStripe() as fake:
+            with override_settings(STRIPE_API_BASE=fake.url, STRIPE_SECRET_KEY='sk_test'):
+                for serve in (lambda jobs: run_wsgi(jobs, 3, 2), lambda jobs: run_asgi(jobs, 3)):
+                    results, elapsed = serve(build_jobs(8, 0.25))
+                    self.assertEqual(len(results[CATALOG].latencies), 6)
+                    self.assertEqual(len(results[CHECKOUT].latencies), 2, results[CHECKOUT].errors)
+                self.assertEqual(len(fake.sessions), 4)
+        self.assertEqual(Order.objects.exclude(stripe_checkout_url='').count(), 4)
@@ -0,0 +1,12 @@
+from django.utils.functional import SimpleLazyObject
+from .storage import get_cart
+
+
+def cart(request):
+    """
+    Expose ``cart_summary`` (``count`` and ``total``) for the navbar badge.
+
+    Evaluated lazily, so pages that don't render the badge pay nothing;
+    otherwise it costs one aggregate query and never loads the cart rows.
+    """
+    return {'cart_summary': SimpleLazyObject(lambda: get_cart(request).summary())}
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 21:27
+
+from django.db import migrations, models
+
+
+def merge_duplicate_lines(apps, schema_editor):
+    CartItem = apps.get_model('cart', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart_id', 'product_id')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        items = list(CartItem.objects.filter(
+            cart_id=duplicate['cart_id'], product_id=duplicate['product_id']
+        ).order_by('id'))
+        # Keep the oldest line with the units of all of them
+        first, rest = items[0], items[1:]
+        first.quantity = sum(item.quantity for item in items)
+        first.save(update_fields=['quantity'])
+        CartItem.objects.filter(id__in=[item.id for item in rest]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_alter_cart_options_alter_cartitem_options_and_more'),
+        ('shop', '0006_stock_movement'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_lines, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cart_item_cart_product_unique'),
+        ),
+    ]
@@ -1,5 +1,8 @@
 # cart/models.py
+from decimal import Decimal
 from django.db import models
+from django.db.models import DecimalField, F, Sum
+from django.db.models.functions import Coalesce
 from shop.models import Product
 from accounts.models import CustomUser  # Link to your custom user model
 
@@ -16,12 +19,39 @@ class Cart(models.Model):
     def __str__(self):
         return f"Cart {self.id}"
 
+    def summary(self):
+        """Item count and total for this cart in a single query."""
+        return self.items.summary()
+
+class CartItemQuerySet(models.QuerySet):
+    def summary(self):
+        """
+        Aggregate ``count`` (units) and ``total`` (price) over these items
+        with one query, without loading the rows or their products.
+        """
+        return self.aggregate(
+            count=Coalesce(Sum('quantity'), 0),
+            total=Coalesce(
+                Sum(F('quantity') * F('product__price'), output_field=DecimalField()),
+                Decimal('0.00'),
+                output_field=DecimalField(),
+            ),
+        )
+
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One line per product; DatabaseCart.add upserts against it
+            models.UniqueConstraint(fields=['cart', 'product'], name='cart_item_cart_product_unique'),
+        ]
+
     def subtotal(self):
         return self.product.price * self.quantity
 
@@ -0,0 +1,10 @@
+from django.contrib.auth.signals import user_logged_in
+from django.dispatch import receiver
+
+from .storage import merge_session_cart
+
+
+@receiver(user_logged_in)
+def move_session_cart_to_user(sender, request, user, **kwargs):
+    if request is not None and hasattr(request, 'session'):
+        merge_session_cart(request.session, user)
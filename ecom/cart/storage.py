@@ -0,0 +1,305 @@
+"""
+Cart storage backends.
+
+Anonymous visitors keep their cart in the session (``SessionCart``), so
+browsing and even adding to the cart never writes to the cart tables.
+Logged-in users get the database-backed ``DatabaseCart``. When a visitor
+logs in, ``merge_session_cart`` folds the session cart into their database
+cart. Views only ever talk to the common interface returned by
+``get_cart``, or ``aget_cart`` in async views, whose carts also offer the
+``a``-prefixed coroutine methods.
+"""
+from abc import ABC, abstractmethod
+from decimal import Decimal
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from accounts.principal import aget_principal, get_principal
+from shop.models import Product
+from .models import Cart, CartItem
+
+
+class CartLine:
+    """A product and quantity, shaped like ``CartItem`` for the templates."""
+
+    __slots__ = ('product', 'quantity')
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def product_id(self):
+        return self.product.id
+
+    def subtotal(self):
+        return self.product.price * self.quantity
+
+
+class BaseCart(ABC):
+    def __init__(self):
+        self._lines = None
+
+    def __len__(self):
+        return sum(self.quantities().values())
+
+    @abstractmethod
+    def add(self, product_id, quantity=1):
+        """Put ``quantity`` more units of ``product_id`` in the cart."""
+
+    @abstractmethod
+    def decrement(self, product_id):
+        """Take one unit of ``product_id`` out, dropping the line at zero."""
+
+    @abstractmethod
+    def remove(self, product_id):
+        """Drop the line of ``product_id``."""
+
+    @abstractmethod
+    def clear(self):
+        """Empty the cart."""
+
+    @abstractmethod
+    def quantities(self):
+        """Return ``{product_id: quantity}``."""
+
+    @abstractmethod
+    def lines(self):
+        """Return the ``CartLine``s with their products, in one query."""
+
+    @abstractmethod
+    async def aadd(self, product_id, quantity=1):
+        """``add`` for async views."""
+
+    @abstractmethod
+    async def aquantities(self):
+        """``quantities`` for async views."""
+
+    @abstractmethod
+    async def alines(self):
+        """``lines`` for async views."""
+
+    async def acount(self):
+        return sum((await self.aquantities()).values())
+
+    def summary(self):
+        lines = self.lines()
+        return {
+            'count': sum(line.quantity for line in lines),
+            'total': sum((line.subtotal() for line in lines), Decimal('0.00')),
+        }
+
+
+class SessionCart(BaseCart):
+    """Cart kept in the session as ``{product_id: quantity}``."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.key = settings.CART_SESSION_ID
+
+    def _data(self):
+        return self.session.get(self.key, {})
+
+    def _save(self, data):
+        self._lines = None
+        if data:
+            self.session[self.key] = data
+        else:
+            self.session.pop(self.key, None)
+        self.session.modified = True
+
+    def add(self, product_id, quantity=1):
+        data = self._data()
+        key = str(product_id)
+        data[key] = data.get(key, 0) + quantity
+        self._save(data)
+
+    def decrement(self, product_id):
+        data = self._data()
+        key = str(product_id)
+        if data.get(key, 0) > 1:
+            data[key] -= 1
+        else:
+            data.pop(key, None)
+        self._save(data)
+
+    def remove(self, product_id):
+        data = self._data()
+        data.pop(str(product_id), None)
+        self._save(data)
+
+    def clear(self):
+        # Inside a checkout transaction, only forget the cart once the order
+        # has actually been committed.
+        transaction.on_commit(lambda: self._save({}))
+
+    def quantities(self):
+        return {int(key): quantity for key, quantity in self._data().items()}
+
+    def lines(self):
+        if self._lines is None:
+            quantities = self.quantities()
+            if not quantities:
+                self._lines = []
+            else:
+                # Products that were deleted since they were added just drop out
+                products = Product.objects.filter(id__in=quantities).order_by('name')
+                self._lines = [CartLine(p, quantities[p.id]) for p in products]
+        return self._lines
+
+    async def _adata(self):
+        return await self.session.aget(self.key, {})
+
+    async def aadd(self, product_id, quantity=1):
+        data = await self._adata()
+        key = str(product_id)
+        data[key] = data.get(key, 0) + quantity
+        # The session is loaded now, so saving doesn't touch the database
+        self._save(data)
+
+    async def aquantities(self):
+        return {int(key): quantity for key, quantity in (await self._adata()).items()}
+
+    async def alines(self):
+        if self._lines is None:
+            quantities = await self.aquantities()
+            products = Product.objects.filter(id__in=quantities).order_by('name')
+            self._lines = [CartLine(p, quantities[p.id]) async for p in products] if quantities else []
+        return self._lines
+
+
+class DatabaseCart(BaseCart):
+    """
+    Cart rows owned by a logged-in user; the ``Cart`` row is made on first
+    add. Only the user's id is used, so a ``Principal`` will do.
+    """
+
+    def __init__(self, user):
+        super().__init__()
+        self.user = user
+
+    def _items(self):
+        return CartItem.objects.filter(cart__user_id=self.user.id)
+
+    def _cart(self):
+        cart, created = Cart.objects.get_or_create(user_id=self.user.id)
+        return cart
+
+    def add(self, product_id, quantity=1):
+        self._lines = None
+        with transaction.atomic():
+            items = self._items().filter(product_id=product_id)
+            if not items.update(quantity=F('quantity') + quantity):
+                # New line: insert it empty unless a concurrent add just did
+                # (the cart/product constraint), then count the units onto it
+                CartItem.objects.bulk_create(
+                    [CartItem(cart=self._cart(), product_id=product_id, quantity=0)],
+                    ignore_conflicts=True,
+                )
+                items.update(quantity=F('quantity') + quantity)
+
+    def decrement(self, product_id):
+        self._lines = None
+        with transaction.atomic():
+            items = self._items().filter(product_id=product_id)
+            if not items.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+                items.delete()
+
+    def remove(self, product_id):
+        self._lines = None
+        self._items().filter(product_id=product_id).delete()
+
+    def clear(self):
+        self._lines = None
+        self._items().delete()
+
+    def quantities(self):
+        if self._lines is not None:
+            return {line.product_id: line.quantity for line in self._lines}
+        return dict(self._items().values_list('product_id', 'quantity'))
+
+    def lines(self):
+        if self._lines is None:
+            items = self._items().select_related('product').order_by('product__name')
+            self._lines = [CartLine(item.product, item.quantity) for item in items]
+        return self._lines
+
+    def summary(self):
+        if self._lines is not None:
+            return super().summary()
+        return self._items().summary()
+
+    async def aadd(self, product_id, quantity=1):
+        # The async ORM has no transactions; run the sync version in a thread
+        await sync_to_async(self.add)(product_id, quantity)
+
+    async def aquantities(self):
+        if self._lines is not None:
+            return self.quantities()
+        return {
+            product_id: quantity
+            async for product_id, quantity in self._items().values_list('product_id', 'quantity')
+        }
+
+    async def alines(self):
+        if self._lines is None:
+            items = self._items().select_related('product').order_by('product__name')
+            self._lines = [CartLine(item.product, item.quantity) async for item in items]
+        return self._lines
+
+
+def get_cart(request):
+    """Return the cart storage for this request."""
+    principal = get_principal(request)
+    if principal.is_authenticated:
+        return DatabaseCart(principal)
+    return SessionCart(request.session)
+
+
+async def aget_cart(request):
+    """``get_cart`` for async views."""
+    principal = await aget_principal(request)
+    if principal.is_authenticated:
+        return DatabaseCart(principal)
+    return SessionCart(request.session)
+
+
+def merge_session_cart(session, user):
+    """
+    Move the anonymous cart in ``session`` into ``user``'s database cart.
+
+    Runs in a fixed number of queries however many lines there are: the
+    lines the user already has are bumped with one bulk update and the
+    rest inserted with one bulk insert.
+    """
+    session_cart = SessionCart(session)
+    incoming = session_cart.quantities()
+    if not incoming:
+        return
+
+    with transaction.atomic():
+        cart, created = Cart.objects.get_or_create(user=user)
+        existing = {
+            item.product_id: item
+            for item in cart.items.filter(product_id__in=incoming)
+        }
+        for product_id, item in existing.items():
+            item.quantity += incoming[product_id]
+        CartItem.objects.bulk_update(existing.values(), ['quantity'])
+
+        valid_ids = set(
+            Product.objects.filter(id__in=incoming.keys() - existing.keys())
+            .values_list('id', flat=True)
+        )
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in incoming.items()
+            if product_id in valid_ids
+        ])
+
+    # The merge is committed, drop the session copy straight away
+    session_cart._save({})
@@ -1,3 +1,144 @@
-from django.test import TestCase
+from decimal import Decimal
 
-# Create your tests here.
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from accounts.models import CustomUser
+from shop.factories import make_products
+from .models import Cart, CartItem
+from .storage import BaseCart, DatabaseCart, SessionCart
+
+
+class CartSummaryTests(TestCase):
+    def setUp(self):
+        self.products = make_products(20)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+        CartItem.objects.bulk_create([
+            CartItem(cart=self.cart, product=product, quantity=2)
+            for product in self.products
+        ])
+
+    def test_summary_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            summary = self.cart.summary()
+        self.assertEqual(summary, {'count': 40, 'total': Decimal('100.00')})
+
+    def test_empty_cart_summary(self):
+        empty = Cart.objects.create(session_key='abc')
+        self.assertEqual(empty.summary(), {'count': 0, 'total': Decimal('0.00')})
+
+    def test_cart_detail_query_count_does_not_grow_with_lines(self):
+        self.client.force_login(self.buyer)
+        # user, items with products (the session comes from the cache)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(response.context['total'], Decimal('100.00'))
+        self.assertEqual(response.context['counter'], 40)
+
+    def test_navbar_badge_uses_one_aggregate(self):
+        self.client.force_login(self.buyer)
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, '>40</span>')
+
+    async def test_async_api_matches_sync(self):
+        cart = DatabaseCart(self.buyer)
+        await cart.aadd(self.products[0].id, 3)
+        self.assertEqual(await cart.acount(), 43)
+        lines = await cart.alines()
+        self.assertEqual(len(lines), 20)
+        self.assertEqual(lines[0].quantity, 5)
+
+
+class DatabaseCartTests(TestCase):
+    def setUp(self):
+        self.products = make_products(2)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+
+    def test_add_keeps_one_line_per_product(self):
+        cart = DatabaseCart(self.buyer)
+        cart.add(self.products[0].id, 2)
+        cart.add(self.products[0].id, 3)
+        cart.add(self.products[1].id)
+        self.assertEqual(
+            list(CartItem.objects.order_by('product_id').values_list('product_id', 'quantity')),
+            [(self.products[0].id, 5), (self.products[1].id, 1)],
+        )
+        # Adding to an existing line is a single UPDATE (in a savepoint here)
+        with self.assertNumQueries(3):
+            cart.add(self.products[1].id)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartItem.objects.create(cart=Cart.objects.get(user=self.buyer), product=self.products[0])
+
+    def test_storages_implement_the_whole_interface(self):
+        with self.assertRaises(TypeError):
+            BaseCart()
+
+        class Incomplete(BaseCart):
+            def add(self, product_id, quantity=1):
+                pass
+
+        with self.assertRaises(TypeError):
+            Incomplete()
+
+
+class SessionCartTests(TestCase):
+    def setUp(self):
+        self.products = make_products(3)
+
+    def test_anonymous_cart_never_touches_cart_tables(self):
+        self.client.get(reverse('shop:product_list'))
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+
+        self.client.post(reverse('cart:cart_add', args=[self.products[0].id]), {'quantity': 2})
+        self.client.post(reverse('cart:cart_add', args=[self.products[1].id]))
+        self.client.post(reverse('cart:remove_cart', args=[self.products[0].id]))
+        response = self.client.get(reverse('cart:cart_detail'))
+
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(response.context['counter'], 2)
+        self.assertEqual(response.context['total'], Decimal('5.00'))
+
+    @override_settings(CART_MAX_QUANTITY=20)
+    def test_posted_quantity_is_clamped(self):
+        url = reverse('cart:cart_add', args=[self.products[0].id])
+        self.client.post(url, {'quantity': 10**9})
+        self.client.post(url, {'quantity': 'lots'})
+        self.client.post(url, {'quantity': -5})
+        self.assertEqual(self.client.get(reverse('cart:cart_detail')).context['counter'], 22)
+
+    def test_full_remove(self):
+        self.client.post(reverse('cart:cart_add', args=[self.products[0].id]), {'quantity': 3})
+        self.client.get(reverse('cart:full_remove', args=[self.products[0].id]))
+        self.assertEqual(self.client.get(reverse('cart:cart_detail')).context['counter'], 0)
+
+    def test_login_merges_session_cart_into_database_cart(self):
+        buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        cart = Cart.objects.create(user=buyer)
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+
+        self.client.post(reverse('cart:cart_add', args=[self.products[0].id]), {'quantity': 2})
+        self.client.post(reverse('cart:cart_add', args=[self.products[2].id]))
+        self.client.post(reverse('login'), {'username': 'buyer', 'password': 'pass'})
+
+        self.assertEqual(DatabaseCart(buyer).quantities(), {
+            self.products[0].id: 3,
+            self.products[2].id: 1,
+        })
+        self.assertNotIn('cart', self.client.session)
+
+    @override_settings(ROOT_URLCONF='ecom.urls_async')
+    async def test_cart_under_asgi(self):
+        await self.async_client.post(reverse('cart:cart_add', args=[self.products[0].id]), {'quantity': 2})
+        await self.async_client.post(reverse('cart:cart_add', args=[self.products[1].id]))
+        response = await self.async_client.get(reverse('cart:cart_detail'))
+        self.assertEqual(response.context['counter'], 3)
+        self.assertFalse(await Cart.objects.aexists())
+
+        session = await self.async_client.asession()
+        self.assertEqual(await SessionCart(session).aquantities(), {
+            self.products[0].id: 2,
+            self.products[1].id: 1,
+        })
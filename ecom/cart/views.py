@@ -1,77 +1,67 @@
 # cart/views.py
-from django.shortcuts import render, redirect, get_object_or_404
+from django.conf import settings
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.response import TemplateResponse
 from shop.models import Product
-from .models import Cart, CartItem
+from .storage import aget_cart, get_cart
 
-# ----- Helper Function -----
-def _get_or_create_cart(request):
-    """Get or create a cart for the current user/session"""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        if not request.session.session_key:
-            request.session.create()
-        session_key = request.session.session_key
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
+def _quantity(request):
+    """The posted quantity, between 1 and ``CART_MAX_QUANTITY``."""
+    try:
+        quantity = int(request.POST.get('quantity', 1))
+    except ValueError:
+        quantity = 1
+    return min(max(quantity, 1), settings.CART_MAX_QUANTITY)
 
 # ----- Cart Views -----
 def cart_detail(request):
-    try:
-        cart = _get_or_create_cart(request)
-        cart_items = cart.items.all()  # Use related_name 'items'
-        total = sum(item.subtotal() for item in cart_items)
-        counter = sum(item.quantity for item in cart_items)
-    except Cart.DoesNotExist:
-        cart_items = []
-        total = 0
-        counter = 0
+    cart = get_cart(request)
+    # One query for the lines and their products; the totals are
+    # computed from the rows already in memory.
+    cart_items = cart.lines()
+    total = sum(item.subtotal() for item in cart_items)
+    counter = sum(item.quantity for item in cart_items)
     
     return render(request, 'cart/cart.html', {
         'cart_items': cart_items,
         'total': total,
-        'counter': counter
+        'counter': counter,
+        'cart_summary': {'count': counter, 'total': total},
     })
-    
-from django.db import transaction
 
 def add_cart(request, product_id):
     product = get_object_or_404(Product, id=product_id)
-    quantity = int(request.POST.get('quantity', 1))
-    
-    # Get or create cart
-    cart = _get_or_create_cart(request)
-    
-    # Update or create cart item
-    with transaction.atomic():  # Prevent race conditions
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
+    quantity = _quantity(request)
+    get_cart(request).add(product.id, quantity)
+    return redirect('cart:cart_detail')
+
+# Async variants, served under ASGI by ecom.urls_async
+async def acart_detail(request):
+    cart = await aget_cart(request)
+    # One query for the lines and their products; the totals are
+    # computed from the rows already in memory.
+    cart_items = await cart.alines()
+    total = sum(item.subtotal() for item in cart_items)
+    counter = sum(item.quantity for item in cart_items)
     
+    # Rendered by the handler, off the event loop
+    return TemplateResponse(request, 'cart/cart.html', {
+        'cart_items': cart_items,
+        'total': total,
+        'counter': counter,
+        'cart_summary': {'count': counter, 'total': total},
+    })
+
+async def aadd_cart(request, product_id):
+    product = await aget_object_or_404(Product, id=product_id)
+    quantity = _quantity(request)
+    await (await aget_cart(request)).aadd(product.id, quantity)
     return redirect('cart:cart_detail')
-# ... keep remove_cart and full_remove views as before ...
 
 def remove_cart(request, product_id):
-    cart = Cart.objects.get(cart_id=_get_or_create_cart(request))
-    product = get_object_or_404(Product, id=product_id)
-    cart_item = CartItem.objects.get(product=product, cart=cart)
-    
-    if cart_item.quantity > 1:
-        cart_item.quantity -= 1
-        cart_item.save()
-    else:
-        cart_item.delete()
-        
+    get_cart(request).decrement(product_id)
     return redirect('cart:cart_detail')
 
 def full_remove(request, product_id):
-    cart = Cart.objects.get(cart_id=_get_or_create_cart(request))
-    product = get_object_or_404(Product, id=product_id)
-    cart_item = CartItem.objects.get(product=product, cart=cart)
-    cart_item.delete()
-    return redirect('cart:cart_detail')
\ No newline at end of file
+    get_cart(request).remove(product_id)
+    return redirect('cart:cart_detail')
@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecom.settings')
+# Route the catalog, cart and payment views to their async variants
+os.environ.setdefault('ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -0,0 +1,261 @@
+"""
+Per-view request metrics.
+
+``MetricsMiddleware`` times every request and, through
+``connection.execute_wrapper``, counts and times its SQL. Template
+rendering is timed by the ``InstrumentedDjangoTemplates`` backend. The
+figures are added to in-process histograms labelled with the resolved URL
+name (``shop:product_list``...), which ``metrics_view`` serves at
+``/metrics`` in the Prometheus text format to staff users or to a scraper
+presenting ``METRICS_TOKEN``. Each worker process keeps its own figures;
+Prometheus sums them across scrape targets.
+
+Requests slower than ``METRICS_SLOW_REQUEST_MS`` are logged together with
+the statements they ran more than once, which is usually an N+1 query.
+
+The hot path is a few ``perf_counter`` calls and a counter update per
+query, plus one lock per request to fold the totals in.
+"""
+import logging
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import ContextVar
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.template.backends.django import DjangoTemplates, Template
+from django.utils.crypto import constant_time_compare
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+SLOW_LOG_STATEMENTS = 5
+
+_current = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    """What one request spent, filled in while it runs."""
+
+    __slots__ = ('queries', 'query_time', 'statements', 'template_time', 'rendering')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.statements = Counter()
+        self.template_time = 0.0
+        self.rendering = False
+
+    def __call__(self, execute, sql, params, many, context):
+        # connection.execute_wrapper hook
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.query_time += perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self):
+        """``(count, sql)`` of the statements run more than once, most repeated first."""
+        repeated = [(count, sql) for sql, count in self.statements.items() if count > 1]
+        return sorted(repeated, reverse=True)
+
+
+# ----- Metric types -----
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+class CounterMetric:
+    def __init__(self, name, help, labels):
+        self.name, self.help, self.labels = name, help, labels
+        self._series = {}
+
+    def inc(self, key):
+        self._series[key] = self._series.get(key, 0) + 1
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for key, value in sorted(self._series.items()):
+            yield f'{self.name}{{{_labels(self.labels, key)}}} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets):
+        self.name, self.help, self.labels, self.buckets = name, help, labels, buckets
+        # label values -> [count per bucket..., count above the last, sum]
+        self._series = {}
+
+    def observe(self, key, value):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def expose(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for key, series in sorted(self._series.items()):
+            labels = _labels(self.labels, key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                yield f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+            cumulative += series[-2]
+            yield f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}'
+            yield f'{self.name}_sum{{{labels}}} {series[-1]}'
+            yield f'{self.name}_count{{{labels}}} {cumulative}'
+
+
+REQUESTS = CounterMetric('django_requests_total', 'Requests by view and status.', ('view', 'status'))
+DURATION = Histogram('django_request_duration_seconds', 'Wall time per request.', ('view',), DURATION_BUCKETS)
+QUERIES = Histogram('django_request_queries', 'SQL statements per request.', ('view',), QUERY_BUCKETS)
+QUERY_TIME = Histogram('django_request_query_duration_seconds', 'Time in SQL per request.', ('view',), DURATION_BUCKETS)
+TEMPLATE_TIME = Histogram('django_request_template_duration_seconds', 'Time rendering templates per request.', ('view',), DURATION_BUCKETS)
+RESPONSE_SIZE = Histogram('django_response_size_bytes', 'Response body size.', ('view',), SIZE_BUCKETS)
+METRICS = (REQUESTS, DURATION, QUERIES, QUERY_TIME, TEMPLATE_TIME, RESPONSE_SIZE)
+
+_lock = threading.Lock()
+
+
+def record(view, status, duration, stats, size=None):
+    key = (view,)
+    with _lock:
+        REQUESTS.inc((view, status))
+        DURATION.observe(key, duration)
+        QUERIES.observe(key, stats.queries)
+        QUERY_TIME.observe(key, stats.query_time)
+        TEMPLATE_TIME.observe(key, stats.template_time)
+        if size is not None:
+            RESPONSE_SIZE.observe(key, size)
+
+
+def reset():
+    with _lock:
+        for metric in METRICS:
+            metric._series.clear()
+
+
+def expose():
+    """All metrics in the Prometheus text exposition format."""
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.expose()]
+    return '\n'.join(lines) + '\n'
+
+
+# ----- Middleware -----
+class MetricsMiddleware:
+    """Record the timings of every request; list this first in ``MIDDLEWARE``."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        stats, start = RequestStats(), perf_counter()
+        token = _current.set(stats)
+        try:
+            with ExitStack() as stack:
+                self.hook_connections(stack, stats)
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, stats, perf_counter() - start)
+
+    async def __acall__(self, request):
+        stats, start = RequestStats(), perf_counter()
+        token = _current.set(stats)
+        stack = ExitStack()
+        try:
+            # Connections are per thread: hook the ones of the thread the
+            # request's sync code, the ORM included, runs in
+            await sync_to_async(self.hook_connections)(stack, stats)
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+            _current.reset(token)
+        return self.record(request, response, stats, perf_counter() - start)
+
+    def hook_connections(self, stack, stats):
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+
+    def record(self, request, response, stats, duration):
+        match = request.resolver_match
+        view = match.view_name if match else '<unresolved>'
+        size = None if response.streaming else len(response.content)
+        record(view, response.status_code, duration, stats, size)
+
+        if duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            self.log_slow(request, view, duration, stats)
+        return response
+
+    def log_slow(self, request, view, duration, stats):
+        duplicates = ''.join(
+            f'\n  {count}x {sql}' for count, sql in stats.duplicates()[:SLOW_LOG_STATEMENTS]
+        )
+        logger.warning(
+            f"Slow request {request.method} {request.path} ({view}): {duration * 1000:.0f} ms, "
+            f"{stats.queries} queries in {stats.query_time * 1000:.0f} ms, "
+            f"templates {stats.template_time * 1000:.0f} ms"
+            + (f"; repeated statements:{duplicates}" if duplicates else '')
+        )
+
+
+# ----- Template timing -----
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        stats = _current.get()
+        if stats is None or stats.rendering:
+            # Outside a request, or a template rendered by another one
+            return super().render(context, request)
+        stats.rendering = True
+        start = perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            stats.template_time += perf_counter() - start
+            stats.rendering = False
+
+
+class InstrumentedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, with render times counted in the request metrics."""
+
+    def from_string(self, template_code):
+        return TimedTemplate(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+# ----- Endpoint -----
+def metrics_view(request):
+    """Serve the metrics to staff users or to a scraper holding ``METRICS_TOKEN``."""
+    token = settings.METRICS_TOKEN
+    authorized = request.user.is_staff or (
+        token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    )
+    if not authorized:
+        return HttpResponseForbidden()
+    return HttpResponse(expose(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,180 @@
+"""
+Rate limits for the views that write, counted in the shared cache.
+
+``RATE_LIMITS`` maps URL names to limits such as ``('ip', '10/m')``: at
+most ten POSTs a minute to that view from one address. A limit is keyed
+by the client's ``ip``, its logged-in ``user`` or its ``session``; a limit
+whose key the request doesn't have (no session yet, not logged in) is
+skipped.
+
+Each limit is a sliding window counter. Requests are counted in fixed
+windows of the limit's period with one ``cache.incr``, and the previous
+window's count is weighted by how much of it still overlaps the sliding
+window, so there is no burst of twice the limit at a window boundary.
+Only requests let through are counted: a client that keeps retrying gets
+in again as soon as its ``Retry-After`` says. Checking takes a read of both
+windows per limit (and an increment if allowed) and no SQL (``user``
+limits read the cached ``accounts.principal``), and a request over its
+limit gets a bare 429 with ``Retry-After`` before the view runs.
+
+Behind a reverse proxy every request comes from the proxy's address; set
+``RATELIMIT_TRUSTED_PROXIES`` to the number of proxies in front of the app
+and ``ip`` limits key on the client address they forward instead.
+
+The counters live in the ``ratelimit`` cache, so a flood of clients can't
+evict the pages and sessions in the default one. With ``LocMemCache`` every
+process counts on its own; set ``REDIS_RATELIMIT_URL`` to share the
+counters between workers.
+"""
+import math
+import time
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+from accounts.principal import get_principal
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+LIMITED_METHODS = {'POST'}
+
+# URL name -> (Limit, ...), parsed from RATE_LIMITS on first use
+_limits = None
+
+
+@dataclass(frozen=True)
+class Limit:
+    scope: str
+    count: int
+    period: int
+
+
+def parse_rate(scope, rate):
+    """``('ip', '10/5m')`` -> ``Limit('ip', 10, 300)``."""
+    count, period = rate.split('/')
+    return Limit(scope, int(count), int(period[:-1] or 1) * PERIODS[period[-1]])
+
+
+def get_limits():
+    global _limits
+    if _limits is None:
+        _limits = {
+            name: tuple(parse_rate(scope, rate) for scope, rate in rates)
+            for name, rates in settings.RATE_LIMITS.items()
+        }
+    return _limits
+
+
+@receiver(setting_changed)
+def _reset_limits(setting, **kwargs):
+    global _limits
+    if setting == 'RATE_LIMITS':
+        _limits = None
+
+
+def client_ip(request):
+    """
+    The address of the client, past the ``RATELIMIT_TRUSTED_PROXIES``
+    proxies that each appended the address they got the request from to
+    ``X-Forwarded-For``. Entries left of those are the client's to forge.
+    """
+    proxies = settings.RATELIMIT_TRUSTED_PROXIES
+    if proxies:
+        forwarded = [
+            address.strip() for address in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',')
+            if address.strip()
+        ]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def client_key(request, scope):
+    """What ``scope`` counts this request under, or None to skip the limit."""
+    if scope == 'ip':
+        return client_ip(request)
+    if scope == 'session':
+        return request.session.session_key
+    if scope == 'user':
+        principal = get_principal(request)
+        return principal.id if principal.is_authenticated else None
+    raise ValueError(f"Unknown rate limit scope {scope!r}")
+
+
+def _retry_after(limit, count, previous, elapsed):
+    """
+    Seconds until the sliding window has room for one more request, given
+    ``count`` in the current window and ``previous`` in the one before.
+    """
+    room = limit.count - 1
+    if count <= room:
+        # Once enough of the previous window has slid out
+        wait = limit.period * (1 - (room - count) / previous) - elapsed
+    else:
+        # Into the next window, once enough of this one has slid out
+        wait = limit.period - elapsed + limit.period * (1 - room / count)
+    return max(1, math.ceil(wait))
+
+
+def hit(key, limit, now=None, count=True):
+    """
+    Count a request against ``limit`` under ``key``; return 0 if it is
+    allowed, otherwise the seconds until it would be. Requests turned away
+    are not counted, and nothing is with ``count=False``.
+    """
+    cache = caches['ratelimit']
+    window, elapsed = divmod(time.time() if now is None else now, limit.period)
+    current, before = f'ratelimit:{key}:{int(window)}', f'ratelimit:{key}:{int(window) - 1}'
+    counts = cache.get_many([current, before])
+    so_far, previous = counts.get(current, 0), counts.get(before, 0)
+    overlap = 1 - elapsed / limit.period
+    if so_far + 1 + previous * overlap > limit.count:
+        return _retry_after(limit, so_far, previous, elapsed)
+    if not count:
+        return 0
+
+    try:
+        so_far = cache.incr(current)
+    except ValueError:
+        # Outlives the window, so the next one can still weigh it
+        if cache.add(current, 1, 2 * limit.period):
+            so_far = 1
+        else:
+            so_far = cache.incr(current)
+    if so_far + previous * overlap > limit.count:
+        # Another request got the last slot first
+        cache.decr(current)
+        return _retry_after(limit, so_far - 1, previous, elapsed)
+    return 0
+
+
+def throttled(retry_after):
+    response = HttpResponse('Too many requests, please slow down.', status=429,
+                            content_type='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    """Answer requests over a ``RATE_LIMITS`` limit of their view with a 429."""
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in LIMITED_METHODS:
+            return None
+        name = request.resolver_match.view_name
+        keyed = []
+        for limit in get_limits().get(name, ()):
+            key = client_key(request, limit.scope)
+            if key is not None:
+                keyed.append((f'{name}:{limit.scope}:{key}', limit))
+        if len(keyed) > 1:
+            # Turned away by one limit, so not counted by the others either
+            wait = max(hit(key, limit, count=False) for key, limit in keyed)
+            if wait:
+                return throttled(wait)
+        wait = max((hit(key, limit) for key, limit in keyed), default=0)
+        return throttled(wait) if wait else None
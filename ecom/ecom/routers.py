@@ -0,0 +1,83 @@
+"""
+Read-replica routing.
+
+Reads of the models in ``REPLICA_APPS`` (the catalog) go to the
+``replica`` database when one is configured; everything else, all writes
+and migrations stay on ``default``. Reads made inside a transaction on
+``default`` stay there too, so checkout sees the rows it locked and what
+it just wrote rather than a copy that may lag behind.
+
+A replica lags, so a client must not read from it right after writing:
+
+- Once a request writes, the rest of it reads from ``default``.
+- ``PrimaryPinMiddleware`` then gives that client a cookie that keeps its
+  requests on ``default`` for ``REPLICA_PIN_SECONDS``. A seller who saves
+  a product sees it on the dashboard they are redirected to.
+- Shared caches (the category registry, the search index, cached pages)
+  are rebuilt inside ``use_primary()``. A copy read from a lagging replica
+  and stored under the new version would otherwise stay stale until the
+  next write.
+"""
+from contextlib import contextmanager
+
+from asgiref.local import Local
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.deprecation import MiddlewareMixin
+
+REPLICA = 'replica'
+PIN_COOKIE = 'primary_pin'
+
+# Per request (or per thread outside one): pinned to default, wrote
+_local = Local()
+
+
+@contextmanager
+def use_primary():
+    """Send every read inside the block to ``default``."""
+    pinned = getattr(_local, 'pinned', False)
+    _local.pinned = True
+    try:
+        yield
+    finally:
+        _local.pinned = pinned
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if (
+            REPLICA in settings.DATABASES
+            and model._meta.app_label in settings.REPLICA_APPS
+            and not getattr(_local, 'pinned', False)
+            and not connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return REPLICA
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        _local.pinned = _local.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both databases hold the same rows
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class PrimaryPinMiddleware(MiddlewareMixin):
+    """Keep a client's reads on ``default`` for a while after it wrote."""
+
+    def process_request(self, request):
+        # Reset on every request: threads and their locals outlive requests
+        _local.pinned = PIN_COOKIE in request.COOKIES
+        _local.wrote = False
+
+    def process_response(self, request, response):
+        if getattr(_local, 'wrote', False) and REPLICA in settings.DATABASES:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS, httponly=True, samesite='Lax',
+            )
+        _local.pinned = _local.wrote = False
+        return response
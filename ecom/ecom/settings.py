@@ -31,27 +31,49 @@ INSTALLED_APPS = [
     'shop',
     'cart',
     'orders',
+    'benchmarks',
     'widget_tweaks',
     
 ]
 CART_SESSION_ID = 'cart'
 SESSION_COOKIE_AGE = 1209600
 DEFAULT_CURRENCY = 'usd' 
+PRODUCTS_PER_PAGE = 24
+SEARCH_RESULTS_LIMIT = 48
+SEARCH_SUGGEST_LIMIT = 8
+ORDERS_PER_PAGE = 20
+LOW_STOCK_THRESHOLD = 10  # Sellers are warned about products with fewer units
+LOW_STOCK_SHOWN = 20  # Low-stock products listed on the seller dashboard
+CART_MAX_QUANTITY = 20  # Units of one product a single add can put in the cart
+# Seconds stock stays held for an unpaid order; Stripe needs at least 30 minutes
+STOCK_RESERVATION_TTL = 45 * 60
 MIDDLEWARE = [
+    'ecom.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Static files, before the session and auth work they don't need
+    'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Outside the session middleware, so it sees the session being saved
+    'ecom.routers.PrimaryPinMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, so it sees the session, the user and the resolved view
+    'ecom.ratelimit.RateLimitMiddleware',
 ]
 
 ROOT_URLCONF = 'ecom.urls'
+# Set by ecom.asgi: serve the async variants of the busiest views
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS') == '1'
+if ASYNC_VIEWS:
+    ROOT_URLCONF = 'ecom.urls_async'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates with render times counted in the request metrics
+        'BACKEND': 'ecom.metrics.InstrumentedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')], 
         'APP_DIRS': True,
         'OPTIONS': {
@@ -59,8 +81,9 @@ TEMPLATES = [
                 'django.template.context_processors.debug',
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
+                'accounts.context_processors.principal',
                 'django.contrib.messages.context_processors.messages',
-            
+                'cart.context_processors.cart',
             ],
         },
     },
@@ -72,12 +95,115 @@ AUTH_USER_MODEL = 'accounts.CustomUser'
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE picks the database setup:
+#   sqlite        (default) SQLite in WAL mode with tuned pragmas
+#   sqlite-plain  SQLite with Django's defaults, to compare against
+#   postgres      PostgreSQL with persistent (or, with DB_POOL, pooled)
+#                 connections and an optional read replica (DB_REPLICA_HOST)
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+
+SQLITE_PRAGMAS = {
+    # Readers no longer block the writer (or each other)
+    'journal_mode': 'WAL',
+    # Safe with WAL: a crash can only lose the last commits, not corrupt
+    'synchronous': 'NORMAL',
+    # Wait for the write lock instead of failing with "database is locked"
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+if DB_PROFILE == 'postgres':
+    _postgres = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('DB_NAME', 'ecom'),
+        'USER': os.environ.get('DB_USER', 'ecom'),
+        'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+        'HOST': os.environ.get('DB_HOST', 'localhost'),
+        'PORT': os.environ.get('DB_PORT', '5432'),
+        'CONN_HEALTH_CHECKS': True,
+    }
+    if os.environ.get('DB_POOL'):
+        # psycopg's connection pool; it replaces persistent connections
+        _postgres['OPTIONS'] = {'pool': {
+            'min_size': int(os.environ.get('DB_POOL_MIN', 2)),
+            'max_size': int(os.environ.get('DB_POOL_MAX', 10)),
+            'timeout': 10,
+        }}
+    else:
+        _postgres['CONN_MAX_AGE'] = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+    DATABASES = {'default': _postgres}
+    if os.environ.get('DB_REPLICA_HOST'):
+        DATABASES['replica'] = {
+            **_postgres,
+            'HOST': os.environ['DB_REPLICA_HOST'],
+            'PORT': os.environ.get('DB_REPLICA_PORT', _postgres['PORT']),
+            'TEST': {'MIRROR': 'default'},
+        }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            # A file (not in-memory) test database lets the concurrency tests
+            # open one connection per thread.
+            'TEST': {
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
     }
+    if DB_PROFILE == 'sqlite':
+        DATABASES['default']['OPTIONS'] = {
+            'init_command': ''.join(f'PRAGMA {name}={value};' for name, value in SQLITE_PRAGMAS.items()),
+            # Take the write lock at BEGIN: a transaction that reads and then
+            # writes can otherwise fail at once instead of waiting its turn
+            'transaction_mode': 'IMMEDIATE',
+        }
+
+# Catalog reads go to the replica when there is one (see ecom.routers)
+DATABASE_ROUTERS = ['ecom.routers.ReplicaRouter']
+REPLICA_APPS = {'shop'}
+# Seconds a client that wrote keeps reading from default, past replica lag
+REPLICA_PIN_SECONDS = 10
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ecom',
+    },
+    # Rate limit counters (ecom.ratelimit), kept apart so a flood of
+    # clients can't evict cached pages and sessions
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'ratelimit',
+        'OPTIONS': {'MAX_ENTRIES': 100000},
+    },
 }
+# Share cached pages (and the version tokens that invalidate them) between
+# worker processes; needs the redis package
+if os.environ.get('REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    }
+# And the rate limit counters, in a Redis of their own: one with an eviction
+# policy shared with the pages would let a flood evict them all the same
+if os.environ.get('REDIS_RATELIMIT_URL'):
+    CACHES['ratelimit'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_RATELIMIT_URL'],
+    }
+# Anonymous catalog pages served by shop.page_cache; also bounds how stale
+# stock counts changed by checkout can be
+PAGE_CACHE_TIMEOUT = 60
+# The version tokens of shop.categories, shop.search and shop.page_cache
+# tell every worker its in-process copies are stale. A process-local cache
+# can't reach the other workers, so without Redis the tokens expire instead
+# and each worker reloads its copies at least this often.
+CACHE_VERSION_TIMEOUT = None if os.environ.get('REDIS_URL') else 60
+# Sessions are read from the cache, so cached pages cost no SQL
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 
 
 # Password validation
@@ -119,6 +245,11 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static'),
 ]
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+# Hashed, precompressed copies written by collectstatic (see ecom.storage)
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'ecom.storage.StaticFilesStorage'},
+}
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
@@ -132,11 +263,14 @@ LOGIN_URL = 'login'          # Redirect unauthenticated users
 # At the bottom of settings.py
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+IMAGE_DERIVATIVE_WORKERS = 2      # Threads resizing uploads in the background
+IMAGE_DERIVATIVES_EAGER = False   # Resize inline instead (tests, scripts)
 
 # Email Configuration (Development)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Prints to console
 EMAIL_HOST = 'localhost'
 EMAIL_PORT = 1025
+DEFAULT_FROM_EMAIL = 'orders@ecommerce.local'  # Sender of queued order emails
 
 # Password Reset Settings
 PASSWORD_RESET_TIMEOUT = 14400  # 4 hours (in seconds)
@@ -144,6 +278,12 @@ PASSWORD_RESET_TIMEOUT = 14400  # 4 hours (in seconds)
 STRIPE_PUBLIC_KEY = os.environ.get('SPK')
 STRIPE_SECRET_KEY = os.environ.get('SSK')
 STRIPE_WEBHOOK_SECRET = os.environ.get('SWS')
+# Payment gateway (orders.payments); STRIPE_API_BASE overrides api.stripe.com
+STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+STRIPE_TIMEOUT = (3.05, 10)  # connect, read (seconds)
+STRIPE_MAX_NETWORK_RETRIES = 2
+# Connections per process; under ASGI also the most Stripe calls in flight
+STRIPE_HTTP_POOL_SIZE = int(os.environ.get('STRIPE_HTTP_POOL_SIZE', 10))
 
 LOGGING = {
     'version': 1,
@@ -160,5 +300,25 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': True,
         },
+        # Slow requests and the statements they repeated
+        'ecom.metrics': {
+            'handlers': ['file'],
+            'level': 'WARNING',
+        },
     },
-}
\ No newline at end of file
+}
+
+# POSTs allowed per URL name (ecom.ratelimit): (key, "count/period"), where
+# the key is the client's ip, user or session and the period s, m, h or d
+RATE_LIMITS = {
+    'cart:cart_add': [('session', '30/m'), ('ip', '120/m')],
+    'orders:order_create': [('user', '5/m'), ('session', '5/m'), ('ip', '30/m')],
+    'login': [('ip', '10/m'), ('ip', '50/h')],
+}
+# Reverse proxies in front of the app that append the client address to
+# X-Forwarded-For; ip limits key on the address the outermost one saw
+RATELIMIT_TRUSTED_PROXIES = int(os.environ.get('RATELIMIT_TRUSTED_PROXIES', 0))
+
+# Request metrics (ecom.metrics), scraped from /metrics with this bearer token
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+METRICS_SLOW_REQUEST_MS = 500
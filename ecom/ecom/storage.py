@@ -0,0 +1,24 @@
+"""
+Static files with content-hashed names, served for as long as browsers like.
+
+``collectstatic`` copies every file under a name that embeds a hash of its
+content (``styles.3f2a9c1e8b4d.css``), records the mapping in
+``staticfiles.json`` and writes gzip (and, with the Brotli package, brotli)
+copies next to it. ``{% static %}`` renders the hashed names, and
+WhiteNoise serves them with ``Cache-Control: max-age=315360000, immutable``
+and picks the compressed copy the browser accepts. A changed file gets a
+new name, so browsers never revalidate and never see a stale one.
+"""
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class StaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """
+    Falls back to the plain names until ``collectstatic`` has written a
+    manifest (development, tests), instead of failing every page.
+    """
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
@@ -0,0 +1,248 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.templatetags.static import static
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, override_settings
+from asgiref.sync import iscoroutinefunction
+from django.urls import resolve, reverse
+from accounts.models import CustomUser
+from shop.models import Category, Product
+from orders.models import Order
+from . import metrics, ratelimit
+from .routers import PIN_COOKIE, PrimaryPinMiddleware, ReplicaRouter, _local, use_primary
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        seller = CustomUser.objects.create_user(username='seller', password='pass', user_type='seller')
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            seller=seller, category=category, name='Novel', slug='novel',
+            image='products/test.jpg', price='9.99', stock=20,
+        )
+
+    def series(self, name, view):
+        return metrics.expose().split(f'{name}{{view="{view}"}} ')[1].split('\n')[0]
+
+    def test_requests_are_recorded_per_view(self):
+        for i in range(2):
+            self.client.get(self.product.get_absolute_url())
+        self.client.get('/no/such/page/')
+
+        text = metrics.expose()
+        self.assertIn('django_requests_total{view="shop:product_detail",status="200"} 2', text)
+        self.assertIn('django_requests_total{view="<unresolved>",status="404"} 1', text)
+        self.assertIn('django_request_duration_seconds_bucket{view="shop:product_detail",le="+Inf"} 2', text)
+        self.assertEqual(self.series('django_request_queries_count', 'shop:product_detail'), '2')
+        # The second request was served from the page cache
+        self.assertEqual(self.series('django_request_queries_sum', 'shop:product_detail'), '2')
+        self.assertGreater(float(self.series('django_request_template_duration_seconds_sum', 'shop:product_detail')), 0)
+        self.assertGreater(float(self.series('django_response_size_bytes_sum', 'shop:product_detail')), 1000)
+
+    @override_settings(ROOT_URLCONF='ecom.urls_async')
+    async def test_async_requests_are_recorded(self):
+        await self.async_client.get(self.product.get_absolute_url())
+        text = metrics.expose()
+        self.assertIn('django_requests_total{view="shop:product_detail",status="200"} 1', text)
+        # Counted in the thread the ORM ran in, as under WSGI
+        self.assertEqual(self.series('django_request_queries_sum', 'shop:product_detail'), '2')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('h', 'Help.', ('view',), (1, 5))
+        for value in (0, 1, 3, 9):
+            histogram.observe(('v',), value)
+        self.assertEqual(list(histogram.expose())[2:], [
+            'h_bucket{view="v",le="1"} 2',
+            'h_bucket{view="v",le="5"} 3',
+            'h_bucket{view="v",le="+Inf"} 4',
+            'h_sum{view="v"} 13',
+            'h_count{view="v"} 4',
+        ])
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_log_repeated_statements(self):
+        user = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.client.force_login(user)
+        with self.assertLogs('ecom.metrics', 'WARNING') as logs:
+            self.client.get(reverse('shop:product_list'))
+        self.assertIn('(shop:product_list)', logs.output[0])
+
+        stats = metrics.RequestStats()
+        stats.statements.update(['SELECT 1', 'SELECT 2', 'SELECT 2'])
+        self.assertEqual(stats.duplicates(), [(2, 'SELECT 2')])
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_endpoint_is_protected(self):
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(url, headers={'Authorization': 'Bearer nope'}).status_code, 403)
+
+        response = self.client.get(url, headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+
+        staff = CustomUser.objects.create_user(username='staff', password='pass', is_staff=True)
+        self.client.force_login(staff)
+        self.assertContains(self.client.get(url), '# TYPE django_requests_total counter')
+
+
+class ReplicaRouterTests(SimpleTestCase):
+    router = ReplicaRouter()
+
+    def setUp(self):
+        # Writes made by earlier tests on this thread pin it to default
+        _local.pinned = _local.wrote = False
+
+    def test_everything_uses_default_without_a_replica(self):
+        self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_catalog_reads_go_to_the_replica(self):
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.assertEqual(self.router.db_for_read(Order), 'default')
+            self.assertEqual(self.router.db_for_write(Product), 'default')
+            self.assertFalse(self.router.allow_migrate('replica', 'shop'))
+
+    def test_reads_inside_a_transaction_stay_on_default(self):
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            with mock.patch('ecom.routers.connections') as connections:
+                connections.__getitem__.return_value.in_atomic_block = True
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_reads_after_a_write_stay_on_default(self):
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            with use_primary():
+                self.assertEqual(self.router.db_for_read(Product), 'default')
+            self.assertEqual(self.router.db_for_read(Product), 'replica')
+            self.router.db_for_write(Product)
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+
+    def test_clients_that_wrote_stay_on_default_for_a_while(self):
+        def view(request):
+            if request.method == 'POST':
+                self.router.db_for_write(Product)
+            return HttpResponse(self.router.db_for_read(Product))
+
+        middleware = PrimaryPinMiddleware(view)
+        factory = RequestFactory()
+        with mock.patch.dict(settings.DATABASES, {'replica': {}}):
+            response = middleware(factory.post('/'))
+            self.assertEqual(response.cookies[PIN_COOKIE]['max-age'], settings.REPLICA_PIN_SECONDS)
+            pinned = factory.get('/')
+            pinned.COOKIES[PIN_COOKIE] = '1'
+            self.assertEqual(middleware(pinned).content, b'default')
+            response = middleware(factory.get('/'))
+            self.assertEqual(response.content, b'replica')
+            self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+class AsyncUrlconfTests(SimpleTestCase):
+    def test_busiest_views_have_async_variants(self):
+        for path in ('/shop/', '/shop/1/novel/', '/cart/', '/cart/add/1/', '/orders/payment/process/'):
+            sync = resolve(path)
+            variant = resolve(path, urlconf='ecom.urls_async')
+            self.assertEqual(variant.view_name, sync.view_name)
+            self.assertFalse(iscoroutinefunction(sync.func), path)
+            self.assertTrue(iscoroutinefunction(variant.func), path)
+        self.assertFalse(iscoroutinefunction(resolve('/cart/remove/1/', urlconf='ecom.urls_async').func))
+
+
+class StaticFilesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        settings_override = override_settings(STATIC_ROOT=root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.root = Path(root)
+
+    def test_pages_link_hashed_stylesheets(self):
+        url = static('shop/css/list.css')
+        self.assertRegex(url, r'^/static/shop/css/list\.[0-9a-f]{12}\.css$')
+        response = Client().get(reverse('shop:product_list'))
+        self.assertContains(response, url)
+        self.assertNotContains(response, '<style')
+
+    def test_hashed_files_are_compressed_and_cached_for_good(self):
+        url = static('cart/css/cart.css')
+        self.assertTrue((self.root / f'{url.removeprefix(settings.STATIC_URL)}.gz').exists())
+        response = Client().get(url, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+@override_settings(RATE_LIMITS={'cart:cart_add': [('ip', '3/m')], 'login': [('session', '1/m')]})
+class RateLimitTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = CustomUser.objects.create_user(username='seller', password='pass', user_type='seller')
+        category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            seller=seller, category=category, name='Novel', slug='novel',
+            image='products/test.jpg', price='9.99', stock=20,
+        )
+        self.url = reverse('cart:cart_add', args=[self.product.id])
+        caches['ratelimit'].clear()
+
+    def test_posts_over_the_limit_get_a_429(self):
+        for i in range(3):
+            self.assertEqual(self.client.post(self.url).status_code, 302)
+        # Turned away before the view, the session or the database
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url)
+        self.assertEqual(response.status_code, 429)
+        # Into the next minute, until a third of this one's 3 slid out
+        self.assertTrue(20 <= int(response['Retry-After']) <= 80)
+
+        self.assertEqual(self.client.get(reverse('cart:cart_detail')).status_code, 200)
+        other = Client(REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(other.post(self.url).status_code, 302)
+
+    def test_limits_without_a_key_are_skipped(self):
+        # No session yet: the login limit has nothing to count
+        for i in range(3):
+            response = Client().post(reverse('login'), {'username': 'seller', 'password': 'nope'})
+            self.assertEqual(response.status_code, 200)
+
+    def test_window_slides(self):
+        limit = ratelimit.parse_rate('ip', '10/m')
+        self.assertEqual(limit, ratelimit.Limit('ip', 10, 60))
+        for i in range(10):
+            self.assertEqual(ratelimit.hit('k', limit, now=59), 0)
+        # Room for one more once a tenth of them slid out of the window
+        self.assertEqual(ratelimit.hit('k', limit, now=59), 7)
+        # All 10 of the last window still count at the start of the next
+        self.assertEqual(ratelimit.hit('k', limit, now=60), 6)
+        # Half of them by halfway through
+        self.assertEqual(ratelimit.hit('k', limit, now=90), 0)
+
+    def test_requests_turned_away_are_not_counted(self):
+        limit = ratelimit.parse_rate('ip', '30/m')
+        waits = [ratelimit.hit('k', limit, now=10) for i in range(200)]
+        self.assertEqual(waits.count(0), 30)
+        # The same answer every time, however often the client retries
+        self.assertEqual(set(waits[30:]), {52})
+        self.assertEqual(ratelimit.hit('k', limit, now=61), 1)
+        self.assertEqual(ratelimit.hit('k', limit, now=62), 0)
+
+    def test_ip_limits_key_on_the_client_behind_trusted_proxies(self):
+        request = RequestFactory().post(
+            '/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='6.6.6.6, 203.0.113.7',
+        )
+        self.assertEqual(ratelimit.client_key(request, 'ip'), '10.0.0.1')
+        with override_settings(RATELIMIT_TRUSTED_PROXIES=1):
+            # The client can prepend anything; only what the proxy added counts
+            self.assertEqual(ratelimit.client_key(request, 'ip'), '203.0.113.7')
+            direct = RequestFactory().post('/', REMOTE_ADDR='198.51.100.2')
+            self.assertEqual(ratelimit.client_key(direct, 'ip'), '198.51.100.2')
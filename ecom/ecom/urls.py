@@ -3,6 +3,7 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from django.views.generic.base import RedirectView
+from .metrics import metrics_view
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', RedirectView.as_view(url='/accounts/login/', permanent=False)),
@@ -10,5 +11,6 @@ urlpatterns = [
     path('shop/',include('shop.urls', namespace = 'shop')),
     path('cart/',include('cart.urls', namespace = 'cart')),
     path('orders/',include('orders.urls', namespace = 'orders')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
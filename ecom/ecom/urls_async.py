@@ -0,0 +1,39 @@
+"""
+The URLconf under ASGI: ``ecom.urls`` with the async variants of the busiest
+views swapped in.
+
+Under WSGI a coroutine view costs an event loop per request, so the sync
+views stay the default; ``ecom.asgi`` sets ``ASYNC_VIEWS`` and the settings
+then point ``ROOT_URLCONF`` here. The routes and their names are the same.
+"""
+from django.urls import URLPattern, URLResolver
+
+from cart import views as cart_views
+from orders import views as order_views
+from shop import views as shop_views
+from . import urls
+
+VARIANTS = {
+    shop_views.product_list: shop_views.aproduct_list,
+    shop_views.product_detail: shop_views.aproduct_detail,
+    cart_views.cart_detail: cart_views.acart_detail,
+    cart_views.add_cart: cart_views.aadd_cart,
+    order_views.payment_process: order_views.apayment_process,
+}
+
+
+def with_variants(patterns):
+    swapped = []
+    for entry in patterns:
+        if isinstance(entry, URLResolver):
+            entry = URLResolver(
+                entry.pattern, with_variants(entry.url_patterns), entry.default_kwargs,
+                entry.app_name, entry.namespace,
+            )
+        elif isinstance(entry, URLPattern) and entry.callback in VARIANTS:
+            entry = URLPattern(entry.pattern, VARIANTS[entry.callback], entry.default_args, entry.name)
+        swapped.append(entry)
+    return swapped
+
+
+urlpatterns = with_variants(urls.urlpatterns)
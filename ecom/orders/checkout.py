@@ -0,0 +1,69 @@
+from django.db import transaction
+
+from shop.models import Product
+from .models import OrderItem
+from .reservations import held_quantities, hold
+
+
+class InsufficientStock(Exception):
+    """Raised when a cart line asks for more units than are left."""
+
+    def __init__(self, product=None):
+        if product is not None:
+            super().__init__(f"Insufficient stock for product {product.id}")
+        else:
+            super().__init__("Insufficient stock")
+        self.product = product
+
+
+def place_order(order, cart):
+    """
+    Turn the contents of ``cart`` (a ``cart.storage`` backend) into
+    ``order`` in a single transaction.
+
+    The statement count does not depend on the number of lines: the order
+    row is inserted, every product is locked with one ``SELECT ... FOR
+    UPDATE`` (in primary key order, so concurrent checkouts can't deadlock),
+    the live holds on them are summed once the locks are held, the lines
+    and the stock holds (see ``orders.reservations``) are written with
+    ``bulk_create`` and the cart emptied (one ``DELETE`` for a database
+    cart, none for a session cart). Raises ``InsufficientStock`` and rolls
+    everything back if any product cannot cover its quantity.
+    """
+    quantities = cart.quantities()
+    if not quantities:
+        raise ValueError("Cannot place an order for an empty cart")
+
+    with transaction.atomic():
+        # Writing first also takes SQLite's write lock up front, which
+        # serializes checkouts the way row locks do on other backends.
+        order.save()
+
+        products = list(
+            Product.objects.select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+            .only('id', 'name', 'price', 'stock', 'seller_id')
+        )
+        # A separate statement, so it sees the holds of any checkout that
+        # held the locks before us (see orders.reservations)
+        held = held_quantities(quantities)
+        for product in products:
+            product.available_stock = product.stock - held.get(product.id, 0)
+            if product.available_stock < quantities[product.id]:
+                raise InsufficientStock(product)
+
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=product,
+                seller_id=product.seller_id,
+                price=product.price,
+                quantity=quantities[product.id],
+            )
+            for product in products
+        ])
+        hold(order, products, quantities)
+        cart.clear()
+
+    return order
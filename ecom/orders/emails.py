@@ -0,0 +1,129 @@
+"""
+Outgoing email, queued in the database and sent by a worker.
+
+Request handlers call ``queue_*`` inside the same transaction as the change
+the email announces, so an email exists exactly when that change was
+committed and the request never waits on the mail server. The
+``send_queued_emails`` management command calls ``send_queued`` to deliver
+due messages in batches over one connection, retrying failures with
+exponential backoff.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import EmailOutbox, line_items_prefetch
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+# Retry after 1, 2, 4, 8, 16 minutes...
+BACKOFF_BASE = timedelta(minutes=1)
+BACKOFF_MAX = timedelta(hours=1)
+# A claimed batch is retried if its worker dies before reporting back
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def queue_order_confirmation(order):
+    """Queue the payment confirmation for ``order``."""
+    prefetch_related_objects([order], line_items_prefetch())
+    context = {'order': order}
+    return EmailOutbox.objects.create(
+        order=order,
+        to=[order.email],
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        subject=f"Order #{order.id} Confirmation",
+        body=render_to_string('orders/email/order_confirmation.txt', context),
+        html_body=render_to_string('orders/email/order_confirmation.html', context),
+    )
+
+
+def backoff(attempts):
+    """Delay before the next try after ``attempts`` failed ones."""
+    return min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+
+
+def _claim(batch_size, now):
+    """Take up to ``batch_size`` due emails, hiding them from other workers."""
+    with transaction.atomic():
+        due = (
+            EmailOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        emails = list(due)
+        EmailOutbox.objects.filter(id__in=[e.id for e in emails]).update(
+            next_attempt_at=now + CLAIM_TIMEOUT
+        )
+    return emails
+
+
+def _message(email, connection):
+    message = EmailMultiAlternatives(
+        email.subject, email.body, email.from_email, email.to, connection=connection
+    )
+    if email.html_body:
+        message.attach_alternative(email.html_body, 'text/html')
+    return message
+
+
+def send_queued(batch_size=100, connection=None):
+    """
+    Send one batch of due emails and return ``(sent, failed)``.
+
+    The whole batch goes over a single connection. A message that fails is
+    rescheduled with exponential backoff and given up on (status
+    ``failed``) after ``MAX_ATTEMPTS`` tries.
+    """
+    now = timezone.now()
+    emails = _claim(batch_size, now)
+    if not emails:
+        return 0, 0
+
+    connection = connection or get_connection()
+    sent = failed = 0
+    try:
+        connection.open()
+    except Exception as e:
+        # The server is down: the whole batch counts as one failed attempt
+        logger.warning(f"Could not connect to the mail server: {e}")
+        for email in emails:
+            _record_failure(email, e, now)
+        EmailOutbox.objects.bulk_update(emails, ['status', 'attempts', 'next_attempt_at', 'last_error'])
+        return 0, len(emails)
+
+    try:
+        for email in emails:
+            try:
+                connection.send_messages([_message(email, connection)])
+            except Exception as e:
+                _record_failure(email, e, now)
+                failed += 1
+            else:
+                email.attempts += 1
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                sent += 1
+    finally:
+        connection.close()
+        EmailOutbox.objects.bulk_update(
+            emails, ['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at']
+        )
+    return sent, failed
+
+
+def _record_failure(email, error, now):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'failed'
+        logger.error(f"Giving up on email {email.id} after {email.attempts} attempts: {error}")
+    else:
+        email.next_attempt_at = now + backoff(email.attempts)
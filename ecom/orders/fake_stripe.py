@@ -0,0 +1,128 @@
+"""
+An in-process stand-in for the Stripe API.
+
+``FakeStripe`` serves the few endpoints the shop calls on a local port, so
+tests and benchmarks exercise the real ``StripeClient`` networking
+(pooling, timeouts, retries) without leaving the machine. It answers
+``POST /v1/checkout/sessions`` like Stripe does, replays the stored
+response for a repeated ``Idempotency-Key``, and can add latency or fail
+the next few requests with a retryable error. Point the gateway at it with
+``STRIPE_API_BASE = fake.url``.
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        params = dict(parse_qsl(body))
+        key = self.headers.get('Idempotency-Key')
+        status, payload = fake.handle(self.path, params, key)
+        self.send(status, payload)
+
+    def send(self, status, payload):
+        data = json.dumps(payload).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if status >= 500:
+                self.send_header('Stripe-Should-Retry', 'true')
+            self.end_headers()
+            self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client timed out and hung up, as tests of timeouts make it
+            self.close_connection = True
+
+
+class FakeStripe:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.sessions = {}
+        self._responses = {}
+        self._failures = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        self._server.daemon_threads = True
+        self._server.fake = self
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset(self):
+        """Forget every request, session and stored idempotent reply."""
+        with self._lock:
+            self.requests = 0
+            self.sessions.clear()
+            self._responses.clear()
+            self._failures = 0
+
+    def fail_next(self, count=1):
+        """Answer the next ``count`` requests with a retryable 500."""
+        self._failures = count
+
+    def handle(self, path, params, key):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.requests += 1
+            if self._failures:
+                self._failures -= 1
+                return 500, {'error': {'type': 'api_error', 'message': 'Injected failure'}}
+            if key and key in self._responses:
+                return self._responses[key]
+            if path == '/v1/checkout/sessions':
+                response = 200, self._checkout_session(params)
+            else:
+                response = 404, {'error': {'type': 'invalid_request_error',
+                                           'message': f'Unrecognized request URL (POST: {path})'}}
+            if key:
+                self._responses[key] = response
+            return response
+
+    def _checkout_session(self, params):
+        session_id = f'cs_test_{uuid.uuid4().hex}'
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'client_reference_id': params.get('client_reference_id'),
+            'expires_at': int(params.get('expires_at') or time.time() + 24 * 3600),
+            'mode': params.get('mode', 'payment'),
+            'payment_intent': None,
+            'status': 'open',
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+            'url': f'{self.url}/pay/{session_id}',
+        }
+        self.sessions[session_id] = session
+        return session
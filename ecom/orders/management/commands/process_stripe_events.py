@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = 'Handle the Stripe webhook events stored by the webhook view'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Events to take per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep polling for events instead of exiting once none are due')
+        parser.add_argument('--interval', type=float, default=1.0,
+                            help='Seconds to wait between polls when no events are due')
+
+    def handle(self, *args, **options):
+        total_processed = total_failed = 0
+        while True:
+            processed, failed = process_events(batch_size=options['batch_size'])
+            total_processed += processed
+            total_failed += failed
+            if processed or failed:
+                self.stdout.write(f"Processed {processed}, failed {failed}")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total_processed} processed, {total_failed} failed"
+        ))
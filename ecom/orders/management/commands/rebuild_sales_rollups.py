@@ -0,0 +1,21 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from orders import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from the order lines, e.g. to backfill them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='first', type=date.fromisoformat,
+                            help='First day to rebuild (YYYY-MM-DD); default: the first paid order')
+        parser.add_argument('--to', dest='last', type=date.fromisoformat,
+                            help='Last day to rebuild (YYYY-MM-DD); default: the last paid order')
+        parser.add_argument('--chunk-days', type=int, default=rollups.CHUNK_DAYS,
+                            help='Days to rebuild per transaction')
+
+    def handle(self, *args, **options):
+        written = rollups.rebuild(options['first'], options['last'], chunk_days=options['chunk_days'])
+        self.stdout.write(f"{written} sales rollup rows rebuilt")
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from orders.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Give back the stock held for orders that were not paid in time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Holds to delete per batch')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep sweeping instead of exiting once nothing has expired')
+        parser.add_argument('--interval', type=float, default=30.0,
+                            help='Seconds to wait between sweeps when nothing has expired')
+
+    def handle(self, *args, **options):
+        total_released = total_canceled = 0
+        while True:
+            released, canceled = release_expired(batch_size=options['batch_size'])
+            total_released += released
+            total_canceled += canceled
+            if released:
+                self.stdout.write(f"Released {released} holds, canceled {canceled} orders")
+                continue
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {total_released} holds released, {total_canceled} orders canceled"
+        ))
@@ -0,0 +1,53 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def copy_sales_fields(apps, schema_editor):
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    OrderItem.objects.update(seller=models.Subquery(
+        Product.objects.filter(id=models.OuterRef('product_id')).values('seller_id')[:1]
+    ))
+    OrderItem.objects.filter(order__status__in=['paid', 'shipped']).update(paid=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_stripe_event'),
+        ('shop', '0002_product_catalog_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='paid',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='seller',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(copy_sales_fields, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created', '-id'], name='orders_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', '-created', '-id'], name='orders_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['seller', '-id'], name='orders_item_seller_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['seller', 'product', 'paid', 'quantity', 'price'], name='orders_item_sales_idx'),
+        ),
+    ]
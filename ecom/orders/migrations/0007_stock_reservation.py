@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:07
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def hold_pending_orders(apps, schema_editor):
+    """Pending orders already took their units out of stock; hold them instead."""
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+    StockReservation = apps.get_model('orders', 'StockReservation')
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    lines = OrderItem.objects.filter(order__status='pending').values_list('order_id', 'product_id', 'quantity')
+    for order_id, product_id, quantity in lines.iterator():
+        Product.objects.filter(id=product_id).update(stock=models.F('stock') + quantity)
+        StockReservation.objects.create(
+            order_id=order_id, product_id=product_id, quantity=quantity, expires_at=expires_at,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_history_indexes'),
+        ('shop', '0004_product_seller_slug_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField()),
+                ('expires_at', models.DateTimeField()),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at', 'quantity'], name='orders_reservation_live_idx'), models.Index(fields=['expires_at'], name='orders_reservation_expiry_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'product'), name='orders_reservation_unique')],
+            },
+        ),
+        migrations.RunPython(hold_pending_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:37
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_paid_at(apps, schema_editor):
+    # The payment time wasn't kept; the order's is the nearest we have
+    Order = apps.get_model('orders', 'Order')
+    Order.objects.filter(status__in=['paid', 'shipped']).update(paid_at=models.F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_checkout_session'),
+        ('shop', '0006_stock_movement'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSalesDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SellerSalesDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('units', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('orders', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ('day',),
+            },
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='paid_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_paid_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['paid_at'], name='orders_paid_at_idx'),
+        ),
+        migrations.AddField(
+            model_name='productsalesday',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_days', to='shop.product'),
+        ),
+        migrations.AddField(
+            model_name='productsalesday',
+            name='seller',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='product_sales_days', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='sellersalesday',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sales_days', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='productsalesday',
+            index=models.Index(fields=['seller', 'day'], name='orders_product_day_seller_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsalesday',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='orders_product_day_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellersalesday',
+            constraint=models.UniqueConstraint(fields=('seller', 'day'), name='orders_seller_day_unique'),
+        ),
+    ]
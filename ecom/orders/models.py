@@ -1,7 +1,24 @@
+from decimal import Decimal
 from django.db import models
+from django.db.models import DecimalField, F, IntegerField, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from shop.models import Product
 from accounts.models import CustomUser
 
+class OrderQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``total_cost``, summed by the database."""
+        return self.annotate(total_cost=Coalesce(
+            Sum(F('items__price') * F('items__quantity'), output_field=DecimalField()),
+            Decimal('0.00'),
+            output_field=DecimalField(),
+        ))
+
+    def with_lines(self):
+        """Prefetch the order lines together with their products."""
+        return self.prefetch_related(line_items_prefetch())
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -9,12 +26,17 @@ class Order(models.Model):
         ('shipped', 'Shipped'),
         ('canceled', 'Canceled'),
     ]
-    
     stripe_id = models.CharField(max_length=250, blank=True, null=True)
+    # The open Checkout Session, reused when the payment form is sent again
+    stripe_checkout_id = models.CharField(max_length=255, blank=True)
+    stripe_checkout_url = models.URLField(max_length=1000, blank=True)
+    stripe_checkout_expires = models.DateTimeField(null=True, blank=True)
     user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     created = models.DateTimeField(auto_now_add=True)
     updated = models.DateTimeField(auto_now=True)
+    # When the payment came through; its day is the one the sales rollups count
+    paid_at = models.DateTimeField(null=True, blank=True)
     currency = models.CharField(max_length=3, default='USD')
     
     # Shipping details
@@ -24,23 +46,231 @@ class Order(models.Model):
     city = models.CharField(max_length=100)
     phone = models.CharField(max_length=20)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(fields=['user', '-created', '-id'], name='orders_user_created_idx'),
+            models.Index(fields=['status', '-created', '-id'], name='orders_status_created_idx'),
+            # The rollup backfill reads the orders paid in a range of days
+            models.Index(fields=['paid_at'], name='orders_paid_at_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.full_name} ({self.status})"
 
     def get_total_cost(self):
-        return sum(item.get_cost() for item in self.items.all())
+        # Free with with_totals() or with_lines(), one aggregate otherwise
+        total = getattr(self, 'total_cost', None)
+        if total is None:
+            if 'items' in getattr(self, '_prefetched_objects_cache', {}):
+                total = sum((item.get_cost() for item in self.items.all()), Decimal('0.00'))
+            else:
+                total = self.items.aggregate(total=Coalesce(
+                    Sum(F('price') * F('quantity'), output_field=DecimalField()),
+                    Decimal('0.00'),
+                    output_field=DecimalField(),
+                ))['total']
+        # SQLite hands back computed decimals without their trailing zeros
+        return total.quantize(Decimal('0.01'))
+
+class OrderItemQuerySet(models.QuerySet):
+    def paid(self):
+        """Lines of orders that have been paid for."""
+        return self.filter(paid=True)
+
+    def sales_summary(self):
+        """Aggregate ``revenue`` and ``units`` in one query."""
+        return self.aggregate(
+            revenue=Coalesce(
+                Sum(F('price') * F('quantity'), output_field=DecimalField()),
+                Decimal('0.00'),
+                output_field=DecimalField(),
+            ),
+            units=Coalesce(Sum('quantity'), 0),
+        )
+
+    def units_by_product(self):
+        """Units and revenue per product id, best sellers first."""
+        return (
+            self.values('product_id')
+            .annotate(
+                units=Sum('quantity'),
+                revenue=Sum(F('price') * F('quantity'), output_field=DecimalField()),
+            )
+            .order_by('-units', 'product_id')
+        )
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, related_name='order_items', on_delete=models.PROTECT)  # Prevent accidental deletion
+    # Copied from the product and the order so a seller's sales don't need a join
+    seller = models.ForeignKey(CustomUser, related_name='sales', on_delete=models.SET_NULL, null=True, blank=True)
+    paid = models.BooleanField(default=False)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = OrderItemQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['seller', '-id'], name='orders_item_seller_idx'),
+            # Covers the sales aggregates, so they never touch the table
+            models.Index(fields=['seller', 'product', 'paid', 'quantity', 'price'], name='orders_item_sales_idx'),
+        ]
+
     def __str__(self):
-        return f"{self.quantity}x {self.product.name} (Order #{self.order.id})"
+        return f"{self.quantity}x {self.product.name} (Order #{self.order_id})"
 
     def get_cost(self):
-        return self.price * self.quantity
\ No newline at end of file
+        return self.price * self.quantity
+
+def line_items_prefetch():
+    """``Prefetch`` of an order's lines with their products selected."""
+    return Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+
+
+class EmailOutbox(models.Model):
+    """An email waiting to be sent by the ``send_queued_emails`` worker."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='emails', on_delete=models.SET_NULL, null=True, blank=True)
+    to = models.JSONField(default=list)
+    from_email = models.CharField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='orders_outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
+
+
+class StripeEvent(models.Model):
+    """A verified Stripe webhook event, stored once per event id."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    ]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    received = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ('received',)
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='orders_stripe_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.event_id} ({self.status})"
+
+
+class StockReservationQuerySet(models.QuerySet):
+    def live(self, now=None):
+        """The holds that haven't expired by ``now``."""
+        return self.filter(expires_at__gt=now or timezone.now())
+
+    def held(self, product_ids, now=None):
+        """``{product id: units}`` held by the live holds on ``product_ids``."""
+        return dict(
+            self.live(now).filter(product_id__in=product_ids)
+            .values('product_id')
+            .annotate(total=Sum('quantity'))
+            .values_list('product_id', 'total')
+            .order_by()
+        )
+
+    def held_of(self, product, now=None):
+        """The units the live holds keep of ``product`` (e.g. an ``OuterRef``), as an expression."""
+        held = self.live(now).filter(product=product).values('product').annotate(total=Sum('quantity')).values('total')
+        return Coalesce(Subquery(held, output_field=IntegerField()), 0, output_field=IntegerField())
+
+
+class StockReservation(models.Model):
+    """Units of a product held for a pending order until ``expires_at``."""
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['order', 'product'], name='orders_reservation_unique'),
+        ]
+        indexes = [
+            # Covers the per-product sum of live holds
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='orders_reservation_live_idx'),
+            # The sweeper deletes by expiry range
+            models.Index(fields=['expires_at'], name='orders_reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity}x product {self.product_id} for order #{self.order_id}"
+
+
+class ProductSalesDay(models.Model):
+    """A product's paid sales on one day, kept up to date by orders.rollups."""
+    day = models.DateField()
+    product = models.ForeignKey(Product, related_name='sales_days', on_delete=models.CASCADE)
+    seller = models.ForeignKey(CustomUser, related_name='product_sales_days', on_delete=models.SET_NULL, null=True, blank=True)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'day'], name='orders_product_day_unique'),
+        ]
+        indexes = [
+            # A seller's best sellers over a range of days
+            models.Index(fields=['seller', 'day'], name='orders_product_day_seller_idx'),
+        ]
+
+    def __str__(self):
+        return f"Product {self.product_id} on {self.day}: {self.units} sold"
+
+
+class SellerSalesDay(models.Model):
+    """A seller's paid sales on one day, kept up to date by orders.rollups."""
+    day = models.DateField()
+    seller = models.ForeignKey(CustomUser, related_name='sales_days', on_delete=models.CASCADE)
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    orders = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('day',)
+        constraints = [
+            # Also the index the analytics time series reads
+            models.UniqueConstraint(fields=['seller', 'day'], name='orders_seller_day_unique'),
+        ]
+
+    def __str__(self):
+        return f"Seller {self.seller_id} on {self.day}: ${self.revenue}"
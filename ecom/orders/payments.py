@@ -0,0 +1,162 @@
+"""
+The payment gateway: every call to the Stripe API goes through here.
+
+One ``StripeClient`` per process shares a pooled ``requests`` session, so
+checkouts reuse warm HTTPS connections instead of opening one each. Calls
+have explicit connect and read timeouts and are retried a bounded number
+of times under an idempotency key derived from the order, so a retry
+can't create a second Checkout Session. The session created for an order is
+kept on the order, and a second submit of the payment form is redirected
+to it without another API call.
+
+``astart_checkout`` is the async views' way in. The shop has no async HTTP
+client, so the same pooled client runs on a dedicated thread pool the size
+of the connection pool: a slow Stripe holds one of those threads, never the
+event loop or the thread that runs the request's ORM calls.
+
+``STRIPE_API_BASE`` points the client somewhere other than Stripe, such as
+``orders.fake_stripe.FakeStripe`` in tests and benchmarks.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import requests
+import stripe
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Don't send a buyer to a session that is about to close under them
+REUSE_MARGIN = timedelta(minutes=5)
+
+_client = None
+_executor = None
+_client_lock = threading.Lock()
+
+
+class PaymentError(Exception):
+    """Stripe couldn't be reached or refused the request."""
+
+
+def get_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=settings.STRIPE_HTTP_POOL_SIZE
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _client = stripe.StripeClient(
+                settings.STRIPE_SECRET_KEY or '',
+                http_client=stripe.RequestsClient(
+                    # requests takes a (connect, read) pair
+                    timeout=settings.STRIPE_TIMEOUT, session=session,
+                ),
+                max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+                base_addresses={'api': settings.STRIPE_API_BASE} if settings.STRIPE_API_BASE else {},
+            )
+    return _client
+
+
+def get_executor():
+    global _executor
+    with _client_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.STRIPE_HTTP_POOL_SIZE, thread_name_prefix='stripe'
+            )
+    return _executor
+
+
+@receiver(setting_changed)
+def _reset_client(setting, **kwargs):
+    global _client, _executor
+    if setting.startswith('STRIPE_'):
+        with _client_lock:
+            _client = None
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+                _executor = None
+
+
+def cached_checkout_url(order):
+    """The URL of ``order``'s open Checkout Session, if it has one worth reusing."""
+    expires = order.stripe_checkout_expires
+    if order.stripe_checkout_url and expires and expires > timezone.now() + REUSE_MARGIN:
+        return order.stripe_checkout_url
+    return None
+
+
+def _session_request(order, success_url, cancel_url, expires_at):
+    """The Checkout Session parameters and request options for ``order``."""
+    # Whole minutes, so a double submit in the same minute sends the same
+    # parameters under the same key and gets the same session back
+    expires = int(expires_at.replace(second=0, microsecond=0).timestamp())
+    params = {
+        'mode': 'payment',
+        'client_reference_id': str(order.id),
+        'success_url': success_url,
+        'cancel_url': cancel_url,
+        'expires_at': expires,
+        'line_items': [
+            {
+                'price_data': {
+                    'unit_amount': int(item.price * 100),
+                    'currency': settings.DEFAULT_CURRENCY,
+                    'product_data': {'name': item.product.name},
+                },
+                'quantity': item.quantity,
+            }
+            for item in order.items.all()
+        ],
+    }
+    return params, {'idempotency_key': f'order-{order.id}-checkout-{expires}'}
+
+
+def _create_session(order_id, params, options):
+    try:
+        return get_client().checkout.sessions.create(params, options)
+    except stripe.StripeError as e:
+        logger.error(f"Stripe error for order {order_id}: {str(e)}")
+        raise PaymentError(str(e)) from e
+
+
+def _keep_session(order, session):
+    """Copy ``session`` onto ``order``; return the fields to save."""
+    order.stripe_checkout_id = session.id
+    order.stripe_checkout_url = session.url
+    order.stripe_checkout_expires = datetime.fromtimestamp(session.expires_at, tz=dt_timezone.utc)
+    if session.payment_intent:
+        order.stripe_id = session.payment_intent
+    return ['stripe_checkout_id', 'stripe_checkout_url', 'stripe_checkout_expires', 'stripe_id', 'updated']
+
+
+def start_checkout(order, success_url, cancel_url, expires_at):
+    """
+    Create a Checkout Session for ``order`` that closes at ``expires_at``,
+    store it on the order and return its URL.
+
+    Expects the order's lines to be prefetched with their products.
+    """
+    params, options = _session_request(order, success_url, cancel_url, expires_at)
+    session = _create_session(order.id, params, options)
+    order.save(update_fields=_keep_session(order, session))
+    return session.url
+
+
+async def astart_checkout(order, success_url, cancel_url, expires_at):
+    """``start_checkout`` for async views."""
+    params, options = _session_request(order, success_url, cancel_url, expires_at)
+    create = sync_to_async(_create_session, thread_sensitive=False, executor=get_executor())
+    session = await create(order.id, params, options)
+    await order.asave(update_fields=_keep_session(order, session))
+    return session.url
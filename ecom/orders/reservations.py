@@ -0,0 +1,167 @@
+"""
+Stock held for orders that haven't been paid for yet.
+
+Placing an order no longer takes units out of ``Product.stock``: it writes
+a ``StockReservation`` ("hold") per line that lasts
+``STOCK_RESERVATION_TTL`` seconds. What can still be promised to a buyer is
+the stock less the unexpired holds (``with_available_stock``, or
+``held_quantities`` for rows already locked). A hold that has expired
+stops counting at once, whether or not the sweeper has deleted it.
+
+Checkout must sum the holds in a statement of its own, after the one that
+locks the products. Under READ COMMITTED a statement sees the rows
+committed before it started, so a sum taken inside the locking ``SELECT``
+would miss the holds of the checkout it waited behind, and both would
+sell the same units.
+
+The listing cards (``shop.cards``) show the available figure too: placing
+and ending holds refreshes the cards of their products. A hold that
+expires keeps counting on the cards until the sweeper deletes it, so they
+can under-promise for a while, never over-promise.
+
+Holds end in one of two ways. ``commit_order`` (payment succeeded) takes
+the units out of stock and deletes the holds in one transaction, so the
+available figure doesn't move. ``release_order`` (payment canceled or
+failed) and ``release_expired`` (the ``release_expired_reservations``
+sweeper) delete them and cancel the order if it is still pending.
+"""
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, PositiveIntegerField, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from shop.cards import refresh_stock
+from shop.models import Product
+from .models import Order, StockReservation
+
+logger = logging.getLogger(__name__)
+
+
+# Stripe won't open a Checkout Session that closes sooner than this
+CHECKOUT_MIN_LIFETIME = timedelta(minutes=30)
+
+
+def hold_expiry(now=None):
+    return (now or timezone.now()) + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+
+def with_available_stock(products, now=None):
+    """Annotate ``available_stock``: the stock less the unexpired holds on it."""
+    return products.annotate(
+        available_stock=F('stock') - StockReservation.objects.held_of(OuterRef('pk'), now)
+    )
+
+
+def held_quantities(product_ids, now=None):
+    """``{product id: units}`` held by the unexpired holds on ``product_ids``."""
+    return StockReservation.objects.held(product_ids, now)
+
+
+def hold(order, products, quantities, now=None):
+    """Hold ``quantities[product.id]`` units of each of ``products`` for ``order``."""
+    expires_at = hold_expiry(now)
+    holds = StockReservation.objects.bulk_create([
+        StockReservation(
+            order=order, product=product, quantity=quantities[product.id], expires_at=expires_at,
+        )
+        for product in products
+    ])
+    # The listing cards show what is left to promise
+    refresh_stock([product.id for product in products])
+    return holds
+
+
+def hold_deadline(order):
+    """
+    The latest ``order``'s holds can run to: the first hold's lifetime and
+    then at most one more, for a Checkout Session opened near its end.
+    """
+    return order.created + 2 * timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+
+def extend_holds(order, now=None):
+    """
+    Restart the clock on ``order``'s live holds for a new Checkout Session,
+    but never past ``hold_deadline``. Return the new expiry, or None if
+    there are no live holds or too little time is left to open a session,
+    so that re-posting the payment form can't keep stock held forever.
+    """
+    now = now or timezone.now()
+    expires_at = min(hold_expiry(now), hold_deadline(order))
+    if expires_at < now + CHECKOUT_MIN_LIFETIME:
+        return None
+    extended = StockReservation.objects.filter(order=order, expires_at__gt=now).update(
+        expires_at=expires_at
+    )
+    return expires_at if extended else None
+
+
+def commit_order(order):
+    """Take the units of a paid ``order`` out of stock and drop its holds."""
+    quantities = dict(order.items.values_list('product_id', 'quantity'))
+    with transaction.atomic():
+        # Lock in primary key order, like checkout, so the two can't deadlock
+        stock = dict(
+            Product.objects.select_for_update()
+            .filter(id__in=quantities)
+            .order_by('id')
+            .values_list('id', 'stock')
+        )
+        for product_id, quantity in quantities.items():
+            if stock.get(product_id, 0) < quantity:
+                # Only possible when the hold expired and the units were sold again
+                logger.error(f"Order {order.id} was paid for {quantity} of product {product_id} "
+                             f"but only {stock.get(product_id, 0)} are left")
+        Product.objects.filter(id__in=quantities).update(stock=Case(
+            *(When(id=product_id, then=Greatest(F('stock') - quantity, 0))
+              for product_id, quantity in quantities.items()),
+            default=F('stock'),
+            output_field=PositiveIntegerField(),
+        ))
+        StockReservation.objects.filter(order=order).delete()
+        # update() skips post_save, which keeps the listing cards current
+        refresh_stock(list(quantities))
+
+
+def release_order(order_id):
+    """Give back the holds of an unpaid order and cancel it."""
+    with transaction.atomic():
+        canceled = Order.objects.filter(id=order_id, status='pending').update(status='canceled')
+        holds = StockReservation.objects.filter(order_id=order_id)
+        product_ids = list(holds.values_list('product_id', flat=True))
+        if product_ids:
+            holds.delete()
+            refresh_stock(product_ids)
+    return bool(canceled)
+
+
+def release_expired(batch_size=1000, now=None):
+    """
+    Delete one batch of expired holds and cancel their orders; return
+    ``(holds released, orders canceled)``.
+
+    The batch is a range of the expiry index ending at the expiry of the
+    ``batch_size``-th oldest hold, so it is removed with one ``DELETE``.
+    All the holds of an order share their expiry and go in the same batch.
+    """
+    now = now or timezone.now()
+    expired = StockReservation.objects.filter(expires_at__lte=now)
+    boundary = list(
+        expired.order_by('expires_at').values_list('expires_at', flat=True)[batch_size - 1:batch_size]
+    )
+    batch = StockReservation.objects.filter(expires_at__lte=boundary[0] if boundary else now)
+
+    with transaction.atomic():
+        held = list(batch.values_list('order_id', 'product_id'))
+        if not held:
+            return 0, 0
+        released, _ = batch.delete()
+        refresh_stock({product_id for order_id, product_id in held})
+        canceled = Order.objects.filter(
+            id__in={order_id for order_id, product_id in held}, status='pending',
+        ).update(status='canceled')
+    return released, canceled
@@ -0,0 +1,171 @@
+"""
+Daily sales totals per product and per seller.
+
+Reports used to add up ``OrderItem`` rows at query time, so a chart over
+two years read every line sold in them. ``ProductSalesDay`` and
+``SellerSalesDay`` hold the units, revenue and number of orders of one
+product or seller on one day (the local day of ``Order.paid_at``), so the
+same chart reads one row per day.
+
+The rows are kept up to date incrementally: the webhook handler that marks
+an order paid calls ``record_paid_order`` in the same transaction, which
+adds the order's lines onto the rows of its day with one ``UPDATE ... SET
+units = units + CASE ...`` per table. An order is only marked paid once,
+so it is only added once.
+
+``rebuild`` recomputes a range of days from the order lines, a chunk of
+days per transaction (the ``rebuild_sales_rollups`` command). Use it to
+backfill after upgrading, or after changing orders behind the handler's
+back. A day rebuilt while orders are being paid for it can miss them, so
+backfill past days, or rebuild today again once it is over.
+"""
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, Max, Min, PositiveIntegerField, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductSalesDay, SellerSalesDay
+
+CHUNK_DAYS = 31
+BATCH_SIZE = 500
+REVENUE = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _totals(lines):
+    return lines.annotate(
+        units=Sum('quantity'),
+        revenue=Sum(F('price') * F('quantity'), output_field=REVENUE),
+        orders=Count('order_id', distinct=True),
+    )
+
+
+# ----- Incremental -----
+def record_paid_order(order):
+    """Add the lines of ``order``, just marked paid, to the rollups of its day."""
+    day = timezone.localdate(order.paid_at)
+    products, sellers, seller_of = {}, {}, {}
+    for line in _totals(order.items.values('product_id', 'seller_id')):
+        products[line['product_id']] = (line['units'], line['revenue'], 1)
+        seller_of[line['product_id']] = line['seller_id']
+        if line['seller_id'] is not None:
+            units, revenue, orders = sellers.get(line['seller_id'], (0, Decimal('0.00'), 1))
+            sellers[line['seller_id']] = (units + line['units'], revenue + line['revenue'], orders)
+    _add(ProductSalesDay, 'product_id', day, products, seller_id=seller_of)
+    _add(SellerSalesDay, 'seller_id', day, sellers)
+
+
+def _add(model, key, day, totals, **fields):
+    """
+    Add ``totals`` ({key: (units, revenue, orders)}) onto the ``model`` rows
+    of ``day``, creating the missing ones; ``fields`` maps a field name to
+    its value per key for the rows created.
+    """
+    if not totals:
+        return
+    model.objects.bulk_create([
+        model(day=day, **{key: value}, **{name: values[value] for name, values in fields.items()})
+        for value in totals
+    ], ignore_conflicts=True)
+
+    def added(position, output_field):
+        return Case(
+            *(When(**{key: value}, then=Value(total[position])) for value, total in totals.items()),
+            default=Value(0),
+            output_field=output_field,
+        )
+
+    model.objects.filter(day=day, **{f'{key}__in': list(totals)}).update(
+        units=F('units') + added(0, PositiveIntegerField()),
+        revenue=F('revenue') + added(1, REVENUE),
+        orders=F('orders') + added(2, PositiveIntegerField()),
+    )
+
+
+# ----- Backfill -----
+def _start_of(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def rebuild(first=None, last=None, chunk_days=CHUNK_DAYS):
+    """
+    Recompute the rollups of the days from ``first`` to ``last`` (by
+    default, those of the first and the last paid order) from the order
+    lines, ``chunk_days`` at a time; return the number of rows written.
+    """
+    if first is None or last is None:
+        bounds = Order.objects.aggregate(first=Min('paid_at'), last=Max('paid_at'))
+        if bounds['first'] is None:
+            return 0
+        first = first or timezone.localdate(bounds['first'])
+        last = last or timezone.localdate(bounds['last'])
+    written = 0
+    while first <= last:
+        end = min(first + timedelta(days=chunk_days - 1), last)
+        written += _rebuild_days(first, end)
+        first = end + timedelta(days=1)
+    return written
+
+
+def _rebuild_days(first, last):
+    lines = (
+        OrderItem.objects.paid()
+        .filter(order__paid_at__gte=_start_of(first), order__paid_at__lt=_start_of(last + timedelta(days=1)))
+        .annotate(day=TruncDate('order__paid_at', tzinfo=timezone.get_current_timezone()))
+    )
+    with transaction.atomic():
+        products = [
+            ProductSalesDay(**row)
+            for row in _totals(lines.values('day', 'product_id', 'seller_id')).order_by()
+        ]
+        sellers = [
+            SellerSalesDay(**row)
+            for row in _totals(lines.exclude(seller=None).values('day', 'seller_id')).order_by()
+        ]
+        ProductSalesDay.objects.filter(day__range=(first, last)).delete()
+        SellerSalesDay.objects.filter(day__range=(first, last)).delete()
+        ProductSalesDay.objects.bulk_create(products, batch_size=BATCH_SIZE)
+        SellerSalesDay.objects.bulk_create(sellers, batch_size=BATCH_SIZE)
+    return len(products) + len(sellers)
+
+
+# ----- Reading -----
+@dataclass
+class SalesPoint:
+    start: object
+    end: object
+    units: int = 0
+    revenue: Decimal = Decimal('0.00')
+    orders: int = 0
+
+
+def seller_timeline(seller_id, first, last, bucket_days=1):
+    """
+    ``SalesPoint``s of ``seller_id`` from ``first`` to ``last``, one per
+    ``bucket_days`` days, with the days that sold nothing at zero.
+    """
+    points = []
+    start = first
+    while start <= last:
+        points.append(SalesPoint(start, min(start + timedelta(days=bucket_days - 1), last)))
+        start += timedelta(days=bucket_days)
+    rows = SellerSalesDay.objects.filter(seller_id=seller_id, day__range=(first, last))
+    for day, units, revenue, orders in rows.values_list('day', 'units', 'revenue', 'orders'):
+        point = points[(day - first).days // bucket_days]
+        point.units += units
+        point.revenue += revenue
+        point.orders += orders
+    return points
+
+
+def top_products(seller_id, first, last):
+    """Units, revenue and orders per product id from ``first`` to ``last``, best first."""
+    return (
+        ProductSalesDay.objects.filter(seller_id=seller_id, day__range=(first, last))
+        .values('product_id')
+        .annotate(units=Sum('units'), revenue=Sum('revenue'), orders=Sum('orders'))
+        .order_by('-revenue', 'product_id')
+    )
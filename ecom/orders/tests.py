@@ -1,3 +1,811 @@
-from django.test import TestCase
+import hashlib
+import hmac
+import json
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import CustomUser
+from cart.models import Cart, CartItem
+from cart.storage import DatabaseCart, SessionCart
+from shop.factories import make_products
+from shop.models import Product, ProductCard
+from .checkout import InsufficientStock, place_order
+from .emails import MAX_ATTEMPTS, queue_order_confirmation, send_queued
+from .fake_stripe import FakeStripe
+from .models import (
+    EmailOutbox, Order, OrderItem, ProductSalesDay, SellerSalesDay, StockReservation, StripeEvent,
+)
+from .payments import PaymentError, start_checkout
+from .reservations import extend_holds, hold, release_expired, with_available_stock
+from .webhooks import handle_checkout_session, handle_checkout_session_failed, process_events
+
+
+def make_order(**kwargs):
+    return Order(
+        full_name='Buyer', email='buyer@example.com', address='1 Street',
+        city='Town', phone='123', **kwargs
+    )
+
+
+def fill_cart(cart, products, quantity=1):
+    return CartItem.objects.bulk_create([
+        CartItem(cart=cart, product=product, quantity=quantity) for product in products
+    ])
+
+
+class PlaceOrderTests(TestCase):
+    def setUp(self):
+        self.products = make_products(50)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+
+    def test_query_count_is_independent_of_cart_size(self):
+        # cart lines, savepoint, order insert, locking select, live holds,
+        # order item insert, holds insert, card stock, cart delete, release
+        for size in (5, 50):
+            fill_cart(self.cart, self.products[:size])
+            with self.assertNumQueries(10):
+                place_order(make_order(), DatabaseCart(self.buyer))
+
+    def test_session_cart_checkout(self):
+        cart = SessionCart(SessionStore())
+        cart.add(self.products[0].id, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            order = place_order(make_order(), cart)
+        self.assertEqual(order.items.get().quantity, 3)
+        self.assertEqual(cart.quantities(), {})
+
+    def test_stock_is_held_and_cart_emptied(self):
+        fill_cart(self.cart, self.products[:3], quantity=4)
+        order = place_order(make_order(), DatabaseCart(self.buyer))
+
+        self.assertEqual(order.items.count(), 3)
+        products = with_available_stock(Product.objects.filter(id__in=[p.id for p in self.products[:3]]))
+        self.assertEqual({(p.stock, p.available_stock) for p in products}, {(10, 6)})
+        self.assertEqual(order.reservations.count(), 3)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_insufficient_stock_rolls_everything_back(self):
+        items = fill_cart(self.cart, self.products[:2], quantity=4)
+        CartItem.objects.filter(id=items[1].id).update(quantity=11)
+
+        with self.assertRaises(InsufficientStock) as raised:
+            place_order(make_order(), DatabaseCart(self.buyer))
+
+        self.assertEqual(raised.exception.product, self.products[1])
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Product.objects.get(id=self.products[0].id).stock, 10)
+        self.assertEqual(self.cart.items.count(), 2)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.products = make_products(2, stock=5)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+
+    def place(self, quantity=2):
+        fill_cart(self.cart, self.products, quantity=quantity)
+        return place_order(make_order(), DatabaseCart(self.buyer))
+
+    def available(self):
+        return list(with_available_stock(Product.objects.order_by('id')).values_list('available_stock', flat=True))
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('stock', flat=True))
+
+    def expire(self, order):
+        order.reservations.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def test_holds_count_against_what_can_be_sold(self):
+        self.place(quantity=3)
+        with self.assertRaises(InsufficientStock) as raised:
+            self.place(quantity=3)
+        self.assertEqual(raised.exception.product.available_stock, 2)
+        self.assertEqual(self.stock(), [5, 5])
+
+    def test_expired_holds_stop_counting_before_the_sweep(self):
+        self.expire(self.place(quantity=3))
+        self.place(quantity=3)
+        self.assertEqual(self.stock(), [5, 5])
+
+    def test_payment_takes_held_units_out_of_stock(self):
+        order = self.place()
+        handle_checkout_session({'client_reference_id': order.id, 'payment_intent': 'pi_1'})
+        self.assertEqual(self.stock(), [3, 3])
+        self.assertEqual(self.available(), [3, 3])
+        self.assertFalse(order.reservations.exists())
+
+    def test_payment_updates_the_listing_cards(self):
+        order = self.place()
+        handle_checkout_session({'client_reference_id': order.id, 'payment_intent': 'pi_1'})
+        self.assertEqual(list(ProductCard.objects.order_by('id').values_list('stock', flat=True)), [3, 3])
+
+    def test_listing_cards_and_detail_page_show_what_is_not_held(self):
+        product = self.products[0]
+        order = self.place()
+        self.assertEqual(list(ProductCard.objects.order_by('id').values_list('stock', flat=True)), [3, 3])
+        response = self.client.get(product.get_absolute_url())
+        self.assertContains(response, '3 in stock')
+        self.assertContains(response, 'max="3"')
+
+        handle_checkout_session_failed({'client_reference_id': order.id})
+        self.assertEqual(list(ProductCard.objects.order_by('id').values_list('stock', flat=True)), [5, 5])
+
+        self.expire(self.place(quantity=1))
+        release_expired()
+        self.assertEqual(list(ProductCard.objects.order_by('id').values_list('stock', flat=True)), [5, 5])
+
+    def test_payment_after_release_is_still_recorded(self):
+        order = self.place()
+        handle_checkout_session_failed({'client_reference_id': order.id})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'canceled')
+        self.assertEqual(self.available(), [5, 5])
+
+        handle_checkout_session({'client_reference_id': order.id, 'payment_intent': 'pi_1'})
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'paid')
+        self.assertEqual(self.stock(), [3, 3])
+
+    def test_sweeper_releases_expired_holds_in_batches(self):
+        orders = [self.place(quantity=1) for i in range(3)]
+        for order in orders[:2]:
+            self.expire(order)
+
+        # batch boundary, savepoint, its holds, range delete, card stock,
+        # cancel, release
+        with self.assertNumQueries(7):
+            self.assertEqual(release_expired(batch_size=2), (2, 1))
+        self.assertEqual(release_expired(batch_size=2), (2, 1))
+        self.assertEqual(release_expired(batch_size=2), (0, 0))
+
+        statuses = list(Order.objects.order_by('id').values_list('status', flat=True))
+        self.assertEqual(statuses, ['canceled', 'canceled', 'pending'])
+        self.assertEqual(self.available(), [4, 4])
+
+    def test_sweeper_command(self):
+        self.expire(self.place())
+        out = StringIO()
+        call_command('release_expired_reservations', stdout=out)
+        self.assertIn('2 holds released, 1 orders canceled', out.getvalue())
+
+    def test_canceling_payment_releases_holds(self):
+        self.client.force_login(self.buyer)
+        order = self.place()
+        session = self.client.session
+        session['order_id'] = order.id
+        session.save()
+
+        self.client.get(reverse('orders:payment_canceled'))
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'canceled')
+        self.assertFalse(order.reservations.exists())
+        self.assertNotIn('order_id', self.client.session)
+
+    def test_paying_for_an_expired_order_is_refused(self):
+        self.client.force_login(self.buyer)
+        order = self.place()
+        self.expire(order)
+        session = self.client.session
+        session['order_id'] = order.id
+        session.save()
+
+        response = self.client.post(reverse('orders:payment_process'))
+        self.assertTemplateUsed(response, 'orders/order_expired.html')
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'canceled')
+
+
+    def test_holds_are_extended_at_most_one_session_past_the_first(self):
+        order = self.place()
+        now = timezone.now()
+        ttl = timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+        Order.objects.filter(id=order.id).update(created=now - ttl - timedelta(minutes=5))
+        order.refresh_from_db()
+        # Capped at the order's time plus two hold lifetimes
+        self.assertEqual(extend_holds(order, now=now), order.created + 2 * ttl)
+        self.assertEqual(set(order.reservations.values_list('expires_at', flat=True)), {order.created + 2 * ttl})
+
+        # Once a new session would close too soon, there is no extension
+        later = order.created + 2 * ttl - timedelta(minutes=20)
+        self.assertIsNone(extend_holds(order, now=later))
+
+    def test_reposting_the_payment_form_cannot_hold_stock_forever(self):
+        self.client.force_login(self.buyer)
+        order = self.place()
+        Order.objects.filter(id=order.id).update(
+            created=timezone.now() - timedelta(seconds=2 * settings.STOCK_RESERVATION_TTL - 600),
+        )
+        session = self.client.session
+        session['order_id'] = order.id
+        session.save()
+
+        response = self.client.post(reverse('orders:payment_process'))
+        self.assertTemplateUsed(response, 'orders/order_expired.html')
+        self.assertFalse(order.reservations.exists())
+
+
+class OrderCreateViewTests(TestCase):
+    def setUp(self):
+        self.products = make_products(3)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+        self.client.force_login(self.buyer)
+
+    def post(self):
+        return self.client.post(reverse('orders:order_create'), {
+            'full_name': 'Buyer', 'email': 'buyer@example.com',
+            'email_confirmation': 'buyer@example.com', 'address': '1 Street',
+            'city': 'Town', 'phone': '123',
+        })
+
+    def test_checkout_creates_order_and_redirects_to_payment(self):
+        fill_cart(self.cart, self.products, quantity=2)
+        response = self.post()
+        self.assertRedirects(response, reverse('orders:payment_process'), fetch_redirect_response=False)
+        order = Order.objects.get()
+        self.assertEqual(self.client.session['order_id'], order.id)
+        self.assertEqual(order.items.count(), 3)
+
+    def test_sold_out_product_renders_stock_error(self):
+        fill_cart(self.cart, self.products, quantity=11)
+        response = self.post()
+        self.assertTemplateUsed(response, 'orders/stock_error.html')
+        self.assertFalse(Order.objects.exists())
+
+
+class PaymentGatewayTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.fake = FakeStripe().start()
+        cls.addClassCleanup(cls.fake.stop)
+
+    def setUp(self):
+        # Order ids repeat between tests, and so would idempotency keys
+        self.fake.reset()
+        self.fake.latency = 0
+        settings = self.settings(STRIPE_API_BASE=self.fake.url, STRIPE_SECRET_KEY='sk_test_123')
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        products = make_products(2)
+        self.buyer = buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        fill_cart(Cart.objects.create(user=buyer), products)
+        self.order = place_order(make_order(user=buyer), DatabaseCart(buyer))
+        self.client.force_login(buyer)
+        session = self.client.session
+        session['order_id'] = self.order.id
+        session.save()
+
+    def pay(self):
+        return self.client.post(reverse('orders:payment_process'))
+
+    def test_checkout_session_is_created_and_kept_on_the_order(self):
+        response = self.pay()
+        self.order.refresh_from_db()
+        session = self.fake.sessions[self.order.stripe_checkout_id]
+        self.assertRedirects(response, session['url'], status_code=303, fetch_redirect_response=False)
+        self.assertEqual(session['client_reference_id'], str(self.order.id))
+        self.assertEqual(self.order.stripe_checkout_url, session['url'])
+        # The holds last as long as the session
+        self.assertGreaterEqual(
+            self.order.reservations.first().expires_at, self.order.stripe_checkout_expires
+        )
+
+    def test_second_submit_reuses_the_session(self):
+        first = self.pay()
+        second = self.pay()
+        self.assertEqual(first['Location'], second['Location'])
+        self.assertEqual(self.fake.requests, 1)
+
+    def test_retries_use_one_idempotency_key(self):
+        self.fake.fail_next(1)
+        self.pay()
+        self.assertEqual(self.fake.requests, 2)
+        self.assertEqual(len(self.fake.sessions), 1)
+
+        # The same order and expiry minute get the same session back
+        order = Order.objects.with_lines().get(id=self.order.id)
+        expires_at = order.reservations.first().expires_at
+        url = start_checkout(order, 'http://x/ok', 'http://x/no', expires_at)
+        self.assertEqual(url, order.stripe_checkout_url)
+        self.assertEqual(len(self.fake.sessions), 1)
+
+    def test_stripe_errors_render_the_error_page(self):
+        self.fake.fail_next(3)
+        with self.settings(STRIPE_MAX_NETWORK_RETRIES=1):
+            response = self.pay()
+        self.assertTemplateUsed(response, 'orders/payment_error.html')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.stripe_checkout_url, '')
+
+    @override_settings(ROOT_URLCONF='ecom.urls_async')
+    async def test_checkout_under_asgi(self):
+        await self.async_client.aforce_login(self.buyer)
+        session = await self.async_client.asession()
+        await session.aset('order_id', self.order.id)
+        await session.asave()
+
+        response = await self.async_client.post(reverse('orders:payment_process'))
+        await self.order.arefresh_from_db()
+        self.assertRedirects(response, self.order.stripe_checkout_url, status_code=303, fetch_redirect_response=False)
+        response = await self.async_client.post(reverse('orders:payment_process'))
+        self.assertEqual(response['Location'], self.order.stripe_checkout_url)
+        self.assertEqual(self.fake.requests, 1)
+
+    def test_slow_stripe_times_out(self):
+        self.fake.latency = 0.5
+        order = Order.objects.with_lines().get(id=self.order.id)
+        with self.settings(STRIPE_TIMEOUT=(1, 0.1), STRIPE_MAX_NETWORK_RETRIES=0):
+            with self.assertRaises(PaymentError):
+                start_checkout(order, 'http://x/ok', 'http://x/no', timezone.now() + timedelta(hours=1))
+
+
+class OrderQuerySetTests(TestCase):
+    def setUp(self):
+        self.products = make_products(30)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+
+    def place(self, size):
+        fill_cart(self.cart, self.products[:size], quantity=2)
+        return place_order(make_order(), DatabaseCart(self.buyer))
+
+    def test_with_totals_annotates_total(self):
+        order = self.place(3)
+        empty = make_order()
+        empty.save()
+        totals = dict(Order.objects.with_totals().values_list('id', 'total_cost'))
+        self.assertEqual(totals, {order.id: Decimal('15.00'), empty.id: Decimal('0.00')})
+        order = Order.objects.with_totals().get(id=order.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(str(order.get_total_cost()), '15.00')
+
+    def test_get_total_cost_uses_prefetched_lines(self):
+        self.place(4)
+        order = Order.objects.with_lines().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(order.get_total_cost(), Decimal('20.00'))
+            self.assertEqual([str(item) for item in order.items.all()][0], f'2x Product 0 (Order #{order.id})')
+
+    def test_get_total_cost_without_annotations_is_one_query(self):
+        order = Order.objects.get(id=self.place(5).id)
+        with self.assertNumQueries(1):
+            self.assertEqual(order.get_total_cost(), Decimal('25.00'))
+
+    def test_payment_page_query_count_does_not_grow_with_lines(self):
+        self.client.force_login(self.buyer)
+        # Takes the principal snapshot the navbar reads
+        self.client.get(reverse('shop:product_list'))
+        for size in (2, 30):
+            order = self.place(size)
+            session = self.client.session
+            session['order_id'] = order.id
+            session.save()
+            # order with total, lines with products, cart badge; the
+            # navbar's user comes from the cached principal
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('orders:payment_process'))
+            self.assertContains(response, f'Total: ${size * 5}.00')
+
+    def test_confirmation_email_query_count_does_not_grow_with_lines(self):
+        for size in (2, 30):
+            order = Order.objects.get(id=self.place(size).id)
+            # lines with products, outbox insert
+            with self.assertNumQueries(2):
+                queue_order_confirmation(order)
+
+
+@override_settings(ORDERS_PER_PAGE=5)
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.products = make_products(4, stock=100)
+        self.seller = self.products[0].seller
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+
+    def place(self, products, quantity=1, status='paid'):
+        fill_cart(self.cart, products, quantity=quantity)
+        order = place_order(make_order(user=self.buyer), DatabaseCart(self.buyer))
+        if status == 'paid':
+            handle_checkout_session({'client_reference_id': order.id, 'payment_intent': 'pi'})
+        return order
+
+    def test_history_pages_through_own_orders(self):
+        orders = [self.place(self.products[:2]) for i in range(12)]
+        other = CustomUser.objects.create_user(username='other', password='pass')
+        make_order(user=other).save()
+        self.client.force_login(self.buyer)
+
+        seen = []
+        base = url = reverse('orders:order_history')
+        while url:
+            # user, orders with totals, cart badge
+            with self.assertNumQueries(3):
+                response = self.client.get(url)
+            page = response.context['page']
+            seen.extend(order.id for order in page)
+            url = f'{base}?after={page.next_cursor}' if page.has_next else None
+        self.assertEqual(seen, [order.id for order in reversed(orders)])
+        self.assertContains(response, '$5.00')
+
+    def test_detail_is_limited_to_the_buyer(self):
+        order = self.place(self.products)
+        other = CustomUser.objects.create_user(username='other', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse('orders:order_detail', args=[order.id])).status_code, 404)
+
+        self.client.force_login(self.buyer)
+        # user, order with total, lines with products, cart badge
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('orders:order_detail', args=[order.id]))
+        self.assertContains(response, 'Total: $10.00')
+
+    def test_checkout_records_the_seller_on_each_line(self):
+        order = self.place(self.products[:2])
+        self.assertEqual(set(order.items.values_list('seller_id', flat=True)), {self.seller.id})
+
+    def test_seller_sales_aggregates_paid_lines(self):
+        self.place(self.products[:2], quantity=3)
+        self.place(self.products[:1], quantity=2)
+        self.place(self.products[1:2], quantity=5, status='pending')
+
+        self.client.force_login(self.seller)
+        # user, best sellers, their names, summary, lines page, cart badge
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('orders:seller_sales'))
+        self.assertEqual(response.context['summary'], {'revenue': Decimal('20.00'), 'units': 8})
+        self.assertEqual(
+            [(row['product_id'], row['units']) for row in response.context['top_products']],
+            [(self.products[0].id, 5), (self.products[1].id, 3)],
+        )
+        self.assertEqual(len(response.context['lines']), 4)
+
+    def test_sales_query_count_does_not_grow_with_lines(self):
+        for i in range(8):
+            self.place(self.products, quantity=2)
+        self.client.force_login(self.seller)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('orders:seller_sales'))
+        self.assertTrue(response.context['page'].has_next)
+
+    def test_sales_page_is_for_sellers_only(self):
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get(reverse('orders:seller_sales')).status_code, 403)
+
+
+class FailingBackend(EmailBackend):
+    def send_messages(self, messages):
+        raise ConnectionError('mail server went away')
+
+
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.products = make_products(2)
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        fill_cart(Cart.objects.create(user=self.buyer), self.products, quantity=2)
+        self.order = place_order(make_order(), DatabaseCart(self.buyer))
+
+    def pay(self, order=None):
+        order = order or self.order
+        handle_checkout_session({
+            'client_reference_id': order.id, 'payment_intent': f'pi_{order.id}'
+        })
+
+    def test_webhook_queues_email_instead_of_sending(self):
+        self.pay()
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.order.stripe_id, f'pi_{self.order.id}')
+        self.assertEqual(mail.outbox, [])
+        email = EmailOutbox.objects.get()
+        self.assertEqual(email.to, ['buyer@example.com'])
+        self.assertIn('Product 1', email.body)
+
+    def test_repeated_webhook_queues_one_email(self):
+        self.pay()
+        self.pay()
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+
+    def test_worker_sends_batch_over_one_connection(self):
+        self.pay()
+        for i in range(3):
+            order = make_order()
+            order.save()
+            self.pay(order)
+
+        opened = []
+
+        class CountingBackend(EmailBackend):
+            def open(self):
+                opened.append(self)
+
+        sent, failed = send_queued(connection=CountingBackend())
+        self.assertEqual((sent, failed), (4, 0))
+        self.assertEqual(len(opened), 1)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+        self.assertFalse(EmailOutbox.objects.exclude(status='sent').exists())
+        self.assertEqual(send_queued(), (0, 0))
+
+    def test_failures_back_off_then_give_up(self):
+        self.pay()
+        email = EmailOutbox.objects.get()
+
+        self.assertEqual(send_queued(connection=FailingBackend()), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('pending', 1))
+        self.assertIn('went away', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(send_queued(connection=FailingBackend()), (0, 0))
+
+        for attempt in range(2, MAX_ATTEMPTS + 1):
+            EmailOutbox.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+            send_queued(connection=FailingBackend())
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('failed', MAX_ATTEMPTS))
+
+    def test_command_drains_outbox(self):
+        self.pay()
+        out = StringIO()
+        call_command('send_queued_emails', '--batch-size', '1', stdout=out)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('1 sent, 0 failed', out.getvalue())
+
+
+@override_settings(STRIPE_WEBHOOK_SECRET='whsec_test')
+class StripeWebhookTests(TestCase):
+    def setUp(self):
+        self.order = make_order()
+        self.order.save()
+
+    def deliver(self, event_id, event_type='checkout.session.completed', order_id=None):
+        payload = json.dumps({
+            'id': event_id,
+            'object': 'event',
+            'type': event_type,
+            'data': {'object': {
+                'object': 'checkout.session',
+                'client_reference_id': order_id or self.order.id,
+                'payment_intent': 'pi_123',
+            }},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(
+            b'whsec_test', f'{timestamp}.{payload}'.encode(), hashlib.sha256
+        ).hexdigest()
+        return self.client.post(
+            reverse('orders:stripe_webhook'), payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}',
+        )
+
+    def test_webhook_only_records_the_event(self):
+        # one insert inside a savepoint
+        with self.assertNumQueries(3):
+            response = self.deliver('evt_1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(StripeEvent.objects.get().status, 'pending')
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+    def test_bad_signature_is_rejected(self):
+        response = self.client.post(
+            reverse('orders:stripe_webhook'), '{}', content_type='application/json',
+            HTTP_STRIPE_SIGNATURE='t=1,v1=bad',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(StripeEvent.objects.exists())
+
+    def test_redelivered_event_is_handled_once(self):
+        for i in range(3):
+            self.assertEqual(self.deliver('evt_1').status_code, 200)
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+        self.assertEqual(process_events(), (1, 0))
+        self.deliver('evt_1')
+        self.assertEqual(process_events(), (0, 0))
+
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.status, self.order.stripe_id), ('paid', 'pi_123'))
+        self.assertEqual(EmailOutbox.objects.count(), 1)
+        self.assertEqual(StripeEvent.objects.get().status, 'processed')
+
+    def test_unhandled_event_types_are_marked_processed(self):
+        self.deliver('evt_2', event_type='charge.refunded')
+        self.assertEqual(process_events(), (1, 0))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'pending')
+
+    def test_failing_handler_is_retried_later(self):
+        self.deliver('evt_3', order_id=self.order.id + 1000)
+        self.assertEqual(process_events(), (0, 1))
+        event = StripeEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(process_events(), (0, 0))
+
+    def test_command_processes_events(self):
+        self.deliver('evt_4')
+        out = StringIO()
+        call_command('process_stripe_events', stdout=out)
+        self.assertIn('1 processed, 0 failed', out.getvalue())
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.products = make_products(3)
+        self.seller = CustomUser.objects.get(username='seller')
+        self.buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        self.cart = Cart.objects.create(user=self.buyer)
+        self.today = timezone.localdate()
+
+    def pay(self, products, quantity):
+        fill_cart(self.cart, products, quantity=quantity)
+        order = place_order(make_order(), DatabaseCart(self.buyer))
+        handle_checkout_session({'client_reference_id': order.id, 'payment_intent': 'pi_123'})
+        return order
+
+    def rows(self):
+        return (
+            list(ProductSalesDay.objects.order_by('day', 'product_id')
+                 .values_list('day', 'product_id', 'units', 'revenue', 'orders')),
+            list(SellerSalesDay.objects.values_list('day', 'units', 'revenue', 'orders')),
+        )
+
+    def test_paying_orders_adds_them_to_their_day(self):
+        first, second, third = self.products
+        self.pay([first, second], 2)
+        self.pay([first], 1)
+        self.assertEqual(self.rows(), (
+            [(self.today, first.id, 3, Decimal('7.50'), 2), (self.today, second.id, 2, Decimal('5.00'), 1)],
+            [(self.today, 5, Decimal('12.50'), 2)],
+        ))
+        self.assertEqual(ProductSalesDay.objects.filter(seller=self.seller).count(), 2)
+
+    def test_rebuild_recomputes_the_days_from_the_lines(self):
+        first, second, third = self.products
+        earlier = self.pay([first, second], 2)
+        self.pay([first], 1)
+        # Paid before the handler kept the rollups
+        earlier_day = self.today - timedelta(days=40)
+        Order.objects.filter(id=earlier.id).update(paid_at=timezone.now() - timedelta(days=40))
+        SellerSalesDay.objects.create(seller=self.seller, day=self.today - timedelta(days=10), units=99)
+
+        out = StringIO()
+        call_command('rebuild_sales_rollups', '--chunk-days', '7', stdout=out)
+        self.assertIn('5 sales rollup rows rebuilt', out.getvalue())
+        self.assertEqual(self.rows(), (
+            [
+                (earlier_day, first.id, 2, Decimal('5.00'), 1),
+                (earlier_day, second.id, 2, Decimal('5.00'), 1),
+                (self.today, first.id, 1, Decimal('2.50'), 1),
+            ],
+            [(earlier_day, 4, Decimal('10.00'), 1), (self.today, 1, Decimal('2.50'), 1)],
+        ))
+
+    def test_analytics_reads_only_the_rollups(self):
+        self.pay(self.products[:2], 2)
+        self.client.force_login(self.seller)
+        # Takes the principal snapshot the navbar reads
+        self.client.get(reverse('orders:seller_analytics'))
+        counts = []
+        for days in ('30', '730', 'bogus'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('orders:seller_analytics'), {'days': days})
+            self.assertFalse([q for q in queries if '"orders_orderitem"' in q['sql']])
+            counts.append(len(queries))
+            self.assertEqual(response.context['totals'], {'revenue': Decimal('10.00'), 'units': 4, 'orders': 1})
+            self.assertEqual([row['product'].name for row in response.context['top_products']],
+                             ['Product 0', 'Product 1'])
+        self.assertEqual(len(set(counts)), 1)
+        self.assertEqual(response.context['days'], 30)
+        self.assertEqual(len(response.context['points']), 30)
+        self.assertEqual(len(self.client.get(reverse('orders:seller_analytics'), {'days': 730}).context['points']), 105)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """
+    Checkouts racing for the same stock. They run on whatever database is
+    configured: SQLite serializes them with its write lock, PostgreSQL
+    (``DB_PROFILE=postgres``) with row locks under READ COMMITTED.
+    """
+    THREADS = 8
+    STOCK = 5
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('threads need a test database they can share')
+
+    def test_checkout_waiting_on_a_lock_sees_the_holds_made_meanwhile(self):
+        product = make_products(1, stock=self.STOCK)[0]
+        cart = SessionCart(SessionStore())
+        cart.add(product.id, 1)
+        locked = threading.Event()
+
+        def other_checkout():
+            # Holds every unit, and commits only once the checkout below waits for the lock
+            try:
+                with transaction.atomic():
+                    Product.objects.select_for_update().get(id=product.id)
+                    order = make_order()
+                    order.save()
+                    hold(order, [product], {product.id: self.STOCK})
+                    locked.set()
+                    time.sleep(0.5)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=other_checkout)
+        thread.start()
+        locked.wait()
+        try:
+            with self.assertRaises(InsufficientStock):
+                place_order(make_order(), cart)
+        finally:
+            thread.join()
+        self.assertEqual(OrderItem.objects.count(), 0)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product = make_products(1, stock=self.STOCK)[0]
+        carts = []
+        for i in range(self.THREADS):
+            cart = SessionCart(SessionStore())
+            cart.add(product.id, 1)
+            carts.append(cart)
+
+        outcomes = []
+        barrier = threading.Barrier(self.THREADS)
+
+        def checkout(cart):
+            try:
+                barrier.wait()
+                for attempt in range(50):
+                    try:
+                        place_order(make_order(), cart)
+                        outcomes.append('ok')
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting
+                        continue
+                    except InsufficientStock:
+                        outcomes.append('sold out')
+                        return
+                outcomes.append('gave up')
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(cart,)) for cart in carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product = with_available_stock(Product.objects.filter(id=product.id)).get()
+        sold = sum(OrderItem.objects.values_list('quantity', flat=True))
+        self.assertEqual(outcomes.count('ok'), sold)
+        self.assertEqual(product.available_stock + sold, self.STOCK)
+        self.assertEqual(sum(StockReservation.objects.values_list('quantity', flat=True)), sold)
+        # Every checkout got an answer, and the stock sold out exactly
+        self.assertEqual(outcomes.count('gave up'), 0)
+        self.assertEqual(outcomes.count('ok'), self.STOCK)
+        self.assertEqual(outcomes.count('sold out'), self.THREADS - self.STOCK)
+        self.assertEqual(Order.objects.count(), sold)
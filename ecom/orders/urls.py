@@ -6,6 +6,10 @@ app_name = 'orders'
 
 urlpatterns = [
     path('create/', views.order_create, name='order_create'),
+    path('history/', views.order_history, name='order_history'),
+    path('<int:order_id>/', views.order_detail, name='order_detail'),
+    path('sales/', views.seller_sales, name='seller_sales'),
+    path('sales/analytics/', views.seller_analytics, name='seller_analytics'),
     path('payment/process/', views.payment_process, name='payment_process'),
     path('payment/completed/', views.payment_completed, name='payment_completed'),
     path('payment/canceled/', views.payment_canceled, name='payment_canceled'),
@@ -1,39 +1,35 @@
-from django.shortcuts import render, redirect, get_object_or_404
+from asgiref.sync import sync_to_async
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.response import TemplateResponse
 from django.urls import reverse
-from django.http import HttpResponse
+from django.http import HttpResponse, HttpResponseRedirect
 from django.views.decorators.csrf import csrf_exempt
-from django.db import transaction
-from django.core.mail import send_mail
-from django.template.loader import render_to_string
+from django.contrib.auth.decorators import login_required
 from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from decimal import Decimal
+import json
 import stripe
 import logging
-from cart.models import Cart, CartItem
+from accounts.decorators import seller_required
+from accounts.principal import get_principal
+from cart.storage import get_cart
 from shop.models import Product
+from shop.pagination import KeysetPaginator
+from .checkout import InsufficientStock, place_order
 from .models import Order, OrderItem
+from .rollups import seller_timeline, top_products
+from .payments import PaymentError, astart_checkout, cached_checkout_url, start_checkout
+from .reservations import extend_holds, release_order
 from .forms import OrderCreateForm
-
-# Initialize Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
+from .webhooks import record_event
 
 # Logger
 logger = logging.getLogger(__name__)
 
-# ----- Helper Functions -----
-def _cart_id(request):
-    """Get or create session-based cart ID."""
-    if not request.session.session_key:
-        request.session.create()
-    return request.session.session_key
-
-def _get_or_create_cart(request):
-    """Get or create a cart for the current user/session."""
-    if request.user.is_authenticated:
-        cart, created = Cart.objects.get_or_create(user=request.user)
-    else:
-        session_key = _cart_id(request)
-        cart, created = Cart.objects.get_or_create(session_key=session_key)
-    return cart
+# Days the seller analytics can look back over
+ANALYTICS_RANGES = (30, 90, 365, 730)
 
 # ----- Order Views -----
 def order_create(request):
@@ -52,105 +48,109 @@ def order_create(request):
             }
         form = OrderCreateForm(initial=initial_data)  # Pre-fill form
 
-    try:
-        cart = _get_or_create_cart(request)
-        cart_items = CartItem.objects.filter(cart=cart)
-
-        if not cart_items.exists():
-            return redirect('cart:cart_detail')
-
-        if request.method == 'POST':
-            if form.is_valid():
-                with transaction.atomic():
-                    # Create order
-                    order = form.save(commit=False)
-                    if request.user.is_authenticated:
-                        order.user = request.user
-                    order.save()
-
-                    # Create order items and reserve stock
-                    for item in cart_items:
-                        if item.product.stock >= item.quantity:
-                            OrderItem.objects.create(
-                                order=order,
-                                product=item.product,
-                                price=item.product.price,
-                                quantity=item.quantity
-                            )
-                            item.product.stock -= item.quantity  # Reserve stock
-                            item.product.save()
-                            item.delete()  # Remove item from cart
-                        else:
-                            logger.error(f"Insufficient stock for product {item.product.id}")
-                            return render(request, 'orders/stock_error.html', {'product': item.product})
-
-                    # Store order ID in session
-                    request.session['order_id'] = order.id
-                    request.session.modified = True
-
-                    # Clear cart from session (if it exists)
-                    if 'cart_id' in request.session:
-                        del request.session['cart_id']
-                
-                    # Redirect to payment
-                    return redirect('orders:payment_process')
-
-        total = sum(item.product.price * item.quantity for item in cart_items)
-        return render(request, 'orders/create.html', {
-            'form': form,
-            'cart_items': cart_items,
-            'total': total
-        })
-
-    except Cart.DoesNotExist:
-        return redirect('shop:product_list')
+    cart = get_cart(request)
+    cart_items = cart.lines()
+
+    if not cart_items:
+        return redirect('cart:cart_detail')
+
+    if request.method == 'POST':
+        if form.is_valid():
+            # Create order
+            order = form.save(commit=False)
+            if request.user.is_authenticated:
+                order.user = request.user
+
+            # Create order items, reserve stock and empty the cart
+            try:
+                place_order(order, cart)
+            except InsufficientStock as e:
+                logger.error(str(e))
+                return render(request, 'orders/stock_error.html', {'product': e.product})
+
+            # Store order ID in session
+            request.session['order_id'] = order.id
+            request.session.modified = True
+
+            # Redirect to payment
+            return redirect('orders:payment_process')
+
+    total = sum(item.subtotal() for item in cart_items)
+    return render(request, 'orders/create.html', {
+        'form': form,
+        'cart_items': cart_items,
+        'total': total
+    })
     
+def _to_stripe(url):
+    # 303 See Other: the browser follows the POST with a GET
+    return HttpResponseRedirect(url, status=303)
+
 def payment_process(request):
     """Process payment via Stripe."""
     order_id = request.session.get('order_id')
     if not order_id:
         return redirect('shop:product_list')
     
-    order = get_object_or_404(Order, id=order_id)
+    order = get_object_or_404(Order.objects.with_lines().with_totals(), id=order_id)
     
     if request.method == 'POST':
+        if order.status == 'pending':
+            # Sent twice: back to the session we already have
+            url = cached_checkout_url(order)
+            if url:
+                return _to_stripe(url)
+        # Keep the stock for as long as the Stripe session stays open
+        expires_at = extend_holds(order) if order.status == 'pending' else None
+        if expires_at is None:
+            release_order(order.id)
+            return render(request, 'orders/order_expired.html', {'order': order})
         try:
-            success_url = request.build_absolute_uri(
-                reverse('orders:payment_completed')
-            )
-            cancel_url = request.build_absolute_uri(
-                reverse('orders:payment_canceled')
+            url = start_checkout(
+                order,
+                success_url=request.build_absolute_uri(reverse('orders:payment_completed')),
+                cancel_url=request.build_absolute_uri(reverse('orders:payment_canceled')),
+                expires_at=expires_at,
             )
-            
-            session_data = {
-                'mode': 'payment',
-                'client_reference_id': order.id,
-                'success_url': success_url,
-                'cancel_url': cancel_url,
-                'line_items': []
-            }
-            
-            for item in order.items.all():
-                session_data['line_items'].append({
-                    'price_data': {
-                        'unit_amount': int(item.price * 100),
-                        'currency': settings.DEFAULT_CURRENCY,
-                        'product_data': {'name': item.product.name},
-                    },
-                    'quantity': item.quantity,
-                })
-            
-            session = stripe.checkout.Session.create(**session_data)
-            order.stripe_id = session.payment_intent  # Use PaymentIntent ID
-            order.save()
-            
-            return redirect(session.url, code=303)
-        except stripe.error.StripeError as e:
-            logger.error(f"Stripe error: {str(e)}")
+        except PaymentError as e:
             return render(request, 'orders/payment_error.html', {'error': str(e)})
+        return _to_stripe(url)
     
     return render(request, 'orders/payment_process.html', {'order': order})
 
+async def apayment_process(request):
+    """Async variant of ``payment_process``, served under ASGI by ecom.urls_async."""
+    order_id = await request.session.aget('order_id')
+    if not order_id:
+        return redirect('shop:product_list')
+    
+    order = await aget_object_or_404(Order.objects.with_lines().with_totals(), id=order_id)
+    
+    # Pages are TemplateResponses so the handler renders them off the event loop
+    if request.method == 'POST':
+        if order.status == 'pending':
+            # Sent twice: back to the session we already have
+            url = cached_checkout_url(order)
+            if url:
+                return _to_stripe(url)
+        # Keep the stock for as long as the Stripe session stays open
+        expires_at = await sync_to_async(extend_holds)(order) if order.status == 'pending' else None
+        if expires_at is None:
+            await sync_to_async(release_order)(order.id)
+            return TemplateResponse(request, 'orders/order_expired.html', {'order': order})
+        try:
+            url = await astart_checkout(
+                order,
+                success_url=request.build_absolute_uri(reverse('orders:payment_completed')),
+                cancel_url=request.build_absolute_uri(reverse('orders:payment_canceled')),
+                expires_at=expires_at,
+            )
+        except PaymentError as e:
+            return TemplateResponse(request, 'orders/payment_error.html', {'error': str(e)})
+        return _to_stripe(url)
+    
+    return TemplateResponse(request, 'orders/payment_process.html', {'order': order})
+
 def payment_completed(request):
     """Display payment success page."""
     order_id = request.session.get('order_id')
@@ -158,13 +158,79 @@ def payment_completed(request):
     return render(request, 'orders/payment_completed.html', {'order': order})
 
 def payment_canceled(request):
-    """Display payment cancellation page."""
+    """Display payment cancellation page and give back the order's stock."""
+    order_id = request.session.pop('order_id', None)
+    if order_id:
+        release_order(order_id)
     return render(request, 'orders/payment_canceled.html')
 
+# ----- Order History -----
+@login_required
+def order_history(request):
+    """The buyer's orders, newest first."""
+    orders = Order.objects.filter(user=request.user).with_totals()
+    page = KeysetPaginator(orders, settings.ORDERS_PER_PAGE).page(
+        after=request.GET.get('after'), before=request.GET.get('before')
+    )
+    return render(request, 'orders/history.html', {'orders': page, 'page': page})
+
+@login_required
+def order_detail(request, order_id):
+    order = get_object_or_404(
+        Order.objects.with_lines().with_totals(), id=order_id, user=request.user
+    )
+    return render(request, 'orders/detail.html', {'order': order})
+
+@seller_required
+def seller_sales(request):
+    """Revenue, best sellers and the latest order lines for a seller."""
+    lines = OrderItem.objects.filter(seller_id=get_principal(request).id)
+    page = KeysetPaginator(
+        lines.select_related('order', 'product'), settings.ORDERS_PER_PAGE, ordering=('-id',)
+    ).page(after=request.GET.get('after'), before=request.GET.get('before'))
+    paid = lines.paid()
+    top_products = list(paid.units_by_product()[:10])
+    # Names only for the rows shown, so the aggregate needs no join
+    products = Product.objects.only('name').in_bulk([row['product_id'] for row in top_products])
+    for row in top_products:
+        row['product'] = products[row['product_id']]
+    return render(request, 'orders/sales.html', {
+        'summary': paid.sales_summary(),
+        'top_products': top_products,
+        'lines': page,
+        'page': page,
+    })
+
+@seller_required
+def seller_analytics(request):
+    """The seller's sales over the last ``days`` days, read from the daily rollups."""
+    days = request.GET.get('days', '')
+    days = int(days) if days.isdigit() and int(days) in ANALYTICS_RANGES else ANALYTICS_RANGES[0]
+    seller_id = get_principal(request).id
+    last = timezone.localdate()
+    first = last - timedelta(days=days - 1)
+    # Weekly bars past a quarter, so the charts stay readable
+    points = seller_timeline(seller_id, first, last, bucket_days=1 if days <= 90 else 7)
+    best = list(top_products(seller_id, first, last)[:10])
+    products = Product.objects.only('name').in_bulk([row['product_id'] for row in best])
+    for row in best:
+        row['product'] = products[row['product_id']]
+    return render(request, 'orders/analytics.html', {
+        'days': days,
+        'ranges': ANALYTICS_RANGES,
+        'points': points,
+        'totals': {
+            'revenue': sum((point.revenue for point in points), Decimal('0.00')),
+            'units': sum(point.units for point in points),
+            'orders': sum(point.orders for point in points),
+        },
+        'top_products': best,
+    })
+
 # ----- Webhook Handlers -----
 @csrf_exempt
 def stripe_webhook(request):
-    """Handle Stripe webhook events."""
+    """Verify and store Stripe webhook events; they are handled by process_stripe_events."""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE', '')
     
@@ -179,46 +245,7 @@ def stripe_webhook(request):
         logger.error("Invalid signature")
         return HttpResponse(status=400)
 
-    if event.type == 'checkout.session.completed':
-        session = event.data.object
-        try:
-            handle_checkout_session(session)
-        except Exception as e:
-            logger.error(f"Error handling checkout session: {str(e)}")
-            return HttpResponse(status=500)
+    if not record_event(json.loads(payload)):
+        logger.info(f"Duplicate Stripe event {event.id}")
     
     return HttpResponse(status=200)
-
-def handle_checkout_session(session):
-    """Handle successful payment via Stripe webhook."""
-    try:
-        order = Order.objects.get(id=session.client_reference_id)
-        
-        # Prevent duplicate processing
-        if order.paid:
-            logger.warning(f"Order {order.id} already marked as paid")
-            return
-        
-        # Mark order as paid
-        order.paid = True
-        order.stripe_id = session.payment_intent
-        order.save()
-        
-        # Send confirmation email
-        subject = f"Order #{order.id} Confirmation"
-        message = render_to_string('orders/email/order_confirmation.txt', {'order': order})
-        html_message = render_to_string('orders/email/order_confirmation.html', {'order': order})
-        send_mail(
-            subject,
-            message,
-            settings.DEFAULT_FROM_EMAIL,
-            [order.email],
-            html_message=html_message
-        )
-        
-    except Order.DoesNotExist:
-        logger.error(f"Order not found: {session.client_reference_id}")
-        raise
-    except Exception as e:
-        logger.error(f"Error processing order {session.client_reference_id}: {str(e)}")
-        raise
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Stripe webhook ingestion.
+
+``stripe_webhook`` only verifies the signature and stores the event with
+``record_event``; a redelivered event hits the unique ``event_id`` and is
+dropped, so replays cost one insert attempt. The ``process_stripe_events``
+command then feeds stored events to the handler registered for their type
+with ``@handles``. Each event is handled and marked processed in one
+transaction, so its effects are applied exactly once.
+"""
+import logging
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .emails import backoff, queue_order_confirmation
+from .models import Order, StripeEvent
+from .reservations import commit_order, release_order
+from .rollups import record_paid_order
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 8
+
+# event type -> handler(data_object)
+HANDLERS = {}
+
+
+def handles(event_type):
+    """Register the decorated function as the handler for ``event_type``."""
+    def register(func):
+        HANDLERS[event_type] = func
+        return func
+    return register
+
+
+def record_event(event):
+    """Store a verified event (the decoded payload); False if already seen."""
+    try:
+        with transaction.atomic():
+            StripeEvent.objects.create(
+                event_id=event['id'], type=event['type'], payload=event
+            )
+    except IntegrityError:
+        return False
+    return True
+
+
+def process_events(batch_size=100):
+    """Run the handlers for one batch of due events; return ``(processed, failed)``."""
+    now = timezone.now()
+    ids = list(
+        StripeEvent.objects.filter(status='pending', next_attempt_at__lte=now)
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', flat=True)[:batch_size]
+    )
+    processed = failed = 0
+    for event_id in ids:
+        with transaction.atomic():
+            # Another worker may have taken it since we listed it
+            event = (
+                StripeEvent.objects.select_for_update(skip_locked=True)
+                .filter(id=event_id, status='pending')
+                .first()
+            )
+            if event is None:
+                continue
+            if _process(event, now):
+                processed += 1
+            else:
+                failed += 1
+    return processed, failed
+
+
+def _process(event, now):
+    handler = HANDLERS.get(event.type)
+    event.attempts += 1
+    try:
+        # A failing handler leaves nothing behind but the error we record
+        with transaction.atomic():
+            if handler is not None:
+                handler(event.payload['data']['object'])
+    except Exception as e:
+        logger.error(f"Error handling Stripe event {event.event_id}: {str(e)}")
+        event.last_error = str(e)
+        if event.attempts >= MAX_ATTEMPTS:
+            event.status = 'failed'
+        else:
+            event.next_attempt_at = now + backoff(event.attempts)
+        event.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+        return False
+
+    event.status = 'processed'
+    event.processed_at = timezone.now()
+    event.last_error = ''
+    event.save(update_fields=['attempts', 'last_error', 'status', 'processed_at'])
+    return True
+
+
+# ----- Handlers -----
+@handles('checkout.session.completed')
+def handle_checkout_session(session):
+    """
+    Mark the order paid, take its units out of stock, add it to the sales
+    rollups and queue its confirmation email.
+    """
+    order = Order.objects.select_for_update().get(id=session['client_reference_id'])
+
+    # Prevent duplicate processing
+    if order.status not in ('pending', 'canceled'):
+        logger.warning(f"Order {order.id} already marked as {order.status}")
+        return
+    if order.status == 'canceled':
+        # The buyer paid after the stock holds ran out; take the payment anyway
+        logger.warning(f"Order {order.id} was paid after its stock holds were released")
+
+    order.status = 'paid'
+    order.stripe_id = session.get('payment_intent')
+    order.paid_at = timezone.now()
+    order.save(update_fields=['status', 'stripe_id', 'paid_at', 'updated'])
+    order.items.update(paid=True)
+    commit_order(order)
+    record_paid_order(order)
+    queue_order_confirmation(order)
+
+
+@handles('checkout.session.expired')
+@handles('checkout.session.async_payment_failed')
+def handle_checkout_session_failed(session):
+    """Give back the stock held for an order that won't be paid."""
+    if release_order(session['client_reference_id']):
+        logger.info(f"Released the stock held for order {session['client_reference_id']}")
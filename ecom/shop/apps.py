@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ShopConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'shop'
+
+    def ready(self):
+        from . import images, signals  # noqa: F401
+        from .models import Product
+        images.register(Product, 'image', widths=(320, 640, 1280))
@@ -0,0 +1,241 @@
+"""
+Bulk product import and export for sellers.
+
+Files are read one row at a time (CSV or JSON lines), each row is checked
+against the fields of ``ProductImportForm`` and valid rows are upserted a chunk at a time with
+a single ``INSERT ... ON CONFLICT (seller, slug) DO UPDATE``, so memory use
+is bounded by the chunk size whatever the file size. Rows that fail
+validation are skipped and reported by line number. A line that isn't
+UTF-8 or valid CSV ends the import with an ``ImportFileError``; the rows
+before it are kept.
+
+Bulk writes bypass ``post_save``, so ``products_changed`` is sent once the
+import is done.
+"""
+import codecs
+import csv
+import json
+from dataclasses import dataclass, field
+
+from django import forms
+from django.db import transaction
+
+from .models import Category, Product
+from .signals import products_changed
+
+COLUMNS = ('slug', 'name', 'category', 'description', 'price', 'stock', 'available')
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 50
+UPDATE_FIELDS = ['category', 'name', 'description', 'price', 'stock', 'available', 'updated']
+
+
+class ImportFileError(ValueError):
+    """The file as a whole can't be read."""
+
+
+class YesNoField(forms.Field):
+    """
+    A yes/no cell: true/false, yes/no, y/n, 1/0 or on/off in any case (or a
+    JSON boolean). A blank cell is None; anything else is an error, where
+    ``NullBooleanField`` would read it as None.
+    """
+
+    TRUE = frozenset({'true', 'yes', 'y', '1', 'on'})
+    FALSE = frozenset({'false', 'no', 'n', '0', 'off'})
+
+    def to_python(self, value):
+        if isinstance(value, bool):
+            return value
+        value = '' if value is None else str(value).strip().lower()
+        if not value:
+            return None
+        if value in self.TRUE:
+            return True
+        if value in self.FALSE:
+            return False
+        raise forms.ValidationError('Enter yes or no (or leave it blank for yes).', code='invalid')
+
+
+class ProductImportForm(forms.ModelForm):
+    """
+    The columns of an imported row and their rules.
+
+    Built from the ``Product`` fields like ``ProductForm``, except that the
+    category is given by slug. Rows are checked against these fields by
+    ``clean_row`` rather than by instantiating the form for every row,
+    which would copy every field each time.
+    """
+
+    category = forms.SlugField()
+    available = YesNoField(required=False)
+
+    class Meta:
+        model = Product
+        fields = ['name', 'slug', 'description', 'price', 'stock', 'available']
+
+
+def clean_row(row, categories):
+    """Return ``(cleaned data, errors)`` for one row."""
+    cleaned, errors = {}, []
+    for name, form_field in ProductImportForm.base_fields.items():
+        value = form_field.widget.value_from_datadict(row, {}, name)
+        try:
+            cleaned[name] = form_field.clean(value)
+        except forms.ValidationError as e:
+            errors.extend(f'{name}: {message}' for message in e.messages)
+    if 'category' in cleaned:
+        category_id = categories.get(cleaned['category'])
+        if category_id is None:
+            errors.append(f'category: Unknown category "{cleaned["category"]}".')
+        cleaned['category'] = category_id
+    # Only a blank cell gets here as None
+    if cleaned.get('available') is None:
+        cleaned['available'] = True
+    return cleaned, errors
+
+
+@dataclass
+class ImportResult:
+    imported: int = 0
+    failed: int = 0
+    # (line number, messages) for the first MAX_REPORTED_ERRORS failures
+    errors: list = field(default_factory=list)
+
+
+def read_rows(fileobj, name):
+    """
+    Yield ``(line number, dict)`` from an uploaded CSV or JSON lines file;
+    raise ``ImportFileError`` at a line that isn't UTF-8 or valid CSV.
+    """
+    read = 0
+
+    def lines():
+        nonlocal read
+        for line in codecs.iterdecode(fileobj, 'utf-8-sig'):
+            read += 1
+            yield line
+
+    try:
+        yield from _read_rows(lines(), name)
+    except UnicodeDecodeError:
+        # Failed decoding the next line
+        raise ImportFileError(
+            f'Line {read + 1}: Not UTF-8 text. Save the file as UTF-8 (in Excel, "CSV UTF-8") and upload it again.'
+        ) from None
+    except csv.Error as e:
+        # Failed parsing the last line read
+        raise ImportFileError(f'Line {read}: Not valid CSV ({e}).') from None
+
+
+def _read_rows(lines, name):
+    if name.endswith('.csv'):
+        reader = csv.DictReader(lines)
+        missing = set(COLUMNS) - {'description', 'available'} - set(reader.fieldnames or ())
+        if missing:
+            raise ImportFileError(f"Missing columns: {', '.join(sorted(missing))}")
+        for row in reader:
+            yield reader.line_num, row
+    elif name.endswith(('.jsonl', '.ndjson')):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield number, row if isinstance(row, dict) else None
+    else:
+        raise ImportFileError('Upload a .csv or .jsonl file.')
+
+
+def import_products(seller, rows, chunk_size=CHUNK_SIZE):
+    """Validate ``rows`` (from ``read_rows``) and upsert them for ``seller``."""
+    categories = dict(Category.objects.values_list('slug', 'id'))
+    result = ImportResult()
+    chunk = {}
+
+    unreadable = None
+    try:
+        for number, row in rows:
+            if row is None:
+                _fail(result, number, ['Not a JSON object.'])
+                continue
+            cleaned, errors = clean_row(row, categories)
+            if errors:
+                _fail(result, number, errors)
+                continue
+            product = Product(
+                seller=seller,
+                category_id=cleaned['category'],
+                name=cleaned['name'],
+                slug=cleaned['slug'],
+                description=cleaned['description'],
+                price=cleaned['price'],
+                stock=cleaned['stock'],
+                available=cleaned['available'],
+            )
+            # The same slug twice in one statement can't be upserted; last one wins
+            chunk[product.slug] = product
+            if len(chunk) >= chunk_size:
+                result.imported += _upsert(chunk.values())
+                chunk = {}
+    except ImportFileError as e:
+        # Keep the rows read before the line that can't be, then say so
+        unreadable = e
+    if chunk:
+        result.imported += _upsert(chunk.values())
+
+    if result.imported:
+        transaction.on_commit(lambda: products_changed.send(sender=Product, seller=seller))
+    if unreadable is not None:
+        if result.imported:
+            raise ImportFileError(f'{unreadable} The {result.imported} valid rows before it were imported.')
+        raise unreadable
+    return result
+
+
+def _upsert(products):
+    with transaction.atomic():
+        return len(Product.objects.bulk_create(
+            list(products),
+            update_conflicts=True,
+            unique_fields=['seller', 'slug'],
+            update_fields=UPDATE_FIELDS,
+        ))
+
+
+def _fail(result, number, messages):
+    result.failed += 1
+    if len(result.errors) < MAX_REPORTED_ERRORS:
+        result.errors.append((number, messages))
+
+
+class _Echo:
+    """File-like object that hands back what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_rows(seller):
+    """Yield the seller's products as tuples in ``COLUMNS`` order."""
+    return (
+        Product.objects.filter(seller=seller)
+        .order_by('id')
+        .values_list('slug', 'name', 'category__slug', 'description', 'price', 'stock', 'available')
+        .iterator(chunk_size=2000)
+    )
+
+
+def export_csv(seller):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(COLUMNS)
+    for row in export_rows(seller):
+        yield writer.writerow(row)
+
+
+def export_jsonl(seller):
+    for row in export_rows(seller):
+        record = dict(zip(COLUMNS, row))
+        record['price'] = str(record['price'])
+        yield json.dumps(record) + '\n'
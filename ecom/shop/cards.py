@@ -0,0 +1,124 @@
+"""
+The catalog's read model: one flat ``ProductCard`` row per product.
+
+Drawing a product in a listing used to take the product row, a
+``reverse()`` for its page and another for its cart form, the ``srcset``
+of its image and, on the seller dashboard, a query for its category. A
+card holds all of that already worked out, so the listings read one narrow
+table through its own indexes, with no joins and no per-row URL building.
+
+Cards are written in the transaction that changes their product (see
+``shop.signals``), so a committed product never has a stale card. Writes
+that skip ``post_save`` refresh the cards themselves: a paid order taking
+stock (``orders.reservations``), an inventory sync (``shop.inventory``), a
+finished image resize (the ``derivatives_built`` signal of ``shop.images``)
+and bulk imports (the ``products_changed`` signal). URLs and image paths
+are stored as rendered, so a change to the URLconf, ``MEDIA_URL`` or the
+image widths needs a ``rebuild`` (the ``rebuild_product_cards`` command).
+
+A card's ``stock`` is what buyers can still be promised: the product's
+stock less the units held for unpaid orders (``orders.reservations``,
+which refreshes the cards as it places and ends holds).
+"""
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Greatest
+from django.urls import reverse
+
+from orders.models import StockReservation
+from .images import sources
+from .models import Product, ProductCard
+
+BATCH_SIZE = 500
+UPDATE_FIELDS = [
+    'seller_id', 'category_id', 'category_name', 'name', 'slug', 'price', 'stock',
+    'available', 'created', 'updated', 'url', 'cart_add_url',
+    'image_src', 'image_srcset', 'image_webp_srcset',
+]
+
+
+def card_values(product, held=0):
+    """
+    The fields of ``product``'s card, ``held`` units of it being held;
+    works on historical models too.
+    """
+    image_src, image_srcset, image_webp_srcset = sources(product.image)
+    return {
+        'id': product.id,
+        'seller_id': product.seller_id,
+        'category_id': product.category_id,
+        'category_name': product.category.name,
+        'name': product.name,
+        'slug': product.slug,
+        'price': product.price,
+        'stock': max(product.stock - held, 0),
+        'available': product.available,
+        'created': product.created,
+        'updated': product.updated,
+        'url': reverse('shop:product_detail', args=[product.id, product.slug]),
+        'cart_add_url': reverse('cart:cart_add', args=[product.id]),
+        'image_src': image_src,
+        'image_srcset': image_srcset,
+        'image_webp_srcset': image_webp_srcset,
+    }
+
+
+def write(products):
+    """Insert or overwrite the cards of ``products``; return how many."""
+    held = StockReservation.objects.held([product.id for product in products])
+    cards = [ProductCard(**card_values(product, held.get(product.id, 0))) for product in products]
+    ProductCard.objects.bulk_create(
+        cards, batch_size=BATCH_SIZE,
+        update_conflicts=True, unique_fields=['id'], update_fields=UPDATE_FIELDS,
+    )
+    return len(cards)
+
+
+def refresh(product_ids=None, seller=None):
+    """
+    Rewrite the cards of ``product_ids`` (or of all of ``seller``'s
+    products) from the products, and drop those whose product is gone.
+    """
+    products = Product.objects.select_related('category')
+    cards = ProductCard.objects.all()
+    if product_ids is not None:
+        products = products.filter(id__in=product_ids)
+        cards = cards.filter(id__in=product_ids)
+    if seller is not None:
+        products = products.filter(seller=seller)
+        cards = cards.filter(seller_id=seller.id)
+    with transaction.atomic():
+        products = list(products)
+        cards.exclude(id__in=[product.id for product in products]).delete()
+        return write(products)
+
+
+def refresh_stock(product_ids, updated=None):
+    """
+    Copy the available stock of ``product_ids`` onto their cards in one
+    statement, and stamp them ``updated`` if given.
+    """
+    stock = Product.objects.filter(id=OuterRef('id')).values('stock')[:1]
+    fields = {'stock': Greatest(Subquery(stock) - StockReservation.objects.held_of(OuterRef('id')), 0)}
+    if updated is not None:
+        fields['updated'] = updated
+    ProductCard.objects.filter(id__in=product_ids).update(**fields)
+
+
+def rename_category(category):
+    ProductCard.objects.filter(category_id=category.id).update(category_name=category.name)
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    """Recreate every card; return how many there are."""
+    written = 0
+    with transaction.atomic():
+        ProductCard.objects.all().delete()
+        batch = []
+        for product in Product.objects.select_related('category').iterator(chunk_size=batch_size):
+            batch.append(product)
+            if len(batch) >= batch_size:
+                written += write(batch)
+                batch = []
+        written += write(batch)
+    return written
@@ -0,0 +1,118 @@
+"""
+Process-local + shared-cache registry of categories.
+
+Categories change rarely but are needed on almost every shop page. The
+registry keeps the rendered list in the Django cache under a versioned key
+and mirrors it in process memory, so a warm request costs one cache lookup
+(for the version token) and no SQL. Signals in ``shop.signals`` call
+``invalidate_categories`` whenever a category or product changes.
+Without a shared cache other workers can't see that, so there the token
+expires after ``CACHE_VERSION_TIMEOUT`` and they reload on their own.
+``aget_categories`` and ``aget_category`` serve async views.
+"""
+import uuid
+from dataclasses import dataclass
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from ecom.routers import use_primary
+
+VERSION_KEY = 'shop:categories:version'
+ENTRIES_KEY = 'shop:categories:{version}'
+CACHE_TIMEOUT = 60 * 60 * 24
+
+# (version, entries, entries_by_slug); swapped as a whole so readers never
+# see a half-updated registry.
+_state = (None, (), {})
+
+
+@dataclass(frozen=True)
+class CategoryEntry:
+    id: int
+    name: str
+    slug: str
+    url: str
+    product_count: int
+
+    def __str__(self):
+        return self.name
+
+    def get_absolute_url(self):
+        return self.url
+
+
+def _load_entries():
+    from .models import Category
+
+    categories = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__available=True))
+    )
+    return tuple(
+        CategoryEntry(
+            id=c.id,
+            name=c.name,
+            slug=c.slug,
+            url=c.get_absolute_url(),
+            product_count=c.product_count,
+        )
+        for c in categories
+    )
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def get_categories():
+    """Return every category, ordered by name, as ``CategoryEntry`` tuples."""
+    return _registry()[1]
+
+
+def _registry():
+    global _state
+    version = _current_version()
+    if _state[0] == version:
+        return _state
+
+    key = ENTRIES_KEY.format(version=version)
+    entries = cache.get(key)
+    if entries is None:
+        # Cached for a day under the new version: not from a lagging replica
+        with use_primary():
+            entries = _load_entries()
+        cache.set(key, entries, CACHE_TIMEOUT)
+
+    _state = (version, entries, {entry.slug: entry for entry in entries})
+    return _state
+
+
+def get_category(slug):
+    """Return the ``CategoryEntry`` for ``slug`` or ``None``."""
+    return _registry()[2].get(slug)
+
+
+async def _aregistry():
+    if _state[0] is not None and _state[0] == await cache.aget(VERSION_KEY):
+        return _state
+    # Cold or stale: rebuilding may query, so do it off the event loop
+    return await sync_to_async(_registry)()
+
+
+async def aget_categories():
+    return (await _aregistry())[1]
+
+
+async def aget_category(slug):
+    return (await _aregistry())[2].get(slug)
+
+
+def invalidate_categories():
+    """Drop the cached registry in every process sharing the cache."""
+    cache.set(VERSION_KEY, uuid.uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
@@ -0,0 +1,30 @@
+"""
+Product fixtures shared by the test suites of the shop, cart and orders apps.
+"""
+from accounts.models import CustomUser
+
+from . import cards
+from .models import Category, Product
+
+
+def make_products(count, seller=None, category=None, start=0, price='2.50', stock=10):
+    """
+    Create ``count`` products slugged ``product-<start>`` onwards, with their
+    listing cards. A seller and a 'books' category are created unless given.
+    """
+    if seller is None:
+        seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+    if category is None:
+        category = Category.objects.create(name='Books', slug='books')
+    products = Product.objects.bulk_create([
+        Product(
+            seller=seller, category=category, name=f'Product {i}',
+            slug=f'product-{i}', image='products/test.jpg', price=price, stock=stock,
+        )
+        for i in range(start, start + count)
+    ])
+    # bulk_create skips post_save, like the bulk import
+    cards.refresh([product.id for product in products])
+    return products
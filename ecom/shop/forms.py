@@ -1,7 +1,9 @@
 from django import forms
 from .models import Product, Category
+from .categories import get_categories
+from .images import DerivativesFormMixin
 
-class ProductForm(forms.ModelForm):
+class ProductForm(DerivativesFormMixin, forms.ModelForm):
     class Meta:
         model = Product
         fields = ['category', 'name', 'slug', 'image', 
@@ -32,4 +34,57 @@ class ProductForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.fields['category'].queryset = Category.objects.all().order_by('name')
\ No newline at end of file
+        field = self.fields['category']
+        field.queryset = Category.objects.all().order_by('name')
+        # Render the options from the cached registry; the queryset is only
+        # hit when a submitted value is validated.
+        field.choices = [('', field.empty_label)] + [
+            (c.id, c.name) for c in get_categories()
+        ]
+
+    def clean_slug(self):
+        slug = self.cleaned_data['slug']
+        # The seller isn't a form field, so the unique check is ours to do
+        taken = Product.objects.filter(seller_id=self.instance.seller_id, slug=slug)
+        if taken.exclude(pk=self.instance.pk).exists():
+            raise forms.ValidationError('You already have a product with this slug.')
+        return slug
+
+class ProductSearchForm(forms.Form):
+    q = forms.CharField(
+        required=False,
+        max_length=200,
+        widget=forms.TextInput(attrs={
+            'class': 'form-control',
+            'placeholder': 'Search products',
+            'autocomplete': 'off',
+        }),
+    )
+    category = forms.ChoiceField(
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+    min_price = forms.DecimalField(
+        required=False,
+        min_value=0,
+        label='Min price',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': '0.00'}),
+    )
+    max_price = forms.DecimalField(
+        required=False,
+        min_value=0,
+        label='Max price',
+        widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': '0.00'}),
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['category'].choices = [('', 'All categories')] + [
+            (c.slug, c.name) for c in get_categories()
+        ]
+
+class ProductImportUploadForm(forms.Form):
+    file = forms.FileField(
+        help_text='CSV with a header row, or one JSON object per line (.jsonl)',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl,.ndjson'}),
+    )
@@ -0,0 +1,227 @@
+"""
+Resized copies ("derivatives") of uploaded images.
+
+Apps ``register`` an image field together with the widths they display it
+at. When a row is saved with an image whose derivatives are missing (its
+``<field>_hash`` column is blank) the work is handed to a small thread pool
+once the transaction commits, so uploads never wait on Pillow. The job
+writes a JPEG, and a WebP where Pillow supports it, for every width under
+``derivatives/`` named after the SHA-256 of the original, then records
+that hash and the original's width on the row (``<field>_hash`` and
+``<field>_width``) and sends ``derivatives_built``. Names are derived
+from the content, so identical uploads share files and the URLs can be
+cached forever.
+
+Images are never enlarged: the widths at or above the original's are
+replaced by a single copy at its own width, so a ``srcset`` only offers
+what the file really is.
+
+Forms reset the hash of a field they change with ``DerivativesFormMixin``.
+``sources`` gives the URLs to offer for an image, which templates render
+with the ``responsive_image`` tag.
+"""
+import hashlib
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.db.models.signals import post_save
+from django.dispatch import Signal
+from PIL import Image, ImageOps, features
+
+logger = logging.getLogger(__name__)
+
+ROOT = 'derivatives'
+JPEG_QUALITY = 82
+WEBP_QUALITY = 80
+WEBP = features.check('webp')
+ORIENTATION = 0x0112
+
+# Sent with model, pk, field_name and digest once a row's hash is recorded
+derivatives_built = Signal()
+
+# (model label, field name) -> widths in pixels
+_registry = {}
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def hash_field(field_name):
+    return f'{field_name}_hash'
+
+
+def width_field(field_name):
+    return f'{field_name}_width'
+
+
+def register(model, field_name, widths):
+    """Keep ``widths`` derivatives of ``model.<field_name>`` up to date."""
+    _registry[(model._meta.label, field_name)] = tuple(sorted(widths))
+
+    def saved(sender, instance, **kwargs):
+        if getattr(instance, field_name) and not getattr(instance, hash_field(field_name)):
+            pk = instance.pk
+            transaction.on_commit(lambda: schedule(model, pk, field_name))
+
+    post_save.connect(saved, sender=model, weak=False,
+                      dispatch_uid=f'derivatives:{model._meta.label}.{field_name}')
+
+
+def registered():
+    """Return ``{(model label, field name): widths}``."""
+    return dict(_registry)
+
+
+def widths_for(model, field_name):
+    return _registry[(model._meta.label, field_name)]
+
+
+def derivative_name(digest, width, extension):
+    return f'{ROOT}/{digest[:2]}/{digest}-{width}.{extension}'
+
+
+def derivative_widths(widths, original):
+    """The ``widths`` an ``original`` pixels wide image is resized to."""
+    if original is None:
+        # Recorded before widths were
+        return widths
+    smaller = tuple(width for width in widths if width < original)
+    return smaller if len(smaller) == len(widths) else smaller + (original,)
+
+
+def sources(image):
+    """
+    Return ``(src, JPEG srcset, WebP srcset)`` for ``image`` (an ImageField
+    value): the original alone until its resized copies exist, and empty
+    strings for an empty field.
+    """
+    if not image:
+        return '', '', ''
+    instance, field_name = image.instance, image.field.name
+    digest = getattr(instance, hash_field(field_name), '')
+    if not digest:
+        return image.url, '', ''
+
+    widths = derivative_widths(
+        widths_for(type(instance), field_name), getattr(instance, width_field(field_name))
+    )
+
+    def srcset(extension):
+        return ', '.join(
+            f'{default_storage.url(derivative_name(digest, width, extension))} {width}w'
+            for width in widths
+        )
+
+    src = default_storage.url(derivative_name(digest, widths[0], 'jpg'))
+    return src, srcset('jpg'), srcset('webp') if WEBP else ''
+
+
+def _pool():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+                thread_name_prefix='derivatives',
+            )
+    return _executor
+
+
+def schedule(model, pk, field_name):
+    """Build derivatives in the pool, or inline with ``IMAGE_DERIVATIVES_EAGER``."""
+    if settings.IMAGE_DERIVATIVES_EAGER:
+        return build_derivatives(model, pk, field_name)
+    return _pool().submit(_run_in_worker, model, pk, field_name)
+
+
+def _run_in_worker(model, pk, field_name):
+    try:
+        return build_derivatives(model, pk, field_name)
+    except Exception:
+        logger.exception(f"Could not build derivatives for {model._meta.label} {pk}")
+    finally:
+        close_old_connections()
+
+
+def build_derivatives(model, pk, field_name):
+    """Write the derivatives of one row's image and record its hash."""
+    instance = model.objects.filter(pk=pk).only(field_name).first()
+    if instance is None:
+        return None
+    image_file = getattr(instance, field_name)
+    if not image_file:
+        return None
+
+    with image_file.storage.open(image_file.name, 'rb') as source:
+        data = source.read()
+    digest = hashlib.sha256(data).hexdigest()
+    original = _upright_width(data)
+
+    image = None
+    for width in derivative_widths(widths_for(model, field_name), original):
+        for extension, save_options in _formats():
+            name = derivative_name(digest, width, extension)
+            if default_storage.exists(name):
+                continue
+            if image is None:
+                image = _open(data)
+            default_storage.save(name, ContentFile(_render(image, width, save_options)))
+
+    # Skip the update if the image was replaced while we were working
+    recorded = model.objects.filter(pk=pk, **{field_name: image_file.name}).update(
+        **{hash_field(field_name): digest, width_field(field_name): original}
+    )
+    if recorded:
+        derivatives_built.send(sender=model, pk=pk, field_name=field_name, digest=digest)
+    return digest
+
+
+def _formats():
+    formats = [('jpg', {'format': 'JPEG', 'quality': JPEG_QUALITY, 'optimize': True, 'progressive': True})]
+    if WEBP:
+        formats.append(('webp', {'format': 'WEBP', 'quality': WEBP_QUALITY, 'method': 4}))
+    return formats
+
+
+def _upright_width(data):
+    # From the header alone; EXIF orientations 5 to 8 are turned on their side
+    image = Image.open(io.BytesIO(data))
+    width, height = image.size
+    return height if image.getexif().get(ORIENTATION) in (5, 6, 7, 8) else width
+
+
+def _open(data):
+    image = Image.open(io.BytesIO(data))
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        # Flatten transparency onto white rather than black
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.getchannel('A'))
+        image = background
+    return image
+
+
+def _render(image, width, save_options):
+    if image.width > width:
+        height = round(image.height * width / image.width)
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    output = io.BytesIO()
+    image.save(output, **save_options)
+    return output.getvalue()
+
+
+class DerivativesFormMixin:
+    """Forget the derivatives of registered image fields the form changed."""
+
+    def save(self, commit=True):
+        model = self._meta.model
+        for name in self.changed_data:
+            if (model._meta.label, name) in _registry:
+                setattr(self.instance, hash_field(name), '')
+        return super().save(commit)
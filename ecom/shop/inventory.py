@@ -0,0 +1,152 @@
+"""
+Stock syncs from sellers' warehouse systems, and low-stock alerts.
+
+A sync is one request carrying any number of changes, each either a
+``delta`` (units received or shipped) or an absolute ``stock`` (a count).
+``apply_stock_changes`` checks them all against the seller's products and
+applies all of them or none: the products are locked in primary key order
+(like checkout and ``orders.reservations``), the new levels are worked out
+here and written with one ``bulk_update`` (a single ``UPDATE`` with a
+``CASE`` on the id) per chunk, and each change that moved the stock is
+appended to the ``StockMovement`` ledger. A sync costs a few statements per
+chunk whatever its size, where ``ProductForm`` took a request per product.
+
+``bulk_update`` skips ``post_save``, so the listing cards are brought up to
+date with ``refresh_stock`` and the cached pages are dropped on commit.
+
+The endpoint is called by the seller's systems, not a browser: it takes
+the seller's ``ApiToken`` key in the ``Authorization`` header (issued with
+``manage.py issue_api_token``) rather than a session.
+
+Low stock is anything under ``LOW_STOCK_THRESHOLD`` units. ``low_stock``
+reads it off the cards through their ``(seller_id, stock)`` index, and a
+sync reports the products it took under the threshold.
+"""
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cards import refresh_stock
+from .models import Product, ProductCard, StockMovement
+from .page_cache import invalidate_pages
+
+MAX_CHANGES = 5000
+CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 50
+
+
+class StockChangeError(ValueError):
+    """The changes can't be applied; ``errors`` says why."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors[:MAX_REPORTED_ERRORS]
+
+
+@dataclass
+class StockChange:
+    product_id: int
+    # Exactly one of these is set
+    delta: int = None
+    stock: int = None
+
+
+@dataclass
+class SyncResult:
+    updated: int = 0
+    # {'id', 'name', 'stock'} of the products the sync took under the threshold
+    low_stock: list = field(default_factory=list)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def parse_changes(data):
+    """
+    Return ``(changes, reference)`` from the decoded body of a sync:
+    ``{"reference": "...", "changes": [{"id": 1, "delta": -2}, {"id": 2, "stock": 40}]}``.
+    """
+    if not isinstance(data, dict) or not isinstance(data.get('changes'), list):
+        raise StockChangeError(['Send an object with a "changes" list.'])
+    if len(data['changes']) > MAX_CHANGES:
+        raise StockChangeError([f'At most {MAX_CHANGES} changes per sync.'])
+    reference = data.get('reference', '')
+    if not isinstance(reference, str) or len(reference) > 100:
+        raise StockChangeError(['reference: At most 100 characters.'])
+
+    changes, errors = [], []
+    for number, item in enumerate(data['changes']):
+        if not isinstance(item, dict) or not _is_int(item.get('id')):
+            errors.append(f'changes[{number}]: Needs an integer "id".')
+        elif ('delta' in item) == ('stock' in item):
+            errors.append(f'changes[{number}]: Give one of "delta" and "stock".')
+        elif 'delta' in item and not _is_int(item['delta']):
+            errors.append(f'changes[{number}]: "delta" must be an integer.')
+        elif 'stock' in item and not (_is_int(item['stock']) and item['stock'] >= 0):
+            errors.append(f'changes[{number}]: "stock" must be a whole number.')
+        else:
+            changes.append(StockChange(item['id'], item.get('delta'), item.get('stock')))
+    if errors:
+        raise StockChangeError(errors)
+    return changes, reference
+
+
+def apply_stock_changes(seller_id, changes, reference=''):
+    """
+    Apply ``changes``, in order, to the products of ``seller_id``; raise
+    ``StockChangeError`` without changing anything if one of them names
+    another seller's product or would take the stock below zero.
+    """
+    now = timezone.now()
+    threshold = settings.LOW_STOCK_THRESHOLD
+    with transaction.atomic():
+        products = {
+            product_id: (name, stock)
+            for product_id, name, stock in Product.objects.select_for_update()
+            .filter(seller_id=seller_id, id__in={change.product_id for change in changes})
+            .order_by('id')
+            .values_list('id', 'name', 'stock')
+        }
+        stock = {product_id: before for product_id, (name, before) in products.items()}
+        movements, errors = [], []
+        for number, change in enumerate(changes):
+            current = stock.get(change.product_id)
+            if current is None:
+                errors.append(f'changes[{number}]: You have no product {change.product_id}.')
+                continue
+            level = current + change.delta if change.delta is not None else change.stock
+            if level < 0:
+                errors.append(f'changes[{number}]: Only {current} of product {change.product_id} in stock.')
+                continue
+            if level != current:
+                movements.append(StockMovement(
+                    product_id=change.product_id, change=level - current, stock=level, reference=reference,
+                ))
+            stock[change.product_id] = level
+        if errors:
+            raise StockChangeError(errors)
+
+        changed = [
+            Product(id=product_id, stock=level, updated=now)
+            for product_id, level in stock.items() if level != products[product_id][1]
+        ]
+        Product.objects.bulk_update(changed, ['stock', 'updated'], batch_size=CHUNK_SIZE)
+        StockMovement.objects.bulk_create(movements, batch_size=CHUNK_SIZE)
+        if changed:
+            refresh_stock([product.id for product in changed], updated=now)
+            transaction.on_commit(invalidate_pages)
+
+    return SyncResult(updated=len(changed), low_stock=[
+        {'id': product.id, 'name': products[product.id][0], 'stock': product.stock}
+        for product in changed if product.stock < threshold <= products[product.id][1]
+    ])
+
+
+def low_stock(seller_id):
+    """The cards of ``seller_id``'s products under ``LOW_STOCK_THRESHOLD``, emptiest first."""
+    return ProductCard.objects.filter(
+        seller_id=seller_id, stock__lt=settings.LOW_STOCK_THRESHOLD,
+    ).order_by('stock')
@@ -0,0 +1,28 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from shop import images
+
+
+class Command(BaseCommand):
+    help = 'Build the resized copies of uploaded images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Rebuild every image, e.g. after changing the widths')
+
+    def handle(self, *args, **options):
+        for (label, field_name), widths in images.registered().items():
+            model = apps.get_model(label)
+            rows = model.objects.exclude(**{field_name: ''})
+            if not options['all']:
+                # Also those built before the original's width was recorded
+                rows = rows.filter(
+                    Q(**{images.hash_field(field_name): ''}) | Q(**{images.width_field(field_name): None})
+                )
+            built = 0
+            for pk in rows.values_list('pk', flat=True).iterator():
+                if images.build_derivatives(model, pk, field_name):
+                    built += 1
+            self.stdout.write(f"{label}.{field_name}: {built} built")
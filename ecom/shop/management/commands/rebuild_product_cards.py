@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from shop import cards
+
+
+class Command(BaseCommand):
+    help = 'Recreate the product listing cards, e.g. after changing URLs, MEDIA_URL or image widths'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=cards.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        written = cards.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(f"{written} product cards rebuilt")
@@ -0,0 +1,23 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['available', '-created', '-id'], name='shop_produc_availab_4a1b82_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'available', '-created', '-id'], name='shop_produc_categor_e0b50c_idx'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.7 on 2026-10-18 18:52
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rename_duplicate_slugs(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    duplicates = (
+        Product.objects.values('seller_id', 'slug')
+        .annotate(count=models.Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        products = Product.objects.filter(
+            seller_id=duplicate['seller_id'], slug=duplicate['slug']
+        ).order_by('id')
+        # Keep the oldest as is, suffix the rest with their id
+        for product in products[1:]:
+            product.slug = f"{product.slug[:190]}-{product.id}"
+            product.save(update_fields=['slug'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_image_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_duplicate_slugs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='product',
+            constraint=models.UniqueConstraint(fields=('seller', 'slug'), name='shop_product_seller_slug_unique'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.1.7 on 2026-10-18 19:59
+
+from django.db import migrations, models
+
+
+def build_cards(apps, schema_editor):
+    from shop.cards import card_values
+
+    Product = apps.get_model('shop', 'Product')
+    ProductCard = apps.get_model('shop', 'ProductCard')
+    ProductCard.objects.bulk_create(
+        (ProductCard(**card_values(product))
+         for product in Product.objects.select_related('category').iterator()),
+        batch_size=500,
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_product_seller_slug_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('id', models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                ('seller_id', models.PositiveBigIntegerField()),
+                ('category_id', models.PositiveBigIntegerField()),
+                ('category_name', models.CharField(max_length=200)),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField(db_index=False, max_length=200)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock', models.PositiveIntegerField()),
+                ('available', models.BooleanField()),
+                ('created', models.DateTimeField()),
+                ('updated', models.DateTimeField()),
+                ('url', models.CharField(max_length=500)),
+                ('cart_add_url', models.CharField(max_length=500)),
+                ('image_src', models.CharField(blank=True, max_length=500)),
+                ('image_srcset', models.TextField(blank=True)),
+                ('image_webp_srcset', models.TextField(blank=True)),
+            ],
+            options={
+                'ordering': ('-created', '-id'),
+                'indexes': [models.Index(fields=['available', '-created', '-id'], name='shop_card_catalog_idx'), models.Index(fields=['category_id', 'available', '-created', '-id'], name='shop_card_category_idx'), models.Index(fields=['seller_id', '-created', '-id'], name='shop_card_seller_idx')],
+            },
+        ),
+        migrations.RunPython(build_cards, migrations.RunPython.noop),
+    ]
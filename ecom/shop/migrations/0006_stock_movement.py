@@ -0,0 +1,40 @@
+# Generated by Django 5.1.7 on 2026-10-18 20:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_product_card'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('change', models.IntegerField()),
+                ('stock', models.PositiveIntegerField()),
+                ('reference', models.CharField(blank=True, max_length=100)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ('-created', '-id'),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productcard',
+            index=models.Index(fields=['seller_id', 'stock'], name='shop_card_seller_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='shop.product'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', '-created', '-id'], name='shop_stockm_product_f92f2d_idx'),
+        ),
+    ]
@@ -31,6 +31,10 @@ class Product(models.Model):
     name = models.CharField(max_length=200, db_index=True)
     slug = models.SlugField(max_length=200, db_index=True)
     image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True)
+    # SHA-256 of the image once its resized copies exist (see shop.images)
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # Its width in pixels, which caps the widths of the copies
+    image_width = models.PositiveIntegerField(null=True, editable=False)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     stock = models.PositiveIntegerField()
@@ -42,10 +46,80 @@ class Product(models.Model):
         ordering = ('-created',)
         indexes = [
             models.Index(fields=['id', 'slug']),
+            # Keyset pagination of the catalog walks these in order
+            models.Index(fields=['available', '-created', '-id']),
+            models.Index(fields=['category', 'available', '-created', '-id']),
+        ]
+        constraints = [
+            # Sellers address their products by slug (bulk import upserts on it)
+            models.UniqueConstraint(fields=['seller', 'slug'], name='shop_product_seller_slug_unique'),
         ]
 
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
-        return reverse('shop:product_detail', args=[self.id, self.slug])
\ No newline at end of file
+        return reverse('shop:product_detail', args=[self.id, self.slug])
+
+class ProductCard(models.Model):
+    """
+    What a product listing shows of a product, precomputed (see shop.cards).
+
+    Keyed by the product's id, without a foreign key, so listings read this
+    table alone.
+    """
+    id = models.PositiveBigIntegerField(primary_key=True)
+    seller_id = models.PositiveBigIntegerField()
+    category_id = models.PositiveBigIntegerField()
+    category_name = models.CharField(max_length=200)
+    name = models.CharField(max_length=200)
+    slug = models.SlugField(max_length=200, db_index=False)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    stock = models.PositiveIntegerField()
+    available = models.BooleanField()
+    created = models.DateTimeField()
+    updated = models.DateTimeField()
+    url = models.CharField(max_length=500)
+    cart_add_url = models.CharField(max_length=500)
+    image_src = models.CharField(max_length=500, blank=True)
+    image_srcset = models.TextField(blank=True)
+    image_webp_srcset = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ('-created', '-id')
+        indexes = [
+            models.Index(fields=['available', '-created', '-id'], name='shop_card_catalog_idx'),
+            models.Index(fields=['category_id', 'available', '-created', '-id'], name='shop_card_category_idx'),
+            models.Index(fields=['seller_id', '-created', '-id'], name='shop_card_seller_idx'),
+            # The seller's low-stock alerts are a range of this one
+            models.Index(fields=['seller_id', 'stock'], name='shop_card_seller_stock_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+class StockMovement(models.Model):
+    """
+    One change to a product's stock made through the inventory sync (see
+    shop.inventory). Rows are only ever added.
+    """
+    product = models.ForeignKey(
+        Product,
+        related_name='stock_movements',
+        on_delete=models.CASCADE
+    )
+    # The units added (positive) or taken away, and the stock it left
+    change = models.IntegerField()
+    stock = models.PositiveIntegerField()
+    # The seller's own id for the sync that made the change, if it sent one
+    reference = models.CharField(max_length=100, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('-created', '-id')
+        indexes = [
+            models.Index(fields=['product', '-created', '-id']),
+        ]
+
+    def __str__(self):
+        return f'{self.product_id}: {self.change:+d}'
@@ -0,0 +1,173 @@
+"""
+Shared cache of whole catalog pages for anonymous visitors.
+
+Anonymous visitors all get the same page apart from three things: the CSRF
+token, the cart badge and any pending flash messages. ``cache_anonymous_page``
+renders a ``TemplateResponse`` once with placeholders for the token and the
+badge, stores it under a key that includes a version token, and fills the
+placeholders in for every request. A cache hit runs no SQL at all: the
+session (if any) comes from the ``cached_db`` engine and the badge count is
+read from the session cart. Visitors with pending messages bypass the cache.
+
+``invalidate_pages`` rotates the version token; the ``Product`` and
+``Category`` signals call it, and stock changes and holds from checkout are picked up
+when entries expire after ``PAGE_CACHE_TIMEOUT`` seconds. Without a shared
+cache every worker keeps its own pages, and those expire the same way.
+
+Responses carry an ETag (the page, the visitor's cart count and a hash of
+their CSRF secret) and the ``Last-Modified`` the view set. Only
+``If-None-Match`` is answered with 304: a page kept by the browser holds a
+token for the secret it was served with, and logging in rotates that
+secret, so a date alone can't tell whether the kept page would still post.
+
+The decorator works on async views too; their cache lookups, session and
+user loading then go through the async APIs.
+"""
+import hashlib
+import uuid
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.template.response import TemplateResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+from django.utils.safestring import mark_safe
+
+from accounts.principal import aget_principal, get_principal
+from cart.storage import aget_cart, get_cart
+from ecom.routers import use_primary
+
+VERSION_KEY = 'shop:pages:version'
+CSRF_PLACEHOLDER = 'csrf-token-placeholder'
+CART_BADGE_PLACEHOLDER = mark_safe('<!-- cart-badge -->')
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+async def _acurrent_version():
+    version = await cache.aget(VERSION_KEY)
+    if version is None:
+        await cache.aadd(VERSION_KEY, uuid.uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
+        version = await cache.aget(VERSION_KEY)
+    return version
+
+
+def invalidate_pages():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, settings.CACHE_VERSION_TIMEOUT)
+
+
+def set_last_modified(response, when):
+    """Advertise ``when`` (a datetime, or None) as the page's Last-Modified."""
+    if when is not None:
+        response['Last-Modified'] = http_date(when.timestamp())
+    return response
+
+
+def _cache_key(request, version):
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return f'shop:page:{version}:{path}'
+
+
+def _render_entry(response):
+    """Render ``response`` with placeholders and turn it into a cache entry."""
+    response.context_data = {
+        **(response.context_data or {}),
+        'csrf_token': CSRF_PLACEHOLDER,
+        'cart_badge_placeholder': CART_BADGE_PLACEHOLDER,
+        # Never bake one visitor's messages into a shared page
+        'messages': [],
+    }
+    response.render()
+    content = response.content.decode(response.charset)
+    return {
+        'content': content,
+        'content_type': response['Content-Type'],
+        'etag': hashlib.md5(response.content).hexdigest(),
+        'last_modified': parse_http_date_safe(response.get('Last-Modified', '')),
+    }
+
+
+def _serve(request, entry, count):
+    # Sets a new secret if the visitor has none, which then matches no ETag
+    token = get_token(request)
+    secret = hashlib.md5(request.META['CSRF_COOKIE'].encode()).hexdigest()[:8]
+    etag = f'"{entry["etag"]}-{count}-{secret}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        badge = render_to_string('cart/badge.html', {'cart_summary': {'count': count}})
+        content = (
+            entry['content']
+            .replace(CSRF_PLACEHOLDER, token)
+            .replace(CART_BADGE_PLACEHOLDER, badge)
+        )
+        response = HttpResponse(content, content_type=entry['content_type'])
+    response['ETag'] = etag
+    if entry['last_modified'] is not None:
+        response['Last-Modified'] = http_date(entry['last_modified'])
+    # The badge and token are per visitor: browsers may keep it, proxies may not
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def cache_anonymous_page(view):
+    """Serve ``view``'s ``TemplateResponse`` from the shared page cache to anonymous GETs."""
+    if iscoroutinefunction(view):
+        return _acache_anonymous_page(view)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if (
+            request.method not in ('GET', 'HEAD')
+            or get_principal(request).is_authenticated
+            or len(get_messages(request))
+        ):
+            return view(request, *args, **kwargs)
+
+        key = _cache_key(request, _current_version())
+        entry = cache.get(key)
+        if entry is None:
+            # Shared by everyone until the next change, so never from a lagging replica
+            with use_primary():
+                response = view(request, *args, **kwargs)
+                if not isinstance(response, TemplateResponse) or response.status_code != 200:
+                    return response
+                entry = _render_entry(response)
+            cache.set(key, entry, settings.PAGE_CACHE_TIMEOUT)
+        return _serve(request, entry, len(get_cart(request)))
+    return wrapper
+
+
+def _acache_anonymous_page(view):
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or (await aget_principal(request)).is_authenticated:
+            return await view(request, *args, **kwargs)
+        # Loads the session as well, so the messages check doesn't block
+        count = await (await aget_cart(request)).acount()
+        if len(get_messages(request)):
+            return await view(request, *args, **kwargs)
+
+        key = _cache_key(request, await _acurrent_version())
+        entry = await cache.aget(key)
+        if entry is None:
+            with use_primary():
+                response = await view(request, *args, **kwargs)
+                if not isinstance(response, TemplateResponse) or response.status_code != 200:
+                    return response
+                # Templates may still query (context processors, lazy objects)
+                entry = await sync_to_async(_render_entry)(response)
+            await cache.aset(key, entry, settings.PAGE_CACHE_TIMEOUT)
+        return _serve(request, entry, count)
+    return wrapper
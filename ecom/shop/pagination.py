@@ -0,0 +1,142 @@
+import base64
+import json
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class KeysetPage:
+    """A single page of results plus the cursors needed to move around."""
+
+    def __init__(self, object_list, ordering, has_next, has_previous):
+        self.object_list = object_list
+        self.ordering = ordering
+        self.has_next = has_next
+        self.has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+    @property
+    def next_cursor(self):
+        if self.has_next and self.object_list:
+            return encode_cursor(self.object_list[-1], self.ordering)
+        return None
+
+    @property
+    def previous_cursor(self):
+        if self.has_previous and self.object_list:
+            return encode_cursor(self.object_list[0], self.ordering)
+        return None
+
+
+class KeysetPaginator:
+    """
+    Cursor based pagination over a fixed ordering.
+
+    Unlike OFFSET pagination the cost of fetching a page does not grow with
+    the page number: every page is a single indexed range scan that reads
+    ``per_page + 1`` rows. The ordering must end with a unique field (the
+    primary key) so that the cursor identifies exactly one position.
+    """
+
+    def __init__(self, queryset, per_page, ordering=('-created', '-id')):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.ordering = tuple(ordering)
+
+    def page(self, after=None, before=None):
+        """Return the page following ``after`` or preceding ``before``."""
+        queryset, make_page = self._plan(after, before)
+        return make_page(list(queryset))
+
+    async def apage(self, after=None, before=None):
+        """``page`` for async views."""
+        queryset, make_page = self._plan(after, before)
+        return make_page([row async for row in queryset])
+
+    def _plan(self, after, before):
+        """Return the query for the page and a function building it from the rows."""
+        if before:
+            values = self._decode(before)
+            if values is not None:
+                return self._page_before(values)
+        values = self._decode(after) if after else None
+        return self._page_after(values)
+
+    def _page_after(self, values):
+        queryset = self.queryset.order_by(*self.ordering)
+        if values is not None:
+            queryset = queryset.filter(_seek_filter(self.ordering, values))
+
+        def make_page(rows):
+            return KeysetPage(
+                rows[:self.per_page],
+                self.ordering,
+                has_next=len(rows) > self.per_page,
+                has_previous=values is not None,
+            )
+        return queryset[:self.per_page + 1], make_page
+
+    def _page_before(self, values):
+        reversed_ordering = tuple(_flip(field) for field in self.ordering)
+        queryset = self.queryset.order_by(*reversed_ordering).filter(
+            _seek_filter(reversed_ordering, values)
+        )
+
+        def make_page(rows):
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            return KeysetPage(rows, self.ordering, has_next=True, has_previous=has_previous)
+        return queryset[:self.per_page + 1], make_page
+
+    def _decode(self, cursor):
+        try:
+            raw = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if not isinstance(raw, list) or len(raw) != len(self.ordering):
+                return None
+            opts = self.queryset.model._meta
+            return [
+                opts.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, raw)
+            ]
+        except (ValueError, TypeError, ValidationError):
+            return None
+
+
+def encode_cursor(obj, ordering):
+    values = []
+    for field in ordering:
+        value = getattr(obj, field.lstrip('-'))
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        values.append(value)
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else '-' + field
+
+
+def _seek_filter(ordering, values):
+    """
+    Build the row-value comparison ``(a, b, c) < (x, y, z)`` as a chain of
+    ORs so it works on every backend and can use a composite index.
+    """
+    condition = Q()
+    for position, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        step = Q(**{f'{name}__{lookup}': values[position]})
+        for previous, value in zip(ordering[:position], values[:position]):
+            step &= Q(**{previous.lstrip('-'): value})
+        condition |= step
+    return condition
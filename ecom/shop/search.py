@@ -0,0 +1,446 @@
+"""
+In-memory inverted index over available products.
+
+Two indexes are kept: one over name and description for the search page,
+and a smaller name-only one for type-ahead suggestions. They are built from
+the database the first time they are used and kept up to date by the
+``Product`` signals in ``shop.signals``.
+
+The version of the catalog is a counter in the shared cache. Every product
+change increments it and logs the product id under the new version, so a
+process that finds its copy behind re-reads just the products changed since
+and applies them; it only rebuilds from scratch when the log no longer
+reaches back that far, or after ``invalidate_indexes`` (bulk changes) sets
+the counter to a new random value. Workers converge on the same view of
+the catalog without each paying for a full rebuild per product saved.
+With a process-local cache other workers never see the counter move, so
+there it expires after ``CACHE_VERSION_TIMEOUT`` and they rebuild.
+
+Ranking is BM25 with the product name weighted above the description. The
+last query term is matched as a prefix so the same code serves type-ahead.
+"""
+import bisect
+import heapq
+import math
+import random
+import re
+import threading
+from dataclasses import dataclass
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+
+from ecom.routers import use_primary
+
+VERSION_KEY = 'shop:search:sequence'
+CHANGE_KEY = 'shop:search:change:{version}'
+TOKEN_RE = re.compile(r'\w+')
+
+# BM25 tuning
+K1 = 1.2
+B = 0.75
+NAME_WEIGHT = 3
+# A prefix expands to its most common completions, like a type-ahead box
+MAX_PREFIX_EXPANSION = 16
+# How far into the vocabulary to look for those completions
+PREFIX_SCAN_LIMIT = 1024
+# Rebuild a term's score list once the catalog size moved this much
+STALE_DRIFT = 0.1
+# A process further behind than this, or than the change log reaches back,
+# rebuilds its indexes instead of replaying the changes
+MAX_REPLAY = 200
+CHANGE_LOG_TIMEOUT = 60 * 10
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+@dataclass(frozen=True)
+class IndexedProduct:
+    id: int
+    name: str
+    slug: str
+    category_id: int
+    price: Decimal
+    length: int
+
+
+class _TermImpacts:
+    """
+    BM25 contributions of one term, kept sorted best-first.
+
+    The collection statistics are frozen when the list is built so that
+    sorted access and lookups by product id always agree; the list is
+    rebuilt once the catalog size drifts too far from that snapshot.
+    """
+
+    __slots__ = ('idf', 'average_length', 'doc_count', 'ordered', 'scores')
+
+    def __init__(self, postings, docs, total_length):
+        self.doc_count = len(docs)
+        self.average_length = total_length / self.doc_count
+        self.idf = math.log(
+            1 + (self.doc_count - len(postings) + 0.5) / (len(postings) + 0.5)
+        )
+        self.scores = {
+            pid: self.score(frequency, docs[pid].length)
+            for pid, frequency in postings.items()
+        }
+        # (-score, product_id) ascending == best first, stable ties
+        self.ordered = sorted((-score, pid) for pid, score in self.scores.items())
+
+    def score(self, frequency, length):
+        return self.idf * frequency * (K1 + 1) / (
+            frequency + K1 * (1 - B + B * length / self.average_length)
+        )
+
+    def add(self, product_id, frequency, length):
+        score = self.score(frequency, length)
+        self.scores[product_id] = score
+        bisect.insort(self.ordered, (-score, product_id))
+
+    def remove(self, product_id):
+        score = self.scores.pop(product_id)
+        del self.ordered[bisect.bisect_left(self.ordered, (-score, product_id))]
+
+    def is_stale(self, doc_count):
+        return abs(doc_count - self.doc_count) > max(STALE_DRIFT * self.doc_count, 16)
+
+
+class SearchIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}     # term -> {product_id: weighted term frequency}
+        self._impacts = {}      # term -> _TermImpacts, built on first query
+        self._terms = []        # sorted vocabulary, for prefix lookups
+        self._docs = {}         # product_id -> IndexedProduct
+        self._doc_terms = {}    # product_id -> terms, for removal
+        self._total_length = 0
+        self._loading = False
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, product_id, name, slug, description, category_id, price):
+        frequencies = {}
+        for term in tokenize(name):
+            frequencies[term] = frequencies.get(term, 0) + NAME_WEIGHT
+        for term in tokenize(description):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        length = sum(frequencies.values())
+
+        with self._lock:
+            self.remove(product_id)
+            for term, frequency in frequencies.items():
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                    if not self._loading:
+                        bisect.insort(self._terms, term)
+                postings[product_id] = frequency
+                impacts = self._impacts.get(term)
+                if impacts is not None:
+                    impacts.add(product_id, frequency, length)
+            self._docs[product_id] = IndexedProduct(
+                product_id, name, slug, category_id, Decimal(price), length
+            )
+            self._doc_terms[product_id] = tuple(frequencies)
+            self._total_length += length
+
+    def load(self, rows, warm=False):
+        """
+        Add many products at once, sorting the vocabulary a single time.
+
+        With ``warm`` the per-term score lists are built up front, so the
+        first keystrokes after a rebuild are as fast as the rest.
+        """
+        with self._lock:
+            self._loading = True
+            try:
+                for row in rows:
+                    self.add(*row)
+            finally:
+                self._loading = False
+                self._terms = sorted(self._postings)
+            if warm:
+                for term in self._terms:
+                    self._term_impacts(term)
+
+    def remove(self, product_id):
+        with self._lock:
+            doc = self._docs.pop(product_id, None)
+            if doc is None:
+                return
+            self._total_length -= doc.length
+            for term in self._doc_terms.pop(product_id):
+                postings = self._postings[term]
+                del postings[product_id]
+                impacts = self._impacts.get(term)
+                if impacts is not None:
+                    impacts.remove(product_id)
+                if not postings:
+                    del self._postings[term]
+                    self._impacts.pop(term, None)
+                    del self._terms[bisect.bisect_left(self._terms, term)]
+
+    def _expand_prefix(self, prefix):
+        start = bisect.bisect_left(self._terms, prefix)
+        completions = []
+        for term in self._terms[start:start + PREFIX_SCAN_LIMIT]:
+            if not term.startswith(prefix):
+                break
+            completions.append(term)
+        if len(completions) <= MAX_PREFIX_EXPANSION:
+            return completions
+        expanded = heapq.nlargest(
+            MAX_PREFIX_EXPANSION, completions, key=lambda t: len(self._postings[t])
+        )
+        if prefix in self._postings and prefix not in expanded:
+            expanded[-1] = prefix
+        return expanded
+
+    def _term_impacts(self, term):
+        impacts = self._impacts.get(term)
+        if impacts is None or impacts.is_stale(len(self._docs)):
+            impacts = self._impacts[term] = _TermImpacts(
+                self._postings[term], self._docs, self._total_length
+            )
+        return impacts
+
+    def search(self, query, category_id=None, min_price=None, max_price=None,
+               limit=20, prefix=True):
+        """
+        Return up to ``limit`` ``(IndexedProduct, score)`` pairs, best first.
+
+        Every query term must match (AND semantics). When ``prefix`` is set
+        the last term also matches any word it is a prefix of.
+
+        Products are visited in descending score order for the rarest term
+        and the scan stops as soon as no unseen product can beat the current
+        top ``limit`` (the max-score bound), so common words stay cheap.
+        """
+        terms = tokenize(query)
+        if not terms or limit <= 0:
+            return []
+
+        with self._lock:
+            if not self._docs:
+                return []
+
+            groups = [[term] for term in dict.fromkeys(terms[:-1])]
+            groups.append(self._expand_prefix(terms[-1]) if prefix else [terms[-1]])
+
+            group_impacts = []
+            for group in groups:
+                impacts = [self._term_impacts(t) for t in group if t in self._postings]
+                if not impacts:
+                    return []
+                group_impacts.append(impacts)
+
+            group_impacts.sort(key=lambda g: sum(len(i.scores) for i in g))
+            driver, others = group_impacts[0], group_impacts[1:]
+            others_bound = sum(max(-i.ordered[0][0] for i in group) for group in others)
+            others = [_group_scores(group) for group in others]
+
+            if len(driver) == 1:
+                candidates = driver[0].ordered
+            else:
+                # A product can match several completions; the first time it
+                # comes out of the merge is its best score.
+                candidates = _unique(heapq.merge(*(i.ordered for i in driver)))
+            filtered = category_id is not None or min_price is not None or max_price is not None
+
+            top = []  # min-heap of (score, product_id)
+            docs = self._docs
+            for negative_score, pid in candidates:
+                score = -negative_score
+                if len(top) == limit and score + others_bound <= top[0][0]:
+                    break
+                for scores in others:
+                    best = scores.get(pid)
+                    if best is None:
+                        break
+                    score += best
+                else:
+                    if filtered and not _matches(docs[pid], category_id, min_price, max_price):
+                        continue
+                    if len(top) < limit:
+                        heapq.heappush(top, (score, pid))
+                    elif score > top[0][0]:
+                        heapq.heapreplace(top, (score, pid))
+
+            top.sort(reverse=True)
+            return [(docs[pid], score) for score, pid in top]
+
+
+def _group_scores(group):
+    """
+    Collapse the completions of one query term into a single lookup table.
+
+    Rarer completions are applied last, so a product matching several of
+    them is scored by the most specific one.
+    """
+    if len(group) == 1:
+        return group[0].scores
+    merged = {}
+    for impacts in sorted(group, key=lambda i: i.idf):
+        merged.update(impacts.scores)
+    return merged
+
+
+def _unique(entries):
+    seen = set()
+    for entry in entries:
+        if entry[1] not in seen:
+            seen.add(entry[1])
+            yield entry
+
+
+def _matches(doc, category_id, min_price, max_price):
+    if category_id is not None and doc.category_id != category_id:
+        return False
+    if min_price is not None and doc.price < min_price:
+        return False
+    if max_price is not None and doc.price > max_price:
+        return False
+    return True
+
+
+# (version, full-text index, product-name index)
+_state = (None, None, None)
+_build_lock = threading.Lock()
+
+
+def _new_version():
+    # A random start, so a counter that was evicted and created again
+    # can't be mistaken for the one an index was built at
+    return random.getrandbits(62)
+
+
+def _current_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, _new_version(), settings.CACHE_VERSION_TIMEOUT)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _rows(products):
+    return products.values_list('id', 'name', 'slug', 'description', 'category_id', 'price')
+
+
+def _apply(full, names, product_ids, rows):
+    """Bring ``product_ids`` up to date from ``rows``, dropping those missing."""
+    rows = {row[0]: row for row in rows}
+    for product_id in product_ids:
+        row = rows.get(product_id)
+        if row is None:
+            full.remove(product_id)
+            names.remove(product_id)
+        else:
+            pid, name, slug, description, category_id, price = row
+            full.add(pid, name, slug, description, category_id, price)
+            names.add(pid, name, slug, '', category_id, price)
+
+
+def build_indexes():
+    """Load the full-text and the name-only (type-ahead) index from the DB."""
+    from .models import Product
+
+    products = Product.objects.filter(available=True)
+    # Kept until the next change, so never from a lagging replica
+    with use_primary():
+        full = SearchIndex()
+        full.load(_rows(products).iterator(chunk_size=2000))
+
+        names = SearchIndex()
+        rows = products.values_list('id', 'name', 'slug', 'category_id', 'price')
+        names.load(
+            ((pid, name, slug, '', category_id, price)
+             for pid, name, slug, category_id, price in rows.iterator(chunk_size=2000)),
+            warm=True,
+        )
+    return full, names
+
+
+def _catch_up(state, version):
+    """
+    Replay the changes from ``state``'s version up to ``version`` onto its
+    indexes; return the new state, or None if they have to be rebuilt.
+    """
+    from .models import Product
+
+    seen, full, names = state
+    if full is None or not 0 < version - seen <= MAX_REPLAY:
+        return None
+    keys = [CHANGE_KEY.format(version=number) for number in range(seen + 1, version + 1)]
+    changes = cache.get_many(keys)
+    if len(changes) < len(keys):
+        # Expired, evicted, or not written yet by the process that counted it
+        return None
+    product_ids = set(changes.values())
+    with use_primary():
+        rows = list(_rows(Product.objects.filter(id__in=product_ids, available=True)))
+    _apply(full, names, product_ids, rows)
+    return (version, full, names)
+
+
+def _indexes():
+    global _state
+    version = _current_version()
+    if _state[0] != version:
+        with _build_lock:
+            if _state[0] != version:
+                _state = _catch_up(_state, version) or (version, *build_indexes())
+    return _state
+
+
+def get_index():
+    """Return this process's full-text index, brought up to date with the others."""
+    return _indexes()[1]
+
+
+def get_suggest_index():
+    """Return the product-name index used for type-ahead."""
+    return _indexes()[2]
+
+
+def _publish_change(product_id):
+    global _state
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # No counter yet (or it expired): nobody has an index to catch up
+        invalidate_indexes()
+        return
+    cache.set(CHANGE_KEY.format(version=version), product_id, CHANGE_LOG_TIMEOUT)
+    # Our copy already has this change; it is only current if it was
+    # current before it, otherwise it catches up on the next read.
+    if _state[0] == version - 1:
+        _state = (version, _state[1], _state[2])
+
+
+def index_product(product):
+    """Add, refresh or drop ``product`` depending on its availability."""
+    version, full, names = _state
+    if version is not None:
+        rows = [(
+            product.id, product.name, product.slug, product.description,
+            product.category_id, product.price,
+        )] if product.available else []
+        _apply(full, names, [product.id], rows)
+    _publish_change(product.id)
+
+
+def invalidate_indexes():
+    """Have every process, this one included, rebuild from the database."""
+    cache.set(VERSION_KEY, _new_version(), settings.CACHE_VERSION_TIMEOUT)
+
+
+def unindex_product(product_id):
+    version, full, names = _state
+    if version is not None:
+        _apply(full, names, [product_id], [])
+    _publish_change(product_id)
@@ -0,0 +1,61 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from . import cards
+from .categories import invalidate_categories
+from .images import derivatives_built
+from .models import Category, Product, ProductCard
+from .page_cache import invalidate_pages
+from .search import index_product, invalidate_indexes, unindex_product
+
+# Sent after products were written in bulk (bulk_create/update skip post_save)
+products_changed = Signal()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def category_registry_changed(sender, **kwargs):
+    # Wait for the commit so a concurrent reader can't re-cache old rows
+    transaction.on_commit(invalidate_categories)
+    transaction.on_commit(invalidate_pages)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        # In the same transaction, so the card commits with the product
+        cards.write([instance])
+    transaction.on_commit(lambda: index_product(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    product_id = instance.id
+    ProductCard.objects.filter(id=product_id).delete()
+    transaction.on_commit(lambda: unindex_product(product_id))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created, raw=False, **kwargs):
+    if not created and not raw:
+        cards.rename_category(instance)
+
+
+@receiver(derivatives_built, sender=Product)
+def product_image_built(sender, pk, **kwargs):
+    cards.refresh([pk])
+
+
+@receiver(products_changed)
+def products_changed_in_bulk(sender, seller=None, **kwargs):
+    # Cards first, so the pages dropped below can't be rebuilt from old ones
+    if seller is not None:
+        cards.refresh(seller=seller)
+    else:
+        cards.rebuild()
+    invalidate_categories()
+    invalidate_indexes()
+    invalidate_pages()
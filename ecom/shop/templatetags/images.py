@@ -0,0 +1,43 @@
+from django import template
+from django.utils.html import format_html
+
+from shop.images import sources
+
+register = template.Library()
+
+
+def _picture(src, srcset, webp_srcset, alt, css_class, sizes, loading):
+    if not src:
+        return ''
+    if not srcset:
+        return format_html(
+            '<img src="{}" class="{}" alt="{}" loading="{}">',
+            src, css_class, alt, loading,
+        )
+    webp = format_html(
+        '<source type="image/webp" srcset="{}" sizes="{}">', webp_srcset, sizes
+    ) if webp_srcset else ''
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}" class="{}" alt="{}" '
+        'loading="{}" decoding="async"></picture>',
+        webp, src, srcset, sizes, css_class, alt, loading,
+    )
+
+
+@register.simple_tag
+def responsive_image(image, alt='', css_class='', sizes='100vw', loading='lazy'):
+    """
+    Render ``image`` (an ImageField value) as a ``<picture>`` offering its
+    resized copies through ``srcset``. Falls back to the original file
+    until the copies have been built, and to nothing for an empty field.
+    """
+    return _picture(*sources(image), alt, css_class, sizes, loading)
+
+
+@register.simple_tag
+def card_image(card, css_class='', sizes='100vw', loading='lazy'):
+    """``responsive_image`` for a ``ProductCard``, from the sources stored on it."""
+    return _picture(
+        card.image_src, card.image_srcset, card.image_webp_srcset,
+        card.name, css_class, sizes, loading,
+    )
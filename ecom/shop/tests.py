@@ -1,3 +1,830 @@
-from django.test import TestCase
+import io
+import json
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from decimal import Decimal
+from PIL import Image
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import ApiToken, CustomUser
+from .categories import get_categories, get_category
+from . import cards
+from .bulk import import_products, read_rows
+from .factories import make_products
+from .forms import ProductForm
+from .images import derivative_name
+from .models import Category, Product, ProductCard, StockMovement
+from .page_cache import CART_BADGE_PLACEHOLDER, CSRF_PLACEHOLDER
+from .pagination import KeysetPaginator
+from . import search
+from .search import SearchIndex, get_index, get_suggest_index
+from .signals import products_changed
+
+
+@override_settings(PRODUCTS_PER_PAGE=5)
+class ProductListTests(TestCase):
+    # The products page; categories come from the cached registry
+    QUERY_BUDGET = 1
+
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+
+    def test_query_count_does_not_grow_with_catalog(self):
+        make_products(3, self.seller, self.category)
+        get_categories()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('shop:product_list'))
+
+        for i in range(30):
+            category = Category.objects.create(name=f'Cat {i}', slug=f'cat-{i}')
+            make_products(5, self.seller, category, start=100 + i * 5)
+        cache.clear()
+        get_categories()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(reverse('shop:product_list'))
+
+    def test_category_page_query_budget(self):
+        make_products(12, self.seller, self.category)
+        get_categories()
+        with self.assertNumQueries(self.QUERY_BUDGET):
+            self.client.get(self.category.get_absolute_url())
+
+    def test_unknown_category_is_404(self):
+        response = self.client.get(reverse('shop:product_list_by_category', args=['nope']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_category_counts_are_annotated(self):
+        make_products(4, self.seller, self.category)
+        Product.objects.filter(slug='product-0').update(available=False)
+        response = self.client.get(reverse('shop:product_list'))
+        books = next(c for c in response.context['categories'] if c.slug == 'books')
+        self.assertEqual(books.product_count, 3)
+
+    def test_cursor_walks_every_product_once(self):
+        make_products(12, self.seller, self.category)
+        seen = []
+        url = reverse('shop:product_list')
+        params = {}
+        while True:
+            page = self.client.get(url, params).context['page']
+            seen.extend(p.id for p in page)
+            if not page.has_next:
+                break
+            params = {'after': page.next_cursor}
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(seen, list(
+            Product.objects.order_by('-created', '-id').values_list('id', flat=True)
+        ))
+
+    def test_before_cursor_returns_previous_page(self):
+        make_products(12, self.seller, self.category)
+        url = reverse('shop:product_list')
+        first = self.client.get(url).context['page']
+        second = self.client.get(url, {'after': first.next_cursor}).context['page']
+        back = self.client.get(url, {'before': second.previous_cursor}).context['page']
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertFalse(back.has_previous)
+
+    def test_invalid_cursor_falls_back_to_first_page(self):
+        make_products(3, self.seller, self.category)
+        response = self.client.get(reverse('shop:product_list'), {'after': 'garbage'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 3)
+
+
+    async def test_async_page_matches_page(self):
+        await sync_to_async(make_products)(12, self.seller, self.category)
+        paginator = KeysetPaginator(Product.objects.all(), 5)
+        first = await paginator.apage()
+        second = await paginator.apage(after=first.next_cursor)
+        back = await paginator.apage(before=second.previous_cursor)
+        self.assertEqual([p.id for p in back], [p.id for p in first])
+        self.assertEqual(
+            [p.id for p in second],
+            [p.id for p in await sync_to_async(paginator.page)(after=first.next_cursor)],
+        )
+
+
+class ProductCardTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+
+    def create_product(self, **fields):
+        return Product.objects.create(**{
+            'seller': self.seller, 'category': self.category, 'name': 'A book',
+            'slug': 'a-book', 'image': 'products/test.jpg', 'price': '5.00', 'stock': 3,
+            **fields,
+        })
+
+    def test_saving_a_product_writes_its_card(self):
+        # No on_commit: the card is written in the product's transaction
+        product = self.create_product()
+        card = ProductCard.objects.get(id=product.id)
+        self.assertEqual(card.url, product.get_absolute_url())
+        self.assertEqual(card.cart_add_url, reverse('cart:cart_add', args=[product.id]))
+        self.assertEqual(card.image_src, product.image.url)
+        self.assertEqual(card.category_name, 'Books')
+
+        product.price = Decimal('7.50')
+        product.available = False
+        product.save()
+        card.refresh_from_db()
+        self.assertEqual((card.price, card.available), (Decimal('7.50'), False))
+
+    def test_category_rename_and_product_delete(self):
+        product = self.create_product()
+        self.category.name = 'Novels'
+        self.category.save()
+        self.assertEqual(ProductCard.objects.get(id=product.id).category_name, 'Novels')
+        product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+    def test_listing_reads_only_the_cards(self):
+        make_products(5, self.seller, self.category)
+        get_categories()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.category.get_absolute_url())
+        self.assertEqual(len(response.context['products']), 5)
+        (query,) = queries
+        self.assertIn('"shop_productcard"', query['sql'])
+        self.assertNotIn('JOIN', query['sql'])
+
+    def test_dashboard_queries_do_not_grow_with_products(self):
+        self.client.force_login(self.seller)
+        make_products(2, self.seller, self.category)
+        get_categories()
+        # Caches the user's principal
+        self.client.get(reverse('shop:seller_dashboard'))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(reverse('shop:seller_dashboard'))
+        other = Category.objects.create(name='Games', slug='games')
+        make_products(6, self.seller, other, start=2)
+        with self.assertNumQueries(len(few)):
+            response = self.client.get(reverse('shop:seller_dashboard'))
+        self.assertContains(response, 'Games')
+
+    def test_bulk_import_refreshes_the_sellers_cards(self):
+        make_products(2, self.seller, self.category)
+        Product.objects.filter(slug='product-0').update(stock=0)
+        Product.objects.filter(slug='product-1').delete()
+        ProductCard.objects.filter(name='Product 1').update(name='Stale')
+        products_changed.send(sender=Product, seller=self.seller)
+        self.assertEqual(list(ProductCard.objects.values_list('name', 'stock')), [('Product 0', 0)])
+
+    def test_command_rebuilds_every_card(self):
+        make_products(3, self.seller, self.category)
+        ProductCard.objects.all().delete()
+        out = io.StringIO()
+        call_command('rebuild_product_cards', stdout=out)
+        self.assertIn('3 product cards rebuilt', out.getvalue())
+        self.assertEqual(
+            list(ProductCard.objects.values_list('id', flat=True)),
+            list(Product.objects.order_by('-created', '-id').values_list('id', flat=True)),
+        )
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+        self.product = Product.objects.create(
+            seller=self.seller, category=self.category, name='Novel', slug='novel',
+            image='products/test.jpg', price='9.99', stock=20,
+        )
+        self.url = self.product.get_absolute_url()
+
+    def test_anonymous_hit_runs_no_queries(self):
+        self.client.get(self.url)
+        # A visitor with a session cart costs nothing either
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 3})
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Novel')
+        self.assertContains(response, '>3</span>')
+        self.client.get(reverse('shop:product_list'))
+        with self.assertNumQueries(0):
+            self.client.get(reverse('shop:product_list'))
+
+    def test_per_visitor_parts_are_filled_in(self):
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 2})
+        first = self.client.get(self.url)
+        other = Client(enforce_csrf_checks=True)
+        second = other.get(self.url)
+        for response in (first, second):
+            self.assertNotContains(response, CSRF_PLACEHOLDER)
+            self.assertNotContains(response, CART_BADGE_PLACEHOLDER)
+        self.assertContains(first, '>2</span>')
+        self.assertNotContains(second, 'badge rounded-pill')
+
+        # The token filled into the cached page is valid for that visitor
+        token = second.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        response = other.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 1, 'csrfmiddlewaretoken': token},
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_saving_a_product_invalidates_pages(self):
+        self.client.get(self.url)
+        self.client.get(reverse('shop:product_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.name = 'Renamed'
+            self.product.save()
+        self.assertContains(self.client.get(self.url), 'Renamed')
+        self.assertContains(self.client.get(reverse('shop:product_list')), 'Renamed')
+
+    def test_conditional_get(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('private', response['Cache-Control'])
+
+        etag = response['ETag']
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # The date can't vouch for the kept page's CSRF token
+        response = self.client.get(
+            self.url, headers={'If-Modified-Since': response['Last-Modified']}
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # The ETag covers the badge, so adding to the cart changes it
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]))
+        response = self.client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_kept_page_is_not_reused_after_the_csrf_secret_rotates(self):
+        client = Client(enforce_csrf_checks=True)
+        etag = client.get(self.url)['ETag']
+        login = client.get(reverse('login'))
+        token = login.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        client.post(
+            reverse('login'),
+            {'username': 'seller', 'password': 'pass', 'csrfmiddlewaretoken': token},
+        )
+        client.logout()
+
+        response = client.get(self.url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        token = response.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        response = client.post(
+            reverse('cart:cart_add', args=[self.product.id]),
+            {'quantity': 1, 'csrfmiddlewaretoken': token},
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def test_logged_in_users_bypass_the_cache(self):
+        self.client.get(self.url)
+        self.client.force_login(self.seller)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['product'], self.product)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_missing_product_is_not_cached(self):
+        url = reverse('shop:product_detail', args=[999, 'nope'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    @override_settings(ROOT_URLCONF='ecom.urls_async')
+    def test_pages_under_asgi(self):
+        get = async_to_sync(self.async_client.get)
+        self.assertContains(get(self.url), 'Novel')
+        with self.assertNumQueries(0):
+            response = get(self.url)
+        self.assertContains(response, 'Novel')
+
+        async_to_sync(self.async_client.post)(
+            reverse('cart:cart_add', args=[self.product.id]), {'quantity': 2}
+        )
+        self.assertContains(get(self.category.get_absolute_url()), '>2</span>')
+        self.assertEqual(get(reverse('shop:product_list_by_category', args=['nope'])).status_code, 404)
+
+
+class CategoryRegistryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+
+    def test_cache_hit_costs_no_sql(self):
+        get_categories()
+        with self.assertNumQueries(0):
+            entries = get_categories()
+            self.assertEqual(get_category('books'), entries[0])
+            self.assertEqual(entries[0].get_absolute_url(), '/shop/books/')
+
+    def test_saving_category_invalidates(self):
+        get_categories()
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Games', slug='games')
+        self.assertEqual([c.slug for c in get_categories()], ['books', 'games'])
+
+    @override_settings(CACHE_VERSION_TIMEOUT=60)
+    def test_process_local_copies_expire_without_a_shared_cache(self):
+        get_categories()
+        # Renamed by another worker, whose invalidation this one never sees
+        Category.objects.filter(id=self.category.id).update(name='Novels')
+        self.assertEqual(get_category('books').name, 'Books')
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertEqual(get_category('books').name, 'Novels')
+
+    def test_saving_product_refreshes_counts(self):
+        self.assertEqual(get_category('books').product_count, 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                seller=self.seller, category=self.category, name='Novel',
+                slug='novel', price='5.00', stock=1,
+            )
+        self.assertEqual(get_category('books').product_count, 1)
+
+    def test_product_form_renders_choices_without_sql(self):
+        get_categories()
+        with self.assertNumQueries(0):
+            html = ProductForm().as_p()
+        self.assertIn('Books', html)
+
+
+class SearchIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = SearchIndex()
+        self.index.load([
+            (1, 'Red cotton shirt', 'red-shirt', 'A soft shirt', 1, '20.00'),
+            (2, 'Blue denim jacket', 'blue-jacket', 'Goes with a red shirt', 1, '80.00'),
+            (3, 'Red wireless mouse', 'red-mouse', 'Bluetooth', 2, '15.00'),
+        ])
+
+    def ids(self, *args, **kwargs):
+        return [doc.id for doc, score in self.index.search(*args, **kwargs)]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.ids('shirt'), [1, 2])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.ids('red mouse'), [3])
+
+    def test_last_term_is_a_prefix(self):
+        self.assertEqual(self.ids('wirel'), [3])
+        self.assertEqual(self.ids('wirel', prefix=False), [])
+
+    def test_category_and_price_filters(self):
+        self.assertEqual(self.ids('red', category_id=2), [3])
+        self.assertEqual(sorted(self.ids('red', max_price=Decimal('20'))), [1, 3])
+        self.assertEqual(self.ids('red', min_price=Decimal('50')), [2])
+
+    def test_remove_and_update(self):
+        self.index.search('red')  # build score lists so they are maintained
+        self.index.remove(3)
+        self.assertEqual(self.ids('mouse'), [])
+        self.index.add(1, 'Green cotton shirt', 'green-shirt', '', 1, '20.00')
+        self.assertEqual(self.ids('green'), [1])
+        self.assertNotIn(1, self.ids('red'))
+
+    def test_limit_keeps_the_best_matches(self):
+        index = SearchIndex()
+        index.load([(i, 'lamp ' + 'x ' * i, f'lamp-{i}', '', 1, '1.00') for i in range(50)])
+        self.assertEqual([doc.id for doc, score in index.search('lamp', limit=3)], [0, 1, 2])
+
+
+class SearchViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.books = Category.objects.create(name='Books', slug='books')
+        self.games = Category.objects.create(name='Games', slug='games')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.novel = Product.objects.create(
+                seller=self.seller, category=self.books, name='Space novel',
+                slug='space-novel', image='products/test.jpg', price='12.00', stock=5,
+            )
+            Product.objects.create(
+                seller=self.seller, category=self.games, name='Space shooter',
+                slug='space-shooter', image='products/test.jpg', price='40.00', stock=5,
+            )
+
+    def test_search_page_ranks_and_filters(self):
+        url = reverse('shop:product_search')
+        response = self.client.get(url, {'q': 'space'})
+        self.assertEqual(len(response.context['products']), 2)
+        response = self.client.get(url, {'q': 'space', 'category': 'games'})
+        self.assertEqual([p.slug for p in response.context['products']], ['space-shooter'])
+        response = self.client.get(url, {'q': 'space', 'max_price': '20'})
+        self.assertEqual([p.slug for p in response.context['products']], ['space-novel'])
+
+    def test_suggest_is_json_and_sql_free(self):
+        url = reverse('shop:product_suggest')
+        self.client.get(url, {'q': 'sp'})
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'q': 'space nov'})
+        self.assertEqual(response.json()['results'], [{
+            'id': self.novel.id,
+            'name': 'Space novel',
+            'price': '12.00',
+            'url': self.novel.get_absolute_url(),
+        }])
+
+    def test_signals_keep_index_current(self):
+        get_index()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.novel.available = False
+            self.novel.save()
+        self.assertEqual([doc.slug for doc, score in get_index().search('space')], ['space-shooter'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.filter(slug='space-shooter').get().delete()
+        self.assertEqual(get_index().search('space'), [])
+
+    def test_other_workers_replay_changes_instead_of_rebuilding(self):
+        get_index()
+        ours = search._state
+        # Saved by another worker: this one's index doesn't see it happen
+        search._state = (None, None, None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.novel.name = 'Space opera'
+            self.novel.save()
+        search._state = ours
+        # The changed product only, not the whole catalog twice
+        with self.assertNumQueries(1):
+            results = get_index().search('opera')
+        self.assertEqual([doc.slug for doc, score in results], ['space-novel'])
+        self.assertEqual(get_suggest_index().search('nov'), [])
+
+
+def make_upload(name='photo.png', size=(2000, 1500), color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(IMAGE_DERIVATIVES_EAGER=True)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        settings_override = override_settings(MEDIA_ROOT=media)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+        self.client.force_login(self.seller)
+
+    def create_product(self, upload, slug='a-book'):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('shop:product_create'), {
+                'category': self.category.id, 'name': 'A book', 'slug': slug,
+                'image': upload, 'description': '', 'price': '5.00',
+                'stock': 3, 'available': 'on',
+            })
+        return Product.objects.get(slug=slug)
+
+    def test_upload_builds_resized_copies(self):
+        product = self.create_product(make_upload())
+        self.assertEqual(len(product.image_hash), 64)
+        for width in (320, 640, 1280):
+            for extension in ('jpg', 'webp'):
+                name = derivative_name(product.image_hash, width, extension)
+                with default_storage.open(name) as derivative:
+                    self.assertEqual(Image.open(derivative).size, (width, width * 3 // 4))
+
+    def test_small_images_are_not_enlarged(self):
+        product = self.create_product(make_upload(size=(500, 375)))
+        self.assertEqual(product.image_width, 500)
+        for width, exists in ((320, True), (500, True), (640, False), (1280, False)):
+            name = derivative_name(product.image_hash, width, 'jpg')
+            self.assertEqual(default_storage.exists(name), exists, width)
+        with default_storage.open(derivative_name(product.image_hash, 500, 'jpg')) as derivative:
+            self.assertEqual(Image.open(derivative).size, (500, 375))
+        # The srcset only offers widths the files really have
+        srcset = ProductCard.objects.get(id=product.id).image_srcset
+        self.assertEqual([entry.split()[1] for entry in srcset.split(', ')], ['320w', '500w'])
+
+    def test_identical_uploads_share_derivatives(self):
+        first = self.create_product(make_upload('one.png'), slug='one')
+        second = self.create_product(make_upload('two.png'), slug='two')
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(first.image_hash, second.image_hash)
+
+    def test_replacing_the_image_resets_and_rebuilds(self):
+        product = self.create_product(make_upload())
+        old_hash = product.image_hash
+        form = ProductForm(
+            {'category': self.category.id, 'name': 'A book', 'slug': 'a-book',
+             'price': '5.00', 'stock': 3, 'available': True},
+            {'image': make_upload(color=(0, 0, 255))},
+            instance=product,
+        )
+        self.assertTrue(form.is_valid(), form.errors)
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save()
+        product.refresh_from_db()
+        self.assertNotIn(product.image_hash, ('', old_hash))
+
+    def test_list_renders_srcset(self):
+        product = self.create_product(make_upload())
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, f'{product.image_hash}-320.jpg 320w')
+        self.assertNotContains(response, product.image.url)
+
+    def test_original_is_served_until_copies_exist(self):
+        product = self.create_product(make_upload())
+        Product.objects.filter(id=product.id).update(image_hash='')
+        cards.refresh([product.id])
+        response = self.client.get(reverse('shop:product_list'))
+        self.assertContains(response, f'<img src="{product.image.url}"')
+
+    def test_profile_picture_uses_the_pipeline(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('profile'), {
+                'username': 'seller', 'email': 'seller@example.com',
+                'profile_picture': make_upload(size=(600, 600)),
+            })
+        self.seller.refresh_from_db()
+        name = derivative_name(self.seller.profile_picture_hash, 128, 'jpg')
+        self.assertTrue(default_storage.exists(name))
+        self.assertContains(self.client.get(reverse('profile')), '128w')
+
+    def test_command_backfills_existing_images(self):
+        product = self.create_product(make_upload())
+        Product.objects.filter(id=product.id).update(image_hash='')
+        call_command('build_image_derivatives', stdout=io.StringIO())
+        product.refresh_from_db()
+        self.assertEqual(len(product.image_hash), 64)
+
+        # Copies made before widths were recorded are redone
+        Product.objects.filter(id=product.id).update(image_width=None)
+        output = io.StringIO()
+        call_command('build_image_derivatives', stdout=output)
+        self.assertIn('shop.Product.image: 1 built', output.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(product.image_width, 2000)
+
+
+CSV_HEADER = 'slug,name,category,description,price,stock,available\n'
+
+
+class BulkImportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.books = Category.objects.create(name='Books', slug='books')
+        Category.objects.create(name='Games', slug='games')
+        self.client.force_login(self.seller)
+
+    def upload(self, name, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('shop:product_import'), {
+                'file': SimpleUploadedFile(name, content.encode()),
+            })
+
+    def test_csv_import_creates_then_updates(self):
+        response = self.upload('p.csv', CSV_HEADER + (
+            'red-book,Red book,books,"Red, hardback",9.99,3,true\n'
+            'blue-game,Blue game,games,,19.50,0,false\n'
+        ))
+        self.assertEqual(response.context['result'].imported, 2)
+        game = Product.objects.get(slug='blue-game')
+        self.assertEqual((game.price, game.stock, game.available), (Decimal('19.50'), 0, False))
+
+        self.upload('p.csv', CSV_HEADER + 'red-book,Red book,books,,7.00,10,\n')
+        self.assertEqual(Product.objects.count(), 2)
+        book = Product.objects.get(slug='red-book')
+        self.assertEqual((book.price, book.stock, book.available), (Decimal('7.00'), 10, True))
+
+    def test_unreadable_files_are_reported(self):
+        url = reverse('shop:product_import')
+        # Saved from Excel as plain "CSV": Windows-1252, not UTF-8
+        upload = SimpleUploadedFile('p.csv', (CSV_HEADER + 'cafe,Caf\xe9,books,,9.99,3,\n').encode('cp1252'))
+        response = self.client.post(url, {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Line 2: Not UTF-8 text.', response.context['error'])
+        self.assertFalse(Product.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(url, {'file': SimpleUploadedFile('p.csv', (
+                CSV_HEADER + 'red-book,Red book,books,,9.99,3,\n' + 'x' * 200_000 + ',Huge,books,,1.00,1,\n'
+            ).encode())})
+        self.assertIn('Line 3: Not valid CSV', response.context['error'])
+        self.assertIn('The 1 valid rows before it were imported.', response.context['error'])
+        self.assertTrue(Product.objects.filter(slug='red-book').exists())
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        response = self.upload('p.csv', CSV_HEADER + (
+            'ok,Fine,books,,1.00,1,true\n'
+            'bad slug,Broken,books,,1.00,1,true\n'
+            'no-cat,No category,comics,,1.00,1,true\n'
+            'neg,Negative,books,,-1,-5,true\n'
+        ))
+        result = response.context['result']
+        self.assertEqual((result.imported, result.failed), (1, 3))
+        self.assertEqual([line for line, messages in result.errors], [3, 4, 5])
+        self.assertIn('Unknown category', result.errors[1][1][0])
+        self.assertEqual(list(Product.objects.values_list('slug', flat=True)), ['ok'])
+
+    def test_available_column_is_read_strictly(self):
+        response = self.upload('p.csv', CSV_HEADER + ''.join(
+            f'p-{i},P {i},books,,1.00,1,{value}\n'
+            for i, value in enumerate(['no', 'FALSE', 'n', 'off', '0', 'Yes', ' on ', '', 'maybe'])
+        ))
+        result = response.context['result']
+        self.assertEqual((result.imported, result.failed), (8, 1))
+        self.assertEqual(result.errors, [(10, ['available: Enter yes or no (or leave it blank for yes).'])])
+        available = dict(Product.objects.values_list('slug', 'available'))
+        self.assertEqual(available, {
+            'p-0': False, 'p-1': False, 'p-2': False, 'p-3': False, 'p-4': False,
+            'p-5': True, 'p-6': True, 'p-7': True,
+        })
+
+    def test_jsonl_import_last_duplicate_wins(self):
+        response = self.upload('p.jsonl', (
+            '{"slug": "a", "name": "First", "category": "books", "price": "2.00", "stock": 1}\n'
+            'not json\n'
+            '{"slug": "a", "name": "Second", "category": "books", "price": 3, "stock": 2}\n'
+        ))
+        result = response.context['result']
+        self.assertEqual((result.imported, result.failed), (1, 1))
+        self.assertEqual(Product.objects.get().name, 'Second')
+
+    def test_unknown_format_and_missing_columns(self):
+        self.assertEqual(self.upload('p.txt', 'x').context['error'], 'Upload a .csv or .jsonl file.')
+        self.assertIn('price', self.upload('p.csv', 'slug,name\na,b\n').context['error'])
+
+    def test_query_count_is_per_chunk_not_per_row(self):
+        rows = ((i, {'slug': f'p-{i}', 'name': f'P {i}', 'category': 'books',
+                     'price': '1.00', 'stock': '1'}) for i in range(250))
+        # categories, then savepoint, upsert, release for each chunk of 50
+        with self.assertNumQueries(1 + 5 * 3):
+            result = import_products(self.seller, rows, chunk_size=50)
+        self.assertEqual(result.imported, 250)
+
+    def test_import_refreshes_search_and_category_counts(self):
+        self.assertEqual(get_categories()[0].product_count, 0)
+        self.assertEqual(len(get_index()), 0)
+        self.upload('p.csv', CSV_HEADER + 'zebra-book,Zebra book,books,,1.00,1,true\n')
+        self.assertEqual(get_category('books').product_count, 1)
+        self.assertEqual(get_index().search('zebra')[0][0].slug, 'zebra-book')
+
+    def test_export_round_trips(self):
+        make_products(3, self.seller, self.books)
+        response = self.client.get(reverse('shop:product_export'))
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content.decode().splitlines()[1], 'product-0,Product 0,books,,2.50,10,True')
+
+        Product.objects.update(stock=0)
+        rows = read_rows(io.BytesIO(content), 'products.csv')
+        self.assertEqual(import_products(self.seller, rows).imported, 3)
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {10})
+
+        lines = b''.join(self.client.get(reverse('shop:product_export') + '?format=jsonl').streaming_content)
+        self.assertEqual(len(lines.splitlines()), 3)
+
+    def test_product_form_rejects_a_slug_the_seller_already_uses(self):
+        make_products(1, self.seller, self.books)
+        response = self.client.post(reverse('shop:product_create'), {
+            'category': self.books.id, 'name': 'Dup', 'slug': 'product-0',
+            'price': '1.00', 'stock': 1,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('slug', response.context['form'].errors)
+
+
+@override_settings(LOW_STOCK_THRESHOLD=10)
+class InventorySyncTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = CustomUser.objects.create_user(
+            username='seller', password='pass', user_type='seller'
+        )
+        self.category = Category.objects.create(name='Books', slug='books')
+        self.products = make_products(3, self.seller, self.category, stock=20)
+        self.client.force_login(self.seller)
+        # Like a warehouse system: a key, no cookies and no CSRF token
+        self.key = ApiToken.issue(self.seller)
+        self.api = Client(enforce_csrf_checks=True, headers={'Authorization': f'Bearer {self.key}'})
+
+    def sync(self, changes, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.api.post(
+                reverse('shop:inventory_sync'), json.dumps({'changes': changes, **data}),
+                content_type='application/json',
+            )
+
+    def stock(self):
+        return list(Product.objects.order_by('id').values_list('stock', flat=True))
+
+    def test_deltas_and_counts_are_applied_and_logged(self):
+        first, second, third = self.products
+        response = self.sync([
+            {'id': first.id, 'delta': -15},
+            {'id': second.id, 'stock': 40},
+            {'id': first.id, 'delta': 2},
+            {'id': third.id, 'stock': 20},
+        ], reference='wh-7')
+        self.assertEqual(response.json(), {
+            'updated': 2, 'low_stock': [{'id': first.id, 'name': 'Product 0', 'stock': 7}],
+        })
+        self.assertEqual(self.stock(), [7, 40, 20])
+        self.assertEqual(list(ProductCard.objects.order_by('id').values_list('stock', flat=True)), [7, 40, 20])
+        # A count that matches the stock isn't a movement
+        self.assertEqual(
+            list(StockMovement.objects.order_by('id').values_list('product_id', 'change', 'stock', 'reference')),
+            [(first.id, -15, 5, 'wh-7'), (second.id, 20, 40, 'wh-7'), (first.id, 2, 7, 'wh-7')],
+        )
+
+    def test_query_count_does_not_grow_with_changes(self):
+        self.client.get(reverse('shop:seller_dashboard'))
+        with CaptureQueriesContext(connection) as few:
+            self.sync([{'id': self.products[0].id, 'delta': 1}])
+        more = make_products(30, self.seller, self.category, start=3)
+        with self.assertNumQueries(len(few)):
+            self.sync([{'id': product.id, 'delta': 1} for product in self.products + more])
+
+    def test_one_bad_change_applies_nothing(self):
+        other = CustomUser.objects.create_user(username='other', password='pass', user_type='seller')
+        (theirs,) = make_products(1, other, self.category, start=3, stock=20)
+        response = self.sync([
+            {'id': self.products[0].id, 'stock': 1},
+            {'id': self.products[1].id, 'delta': -21},
+            {'id': theirs.id, 'delta': 1},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            'changes[1]: Only 20 of product %d in stock.' % self.products[1].id,
+            'changes[2]: You have no product %d.' % theirs.id,
+        ])
+        self.assertEqual(self.stock(), [20, 20, 20, 20])
+        self.assertFalse(StockMovement.objects.exists())
+
+    def test_malformed_syncs_are_rejected(self):
+        self.assertEqual(self.sync([{'id': 1}, {'id': '1', 'stock': 1}, {'id': 1, 'stock': -1}]).json(), {
+            'errors': [
+                'changes[0]: Give one of "delta" and "stock".',
+                'changes[1]: Needs an integer "id".',
+                'changes[2]: "stock" must be a whole number.',
+            ],
+        })
+        response = self.api.post(reverse('shop:inventory_sync'), 'stock', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.api.get(reverse('shop:inventory_sync')).status_code, 405)
+
+    def test_syncs_need_a_sellers_api_key(self):
+        url = reverse('shop:inventory_sync')
+        body = json.dumps({'changes': [{'id': self.products[0].id, 'stock': 1}]})
+        # A logged-in browser session is not enough
+        response = self.client.post(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        self.assertIn('errors', response.json())
+        response = self.client.post(url, body, content_type='application/json', headers={
+            'Authorization': 'Bearer not-a-key',
+        })
+        self.assertEqual(response.status_code, 401)
+
+        buyer = CustomUser.objects.create_user(username='buyer', password='pass')
+        response = self.client.post(url, body, content_type='application/json', headers={
+            'Authorization': f'Bearer {ApiToken.issue(buyer)}',
+        })
+        self.assertEqual(response.status_code, 403)
+        self.assertIn('errors', response.json())
+
+        call_command('issue_api_token', 'seller', stdout=io.StringIO())
+        response = self.api.post(url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stock(), [20, 20, 20])
+
+    def test_dashboard_warns_about_low_stock(self):
+        Product.objects.filter(id=self.products[2].id).update(stock=3)
+        cards.refresh_stock([self.products[2].id])
+        response = self.client.get(reverse('shop:seller_dashboard'))
+        self.assertEqual([card.name for card in response.context['low_stock']], ['Product 2'])
+        self.assertContains(response, '3 left')
@@ -9,6 +9,11 @@ urlpatterns = [
     path('seller/products/add/', views.product_create, name='product_create'),
     path('seller/products/<int:pk>/edit/', views.product_update, name='product_update'),
     path('seller/products/<int:pk>/delete/', views.product_delete, name='product_delete'),
+    path('seller/products/import/', views.product_import, name='product_import'),
+    path('seller/products/export/', views.product_export, name='product_export'),
+    path('seller/inventory/', views.inventory_sync, name='inventory_sync'),
+    path('search/', views.product_search, name='product_search'),
+    path('search/suggest/', views.product_suggest, name='product_suggest'),
     path('', views.product_list, name='product_list'),
     path('<slug:category_slug>/', views.product_list, name='product_list_by_category'),
     path('<int:id>/<slug:slug>/', views.product_detail, name='product_detail'),
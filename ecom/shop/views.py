@@ -1,36 +1,49 @@
-from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth.decorators import login_required
-from accounts.decorators import seller_required
-from .models import Product, Category
-from .forms import ProductForm
+import json
+
+from django.conf import settings
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+from django.shortcuts import aget_object_or_404, render, redirect, get_object_or_404
+from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.views.decorators.http import require_POST
+from accounts.decorators import api_token_required, seller_required
+from accounts.principal import get_principal
+from orders.reservations import with_available_stock
+from .models import Product, ProductCard
+from .categories import aget_categories, aget_category, get_categories, get_category
+from .bulk import COLUMNS, ImportFileError, export_csv, export_jsonl, import_products, read_rows
+from .forms import ProductForm, ProductImportUploadForm, ProductSearchForm
+from .inventory import StockChangeError, apply_stock_changes, low_stock, parse_changes
+from .page_cache import cache_anonymous_page, set_last_modified
+from .pagination import KeysetPaginator
+from .search import get_index, get_suggest_index
 
-@login_required
 @seller_required
 def seller_dashboard(request):
-    products = Product.objects.filter(seller=request.user)
+    seller_id = get_principal(request).id
+    products = ProductCard.objects.filter(seller_id=seller_id)
     return render(request, 'shop/seller/dashboard.html', {
         'products': products,
-        'categories': Category.objects.all()
+        'low_stock': low_stock(seller_id)[:settings.LOW_STOCK_SHOWN],
+        'low_stock_threshold': settings.LOW_STOCK_THRESHOLD,
+        'categories': get_categories()
     })
 
-@login_required
 @seller_required
 def product_create(request):
+    product = Product(seller_id=get_principal(request).id)
     if request.method == 'POST':
-        form = ProductForm(request.POST, request.FILES)
+        form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
-            product = form.save(commit=False)
-            product.seller = request.user
-            product.save()
+            form.save()
             return redirect('shop:seller_dashboard')
     else:
-        form = ProductForm()
+        form = ProductForm(instance=product)
     return render(request, 'shop/seller/product_form.html', {'form': form})
 
-@login_required
 @seller_required
 def product_update(request, pk):
-    product = get_object_or_404(Product, pk=pk, seller=request.user)
+    product = get_object_or_404(Product, pk=pk, seller_id=get_principal(request).id)
     if request.method == 'POST':
         form = ProductForm(request.POST, request.FILES, instance=product)
         if form.is_valid():
@@ -40,32 +53,158 @@ def product_update(request, pk):
         form = ProductForm(instance=product)
     return render(request, 'shop/seller/product_form.html', {'form': form})
 
-@login_required
 @seller_required
 def product_delete(request, pk):
-    product = get_object_or_404(Product, pk=pk, seller=request.user)
+    product = get_object_or_404(Product, pk=pk, seller_id=get_principal(request).id)
     if request.method == 'POST':
         product.delete()
         return redirect('shop:seller_dashboard')
     return render(request, 'shop/seller/product_confirm_delete.html', {'product': product})
 
-from django.shortcuts import get_object_or_404
+@seller_required
+def product_import(request):
+    """Create or update many products from a CSV or JSON lines upload."""
+    form = ProductImportUploadForm(request.POST or None, request.FILES or None)
+    result = error = None
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        try:
+            result = import_products(request.user, read_rows(upload, upload.name.lower()))
+        except ImportFileError as e:
+            error = str(e)
+    return render(request, 'shop/seller/product_import.html', {
+        'form': form, 'result': result, 'error': error, 'columns': COLUMNS,
+    })
 
+@seller_required
+def product_export(request):
+    """Stream the seller's catalog in the import format."""
+    if request.GET.get('format') == 'jsonl':
+        response = StreamingHttpResponse(export_jsonl(request.user), content_type='application/x-ndjson')
+        filename = 'products.jsonl'
+    else:
+        response = StreamingHttpResponse(export_csv(request.user), content_type='text/csv')
+        filename = 'products.csv'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@api_token_required
+@require_POST
+def inventory_sync(request):
+    """Apply a JSON batch of stock changes from a warehouse system (see shop.inventory)."""
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'errors': ['The body is not JSON.']}, status=400)
+    try:
+        changes, reference = parse_changes(data)
+        result = apply_stock_changes(request.api_user.id, changes, reference)
+    except StockChangeError as e:
+        return JsonResponse({'errors': e.errors}, status=400)
+    return JsonResponse({'updated': result.updated, 'low_stock': result.low_stock})
+
+@cache_anonymous_page
 def product_list(request, category_slug=None):
     category = None
-    categories = Category.objects.all()
-    products = Product.objects.filter(available=True)
+    products = ProductCard.objects.filter(available=True)
     
     if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
+        category = get_category(category_slug)
+        if category is None:
+            raise Http404('No category matches the given query.')
+        products = products.filter(category_id=category.id)
+
+    paginator = KeysetPaginator(products, settings.PRODUCTS_PER_PAGE)
+    page = paginator.page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
         
-    return render(request, 'shop/product/list.html', {
+    response = TemplateResponse(request, 'shop/product/list.html', {
         'category': category,
-        'categories': categories,
-        'products': products
+        'categories': get_categories(),
+        'products': page,
+        'page': page,
     })
+    return set_last_modified(response, max((p.updated for p in page), default=None))
 
+@cache_anonymous_page
 def product_detail(request, id, slug):
-    product = get_object_or_404(Product, id=id, slug=slug, available=True)
-    return render(request, 'shop/product/detail.html', {'product': product})
\ No newline at end of file
+    product = get_object_or_404(with_available_stock(Product.objects.all()), id=id, slug=slug, available=True)
+    response = TemplateResponse(request, 'shop/product/detail.html', {'product': product})
+    return set_last_modified(response, product.updated)
+
+# Async variants, served under ASGI by ecom.urls_async
+@cache_anonymous_page
+async def aproduct_list(request, category_slug=None):
+    category = None
+    products = ProductCard.objects.filter(available=True)
+    
+    if category_slug:
+        category = await aget_category(category_slug)
+        if category is None:
+            raise Http404('No category matches the given query.')
+        products = products.filter(category_id=category.id)
+
+    paginator = KeysetPaginator(products, settings.PRODUCTS_PER_PAGE)
+    page = await paginator.apage(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
+        
+    response = TemplateResponse(request, 'shop/product/list.html', {
+        'category': category,
+        'categories': await aget_categories(),
+        'products': page,
+        'page': page,
+    })
+    return set_last_modified(response, max((p.updated for p in page), default=None))
+
+@cache_anonymous_page
+async def aproduct_detail(request, id, slug):
+    product = await aget_object_or_404(
+        with_available_stock(Product.objects.all()), id=id, slug=slug, available=True
+    )
+    response = TemplateResponse(request, 'shop/product/detail.html', {'product': product})
+    return set_last_modified(response, product.updated)
+
+def product_search(request):
+    form = ProductSearchForm(request.GET)
+    query = ''
+    products = []
+    if form.is_valid() and form.cleaned_data['q'].strip():
+        query = form.cleaned_data['q'].strip()
+        category = get_category(form.cleaned_data['category'])
+        results = get_index().search(
+            query,
+            category_id=category.id if category else None,
+            min_price=form.cleaned_data['min_price'],
+            max_price=form.cleaned_data['max_price'],
+            limit=settings.SEARCH_RESULTS_LIMIT,
+        )
+        # One query for the hits, then restore the ranking order
+        found = ProductCard.objects.in_bulk([doc.id for doc, score in results])
+        products = [found[doc.id] for doc, score in results if doc.id in found]
+
+    return render(request, 'shop/product/search.html', {
+        'form': form,
+        'query': query,
+        'categories': get_categories(),
+        'products': products,
+    })
+
+def product_suggest(request):
+    """Type-ahead: answered entirely from the in-memory index."""
+    query = request.GET.get('q', '')[:200]
+    results = get_suggest_index().search(query, limit=settings.SEARCH_SUGGEST_LIMIT)
+    return JsonResponse({
+        'results': [
+            {
+                'id': doc.id,
+                'name': doc.name,
+                'price': str(doc.price),
+                'url': reverse('shop:product_detail', args=[doc.id, doc.slug]),
+            }
+            for doc, score in results
+        ]
+    })